@@ -18,6 +18,8 @@ from devices.uBase import uBase
 from utils.DataAnalysis import DataAnalysis
 from utils.TestingProcedures import (charge_linearity_scan, dark_count_scan,
                                      frontal_HV_scan, photocathode_scan)
+from utils.Planner import RunPlanner, find_timelines
+from utils.Timeline import StageTimeline
 from utils.util import setup_file_logging, signal_handle, check_config
 
 ##########################################################################################
@@ -50,6 +52,10 @@ def main():
     logging.getLogger("OMCU").info(f"--- OMCU INITIALIZING ---")
     logging.getLogger("OMCU").info(f"storing data in {DATA_PATH}")
 
+    # per point stage timing of the procedures, next to the log file
+    timeline = StageTimeline.Instance()
+    timeline.start(DATA_PATH)
+
     # copy config file to datapath
     config_path = os.path.abspath(config.__file__)
     shutil.copyfile(config_path, os.path.join((DATA_PATH), "config.py"))
@@ -58,23 +64,27 @@ def main():
     # checking config
     check_config()
 
-    # user input to confirm device setup    
-    print("\nPlease make sure that the following conditions are met before the OMCU is turned on:\n")
-    print("1.)\tThe PMT is connected to the Picoscope via the coaxial cable labeled \"Signal\" inside the OMCU.")
-    print("2.)\tThe OMCU is properly closed and the red handles are shut.")
-    print("3.)\the uBase is plugged in. (See plug to the right of the OMCU)")
-    print("4.)\tThe following devices to the right of the OMCU are turned on:")
-    print("\t\t - the Power Meter")
-    print("\t\t - the Laser Control System")
-    print("\t\t - both PSU_0 and PSU_1")
-    print("\t\t - the Picoscope")
-    print("\t\t - the Picoamp")
-    print()
-    check = input("Please confirm that the OMCU is properly set up [Yes/no]:\n>>> ")
-    if not (check.lower() == "yes" or check.lower() == "y"):
-        print("ERROR: OMCU determined as not set up by user input. Exiting program. Good bye!")
-        exit()
-    logging.getLogger("OMCU").info(f"OMCU marked as set up by user. Performing checks...")
+    # user input to confirm device setup (nothing to set up in simulation)
+    if config.SIMULATING:
+        print("\nSimulating the OMCU, no devices are used.")
+        logging.getLogger("OMCU").info(f"simulating all devices. Performing checks...")
+    else:
+        print("\nPlease make sure that the following conditions are met before the OMCU is turned on:\n")
+        print("1.)\tThe PMT is connected to the Picoscope via the coaxial cable labeled \"Signal\" inside the OMCU.")
+        print("2.)\tThe OMCU is properly closed and the red handles are shut.")
+        print("3.)\the uBase is plugged in. (See plug to the right of the OMCU)")
+        print("4.)\tThe following devices to the right of the OMCU are turned on:")
+        print("\t\t - the Power Meter")
+        print("\t\t - the Laser Control System")
+        print("\t\t - both PSU_0 and PSU_1")
+        print("\t\t - the Picoscope")
+        print("\t\t - the Picoamp")
+        print()
+        check = input("Please confirm that the OMCU is properly set up [Yes/no]:\n>>> ")
+        if not (check.lower() == "yes" or check.lower() == "y"):
+            print("ERROR: OMCU determined as not set up by user input. Exiting program. Good bye!")
+            exit()
+        logging.getLogger("OMCU").info(f"OMCU marked as set up by user. Performing checks...")
     start_time = time.time()
 
     #Turn relevant devices on
@@ -147,12 +157,13 @@ def main():
     print(f"\nOMCU turned on successfully. Entering cooldown time of {COOLDOWN_TIME} minutes before taking measurements")
     logging.getLogger("OMCU").info(f"entering cooldown time of {COOLDOWN_TIME} minutes")
     Laser.Instance().off_pulsed()
-    uBase.Instance().SetVoltage(config.COOLDOWN_HV)
-    for i in range(COOLDOWN_TIME):
-        remain = COOLDOWN_TIME - i
-        if not remain%10:
-            print(f"{remain} minutes of cooldown remaining")
-        time.sleep(60)
+    with timeline.stage("cooldown"):
+        uBase.Instance().SetVoltage(config.COOLDOWN_HV)
+        for i in range(COOLDOWN_TIME):
+            remain = COOLDOWN_TIME - i
+            if not remain%10:
+                print(f"{remain} minutes of cooldown remaining")
+            time.sleep(60)
     print("cooldown completed!")
     logging.getLogger("OMCU").info(f"cooldown completed")
 
@@ -165,12 +176,13 @@ def main():
     Laser.Instance().on_pulsed()
     print(f"\nLaser turned on. Waiting {config.LASER_SETUP_TIME} minutes for laser to warm up.")
     logging.getLogger("OMCU").info(f"entering laser setup time of {config.LASER_SETUP_TIME} minutes")
-    uBase.Instance().SetVoltage(config.COOLDOWN_HV)
-    for i in range(config.LASER_SETUP_TIME):
-        remain = config.LASER_SETUP_TIME - i
-        if not remain % 10:
-            print(f"{remain} minutes of laser startup remaining")
-        time.sleep(60)
+    with timeline.stage("laser warm-up"):
+        uBase.Instance().SetVoltage(config.COOLDOWN_HV)
+        for i in range(config.LASER_SETUP_TIME):
+            remain = config.LASER_SETUP_TIME - i
+            if not remain % 10:
+                print(f"{remain} minutes of laser startup remaining")
+            time.sleep(60)
     print("laser startup completed!")
     logging.getLogger("OMCU").info(f"laser startup completed")
 
@@ -194,17 +206,19 @@ def main():
 
     if config.ANALYSIS_PERFORM:
         print("analyzing data now")
-        analysis = DataAnalysis(DATA_PATH)
-        if config.FRONTAL_HV_SCAN:
-            analysis.analyze_FHVS()
-        if config.PHOTOCATHODE_SCAN:
-            analysis.analyze_PCS()
-        if config.CHARGE_LINEARITY_SCAN:
-            analysis.analyze_CLS()
-        if config.DARK_COUNT_SCAN:
-            analysis.analyze_DCS()
+        with timeline.stage("analysis"):
+            analysis = DataAnalysis(DATA_PATH)
+            if config.FRONTAL_HV_SCAN:
+                analysis.analyze_FHVS()
+            if config.PHOTOCATHODE_SCAN:
+                analysis.analyze_PCS()
+            if config.CHARGE_LINEARITY_SCAN:
+                analysis.analyze_CLS()
+            if config.DARK_COUNT_SCAN:
+                analysis.analyze_DCS()
 
     end_time = time.time()
+    timeline.finish()
 
     print("\nEnd of program reached, nothing to execute anymore.")
     print(f"Total execution time: {round((end_time - start_time)/60,0)} minutes")
@@ -260,6 +274,9 @@ if __name__ == "__main__":
     parser.add_argument('--config', type=str, help="path to an alternative config file, which should be used instead of the default one", action="store")
     parser.add_argument('--script', type=str, help="executes the given script instead of the main program.", action="store")
     parser.add_argument('--printconfig', help="prints the content of the given config file. Exits the program afterwards.", action="store_true")
+    parser.add_argument('--simulate', help="runs with simulated devices instead of the hardware (see SIMULATING in config.py)", action="store_true")
+    parser.add_argument('--plan', type=str, nargs="*", metavar="RUN", help="predicts duration and data size of the configured run without using any device. Exits the program afterwards. \
+                                                                         the latency models are calibrated with the timelines of the given run directories (default: the latest runs in the output path)", action="store")
     
     args = parser.parse_args()
 
@@ -308,6 +325,10 @@ if __name__ == "__main__":
     else: 
         import config
 
+    if args.simulate:
+        import config as device_config  # the config module the devices read (differs from config with --config)
+        config.SIMULATING = device_config.SIMULATING = True
+
     # config imports
     OUT_PATH    = config.OUT_PATH
     PMT_NAME    = config.PMT_NAME
@@ -323,7 +344,14 @@ if __name__ == "__main__":
         LOG_LVL = args.loglvl
     if args.pmtname:
         PMT_NAME = args.pmtname
-    if args.cooldown:
+    if args.cooldown is not None:
         COOLDOWN_TIME = args.cooldown
 
+    if args.plan is not None:
+        #if --plan is called, predicts the run from the config, then exits programm
+        planner = RunPlanner(config, cooldown_time=COOLDOWN_TIME, out_path=OUT_PATH)
+        planner.calibrate(args.plan if args.plan else find_timelines(OUT_PATH, config.TIMELINE_FILE, config.PLAN_CALIBRATION_RUNS))
+        planner.report()
+        exit(0)
+
     main()
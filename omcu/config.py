@@ -13,11 +13,95 @@ PMT_NAME  = None             # asks for name at runtime if None
 LOG_FILE  = "omcu.log"	     # name of the log file
 LOG_LVL   = 20               # logging level (10: Debug, 20: Info, 30: Warning etc...)
 
+TIMELINE_FILE         = "timeline.csv"           # duration of every stage (move, HV settling, capture, ...) of every scan point, next to the log file (None: not timed)
+TIMELINE_SUMMARY_FILE = "timeline_summary.json"  # where the run time went, per procedure and stage (None: only logged)
+
 COOLDOWN_TIME     = 6*60    # Time in minutes before any measurements take place
 COOLDOWN_HV       = 85
 
 LASER_SETUP_TIME  = 120      # Time to wait after the laser is turned on (usually after DCS)
 
+SERIAL_FIXED_DELAY  = False  # sleep the fixed device delay after every serial write (legacy). otherwise replies are read as soon as they arrive
+
+DEVICE_CACHE_TTL    = 60     # s, parameters only changed by this software (laser tune, frequency, ...) are served from cache (0: always query)
+DEVICE_CACHE_TTL_PER_PARAMETER = {"Laser.ld": 5}  # TTL overrides as "<Device>.<parameter>": s (e.g. emission state can be changed by the interlock)
+
+# simulation (--simulate): laser, rotation stage, uBase, powermeter, picoamp, PSUs (devices/sim_setup.py) and the Picoscope
+# (devices/sim_picoscope.py, see PICOSCOPE_SIM_*) are simulated, no hardware needed
+
+SIMULATING          = False
+SIM_REALTIME        = True   # device replies, stage moves and HV ramps take their modelled time (False: replies at once)
+
+# rotation stage (utils/MotionPlanner.py)
+
+ROTATION_REHOME_INTERVAL  = 20      # home an axis every n-th move, in between move relative to the last position (1: home before every move)
+ROTATION_STEPS_PER_TURN   = 5000    # steps of the stepper axes per 360°
+ROTATION_SPEED_UNIT       = 1e-6    # s per unit of Rotation.get_speed() (step delay in µs, see Rotation.set_speed)
+ROTATION_STEP_DELAY       = 1e-3    # s per step, used for the motion model if the stage cannot be queried
+ROTATION_MOVE_OVERHEAD    = 0.1     # s per move within a motion session (1.4 s if the PSU is switched for every move)
+ROTATION_HOMING_OVERHEAD  = 1.0     # s additional per homing (reference switch search)
+ROTATION_SESSION_IDLE_TIMEOUT = 120 # s, steppers are turned off if no move happened within a motion session for this long (safety)
+
+# HV settling (utils/Settling.py)
+
+UBASE_SETTLE_TOLERANCE       = 0.1   # V, Dy10 readback has to be stable within this band around the set value
+UBASE_SETTLE_TIMEOUT         = 65    # s, max wait for the HV to settle
+UBASE_SETTLE_SAMPLE_INTERVAL = 0.2   # s between Dy10 readings
+UBASE_SETTLE_WINDOW          = 5     # nr of readings judged for stability (mean, spread, slope)
+
+# tuning (utils/Tuning.py)
+
+TUNE_MODEL_FILE     = "tuning_model.json"  # measurements of earlier tunings in OUT_PATH, seed the tuning models (None: do not keep)
+TUNE_MODEL_HISTORY  = 200                  # nr of measurements kept per model
+TUNE_GAIN_EXPONENT  = 7.0                  # exponent k of gain ~ Dy10^k, until the gain model is fitted to the PMT
+TUNE_GAIN_MAX_JUMP  = 10                   # V, max HV change per gain tuning step
+TUNE_SEQUENTIAL     = True                 # tuning captures stop early once occupancy / gain are decided (TUNE_NR_OF_WAVEFORMS is the maximum)
+TUNE_GAIN_WARM_START = None                # previous frontal HV scan file of this PMT (e.g. OUT_PATH/<pmt>/data_frontal_HV_scan.hdf5) to start the gain model from
+
+# sequential measurements (Picoscope.sequential_measurement)
+
+SEQUENTIAL_CHUNK_SIZE  = 10000  # nr of waveforms per chunk, the same for every chunk (the scope is only set up once)
+SEQUENTIAL_CONFIDENCE  = 0.99   # confidence of the stopping decisions (stricter than a single test, data is looked at after every chunk)
+SEQUENTIAL_MIN_SIGNALS = 1000   # min nr of signal waveforms before a gain decision (the gain fit is biased below ~500 signals, ~1 % spread at 1000)
+
+PIPELINE_QUEUE_SIZE = 2      # captured datasets that may wait for analysis/writing in the background while the next point is measured (0: run in series)
+
+# data storage
+
+STORE_RAW_ADC     = False    # store waveforms as raw int16 ADC codes (+ range and max adc as attributes) instead of float32 mV
+PICOSCOPE_STORE_TRIGGER_TRACE = False  # debug: keep and store the full trigger trace, not only the trigger time of every waveform
+PICOSCOPE_CHUNK_SIZE          = 100000 # nr of waveforms per block capture when reading out large measurements in chunks
+
+# run planning (omcu --plan, utils/Planner.py): duration and data size of the configured run are predicted with latency
+# models of the stages. the models start from these priors and are calibrated with the stage timelines (TIMELINE_FILE)
+# and data files of earlier runs
+
+PLAN_CALIBRATION_RUNS     = 5       # nr of the latest runs in OUT_PATH used for the calibration (if no runs are given to --plan)
+PLAN_TRIGGER_RATE         = 10000   # Hz, laser pulse rate (capture time of block measurements)
+PLAN_TRANSFER_RATE        = 200e6   # bytes/s from the Picoscope to the PC
+PLAN_PROCESSING_TIME      = 1e-7    # s per sample for analysis and writing of a dataset in the background
+PLAN_HV_RAMP_RATE         = 2       # V/s, Dy10 ramp of the uBase
+PLAN_COMPRESSION          = 0.8     # size of the stored waveforms relative to the uncompressed captured ones (compression and filtering), until calibrated
+PLAN_PROCEDURE_OVERHEAD   = 30      # s per procedure for laser on/off, homing and opening files
+PLAN_SETUP_OVERHEAD       = 60      # s for connecting and checking the devices at the start of the run
+
+# Picoscope backend
+
+PICOSCOPE_BACKEND           = "ps6000a"  # "ps6000a" (6424E via picosdk) or "simulation" (devices/sim_picoscope.py, no hardware needed)
+
+# simulated Picoscope
+PICOSCOPE_SIM_OCCUPANCY     = 0.1      # fraction of waveforms with at least one photoelectron
+PICOSCOPE_SIM_GAIN          = 5e6
+PICOSCOPE_SIM_GAIN_SPREAD   = 0.3      # relative sigma of the SPE charge
+PICOSCOPE_SIM_TRANSIT_TIME  = 200      # ns after the trigger edge (inside WaveformBatch.expected_tt_min/max)
+PICOSCOPE_SIM_TTS           = 1.5      # ns, sigma of the transit time
+PICOSCOPE_SIM_NOISE         = 0.6      # mV, sigma of the baseline noise
+PICOSCOPE_SIM_DARK_RATE     = 1000     # Hz
+PICOSCOPE_SIM_TRIGGER_RATE  = 10000    # Hz, laser pulse rate (capture time of block measurements)
+PICOSCOPE_SIM_TRANSFER_RATE = 200e6    # bytes/s from the scope to the PC
+PICOSCOPE_SIM_REALTIME      = True     # sleep the modelled capture and transfer time (False: as fast as the simulation runs)
+PICOSCOPE_SIM_SEED          = None     # seed of the waveform generator (None: random)
+
 
 #------------------------------------------------------
 
@@ -35,6 +119,22 @@ DARK_COUNT_SCAN       = False
 ANALYSIS_PERFORM    = True     # perform data analysis after datataking
 ANALYSIS_SHOW_PLOTS = False     # call plt.show()
 
+# streaming analysis (utils/Statistics.py) of large datasets in chunks
+
+ANALYSIS_CHUNK_SIZE             = 100000                 # nr of waveforms read from file at once when recalculating metadicts
+
+# fixed binning (min, max, nr of bins) of the mergeable histograms. the ranges cover the scanned HVs (gain of about
+# 5e7 at 119 V, FHVS_HV_LIST) and the multi photoelectron pulses of the charge linearity scan. the bins are much finer
+# than the fits need, the filled range is rebinned to about 500 bins (utils.Statistics.Histogram.rebinned)
+ANALYSIS_BINNING_AMPLITUDE      = (-2000,    0,     200000) # mV
+ANALYSIS_BINNING_CHARGE         = (-200e-12, 5e-12, 205000) # C
+ANALYSIS_BINNING_GAIN           = (0,        2e8,   200000)
+ANALYSIS_BINNING_TRANSIT_TIME   = (0,        300,   300000) # ns
+ANALYSIS_BINNING_RISE_TIME      = (0,        50,    10000)  # ns
+ANALYSIS_BINNING_PTV            = (0,        1000,  100000)
+ANALYSIS_MAX_OUT_OF_RANGE       = 0.01                      # max fraction of the values outside of the binning, the fit is invalid above
+ANALYSIS_MAX_OUT_OF_RANGE_COUNT = 10                        # nr of values outside of the binning that are always accepted (outliers of small datasets)
+
 # what to plot
 
 ANALYSIS_PLOT_WFS                        = False
@@ -79,7 +179,7 @@ PCS_DATAFILE      = "data_photocathode_scan.hdf5"
 # tune
 
 PCS_TUNE_MODE     = "iter"      # (none, iter, single, only_gain, only_occ)
-PCS_TUNE_MAX_ITER = 15          # max iters for iter tune mode
+PCS_TUNE_MAX_ITER = 15          # max nr of captures for tuning
 
 # gain tune
 PCS_TUNE_GAIN_MIN    = 4.9e6
@@ -91,7 +191,7 @@ PCS_TUNE_V_STEP      = 1
 PCS_TUNE_OCC_MIN        = 0.09
 PCS_TUNE_OCC_MAX        = 0.10
 PCS_TUNE_LASER_START    = 710      # will start at current laser tune if None
-PCS_TUNE_LASER_STEP     = 1
+PCS_TUNE_LASER_STEP     = 1        # first step while the occupancy model can not predict yet (doubles until bracketed)
 
 PCS_TUNE_NR_OF_WAVEFORMS  =  100000
 PCS_TUNE_SIGNAL_THRESHOLD = -3.5
@@ -107,6 +207,14 @@ PCS_MEASUREMENT_SLEEP   =  1                      # Time in seconds that are wai
 
 PCS_FILTER_DATASET      = True                    # determines if dataset should be filtered by signal threshold before writing to disk
 
+# adaptive nr of waveforms per point (utils/AdaptiveSampling.py), estimated from the occupancy of the neighbouring points.
+# PCS_NR_OF_WAVEFORMS is used until neighbours are analysed. all targets None: fixed PCS_NR_OF_WAVEFORMS
+PCS_TARGET_SIGNALS      = None                    # nr of signal waveforms per point
+PCS_TARGET_GAIN_ERROR   = None                    # relative statistical error of the mean gain (e.g. 0.005)
+PCS_TARGET_TTS_ERROR    = None                    # relative statistical error of the transit time spread (e.g. 0.02)
+PCS_MIN_NR_OF_WAVEFORMS = 10000
+PCS_MAX_NR_OF_WAVEFORMS = 1000000
+
 
 #------------------------------------------------------
 #--------------   FRONTAL HV SCAN     -----------------
@@ -121,7 +229,7 @@ FHVS_DATAFILE      = "data_frontal_HV.hdf5"
 # tune
 
 FHVS_TUNE_MODE     = "only_occ"      # (none, iter, single, only_gain, only_occ)
-FHVS_TUNE_MAX_ITER = 15              # max iters for iter tune mode
+FHVS_TUNE_MAX_ITER = 15              # max nr of captures for tuning
 
 # gain tune
 FHVS_TUNE_GAIN_MIN    = None
@@ -148,6 +256,14 @@ FHVS_MEASUREMENT_SLEEP   =  1                     # Time in seconds that are wai
 
 FHVS_FILTER_DATASET      = True                   # determines if dataset should be filtered by signal threshold before writing to disk
 
+# adaptive nr of waveforms per point (utils/AdaptiveSampling.py), estimated from the occupancy of the neighbouring points.
+# FHVS_NR_OF_WAVEFORMS is used until neighbours are analysed. all targets None: fixed FHVS_NR_OF_WAVEFORMS
+FHVS_TARGET_SIGNALS      = None                   # nr of signal waveforms per point
+FHVS_TARGET_GAIN_ERROR   = None                   # relative statistical error of the mean gain (e.g. 0.005)
+FHVS_TARGET_TTS_ERROR    = None                   # relative statistical error of the transit time spread (e.g. 0.02)
+FHVS_MIN_NR_OF_WAVEFORMS = 10000
+FHVS_MAX_NR_OF_WAVEFORMS = 1000000
+
 
 #------------------------------------------------------
 #-----------   CHARGE LINEARITY SCAN     --------------
@@ -162,7 +278,7 @@ CLS_DATAFILE      = "data_linearity.hdf5"
 # tune
 
 CLS_TUNE_MODE     = "iter"      # (none, iter, single, only_gain, only_occ)
-CLS_TUNE_MAX_ITER = 15          # max iters for iter tune mode
+CLS_TUNE_MAX_ITER = 15          # max nr of captures for tuning
 
 # gain tune
 CLS_TUNE_GAIN_MIN    = 4.9e6
@@ -189,6 +305,14 @@ CLS_MEASUREMENT_SLEEP   =  60                    # Time in seconds that are wait
 
 CLS_FILTER_DATASET      = True                   # determines if dataset should be filtered by signal threshold before writing to disk
 
+# adaptive nr of waveforms per point (utils/AdaptiveSampling.py), estimated from the occupancy of the neighbouring points.
+# CLS_NR_OF_WAVEFORMS is used until neighbours are analysed. all targets None: fixed CLS_NR_OF_WAVEFORMS
+CLS_TARGET_SIGNALS      = None                   # nr of signal waveforms per point
+CLS_TARGET_GAIN_ERROR   = None                   # relative statistical error of the mean gain (e.g. 0.005)
+CLS_TARGET_TTS_ERROR    = None                   # relative statistical error of the transit time spread (e.g. 0.02)
+CLS_MIN_NR_OF_WAVEFORMS = 10000
+CLS_MAX_NR_OF_WAVEFORMS = 1000000
+
 
 #------------------------------------------------------
 #-------------    DARK COUNT SCAN      ----------------
@@ -1,5 +1,5 @@
 #!/usr/bin/python3
-from devices.device import serial_device
+from devices.device import cached_parameter, serial_device
 
 
 class Laser(serial_device):
@@ -51,7 +51,7 @@ class Laser(serial_device):
         ext. frequency:	         0 Hz
         trigger level:	     +0.00 V
         """
-        s = self.serial_io('state?', multi_line=True)
+        s = self.serial_io('state?', multi_line=True, end_marker="trigger level")
         print(f"requested laser state:\n{s}")
 
     def on_pulsed(self):
@@ -61,7 +61,7 @@ class Laser(serial_device):
         """
         self.serial_io('ld=1')  # enables pulsed laser emission
         self.logger.info("turning pulsed laser emission on")
-        return self.get_ld()
+        return self.get_ld(refresh=True)
 
     def off_pulsed(self):
         """
@@ -70,8 +70,9 @@ class Laser(serial_device):
         """
         self.serial_io('ld=0')  # disables pulsed laser emission
         self.logger.info("turning pulsed laser emission off")
-        return self.get_ld()
+        return self.get_ld(refresh=True)
 
+    @cached_parameter("ld")
     def get_ld(self):
         """
         This is a function to get information about the pulsed laser emission state
@@ -97,8 +98,9 @@ class Laser(serial_device):
         """
         self.serial_io(f'te={te}', line_ending='\n')  # sets trigger edge to te (falling 0, rising 1)
         self.logger.info(f"setting laser trigger edge to {te}")
-        return self.get_trig_edge()
+        return self.get_trig_edge(refresh=True)
 
+    @cached_parameter("trigger edge")
     def get_trig_edge(self):
         """
         This is a function to get information about the set trigger edge
@@ -125,8 +127,9 @@ class Laser(serial_device):
         self.serial_io(f'ts={ts}', line_ending='\n')  # sets trigger source to ts
         self.logger.info(f"setting laser trigger source to {ts}")
         # (internal 0, ext. adj. 1, ext. TTL 2)
-        return self.get_trig_source()
+        return self.get_trig_source(refresh=True)
 
+    @cached_parameter("trigger source")
     def get_trig_source(self):
         """
         This is a function to get information about the set trigger source
@@ -154,8 +157,9 @@ class Laser(serial_device):
         """
         self.serial_io(f'tl={tl}', line_ending='\n')  # sets trigger level to tl (-4800...+4800 mV)
         self.logger.info(f"setting laser trigger level to {tl}")
-        return self.get_trig_level()
+        return self.get_trig_level(refresh=True)
 
+    @cached_parameter("trigger level")
     def get_trig_level(self):
         """
         This is a function to get information about the set trigger level
@@ -176,8 +180,9 @@ class Laser(serial_device):
         """
         self.serial_io(f'tm={tm}', line_ending='\n')  # sets tune mode to tm (manual 0, auto 1)
         self.logger.info(f"setting laser tune mode to {tm}")
-        return self.get_tune_mode()
+        return self.get_tune_mode(refresh=True)
 
+    @cached_parameter("tune mode")
     def get_tune_mode(self):
         """
         This is a function to get information about the set tune mode
@@ -203,11 +208,12 @@ class Laser(serial_device):
         :return: float: tune value (0...1000, where 1000=100 %)
         """
         self.serial_io('tm=0')  # sets tune mode to manual
-        tune_mode_0 = self.get_tune_mode()
+        tune_mode_0 = self.get_tune_mode(refresh=True)
         self.serial_io(f'tune={tune}', line_ending='\n') # sets tune value to tune (0...1000, where 1000=100 %)
         self.logger.info(f"setting tune value to {tune}")
-        return self.get_tune_value()
+        return self.get_tune_value(refresh=True)
 
+    @cached_parameter("tune value")
     def get_tune_value(self):
         """
         This is a function to get information about the set tune value
@@ -228,8 +234,9 @@ class Laser(serial_device):
         """
         self.serial_io(f'f={f}', line_ending='\n')  # sets frequency to f (25...125000000)
         self.logger.info(f"set internal oscillator frequency to {f}")
-        return self.get_freq()
+        return self.get_freq(refresh=True)
 
+    @cached_parameter("frequency")
     def get_freq(self):
         """
         This is a function to get information about the set frequency
@@ -250,8 +257,9 @@ class Laser(serial_device):
         """
         self.serial_io(f'cwl={cwl}', line_ending='\n')  # sets CW laser output power (0...100)
         self.logger.info(f"set CW laser output power value to {cwl}")
-        return self.get_cwl()
+        return self.get_cwl(refresh=True)
 
+    @cached_parameter("cw power")
     def get_cwl(self):
         """
         This is a function to get information about the CW laser output power value
@@ -271,7 +279,7 @@ class Laser(serial_device):
         """
         self.serial_io('cw=1')  # enables CW laser emission
         self.logger.info("enable the CW laser emission")
-        return self.get_cw()
+        return self.get_cw(refresh=True)
 
     def off_cw(self):
         """
@@ -280,8 +288,9 @@ class Laser(serial_device):
         """
         self.serial_io('cw=0')  # disables CW laser emission
         self.logger.info("disable the CW laser emission")
-        return self.get_cw()
+        return self.get_cw(refresh=True)
 
+    @cached_parameter("cw")
     def get_cw(self):
         """
         This is a function to get information about the CW laser emission state
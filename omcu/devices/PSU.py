@@ -1,28 +1,37 @@
 #!/usr/bin/python3
 import time
 
-import gpd3303s
+import config
 from devices.device import device
 
 
-class PSU(device, gpd3303s.GPD3303S):
+class PSU(device):
 
     """
     This class makes an instance for the USB power supply.
     It is important that the udev rules allow access to the current user.
     """
 
-    def __init__(self, dev):
+    def __init__(self, dev, simulating=False):
         """
         This is the init function for the power supply device
         :param dev: device path, use: dev="/dev/PSU_0" or dev="/dev/PSU_1"
+        :param simulating: use the simulated supply of devices.sim_setup (also if config.SIMULATING)
         """
-        #super() has problems due to multiple inherits
-        device.__init__(self)
-        gpd3303s.GPD3303S.__init__(self)
+        super().__init__()
         self.state = False
-        self.open(dev)
-        self.enableOutput(False)
+        self.simulating = simulating or config.SIMULATING
+
+        # the commands go to the gpd3303s driver, or to the simulated supply with the same methods.
+        # the driver is only imported for the hardware, offline runs do not need the package
+        if self.simulating:
+            from devices.sim_setup import sim_setup
+            self.driver = sim_setup.Instance().device(dev)
+        else:
+            import gpd3303s
+            self.driver = gpd3303s.GPD3303S()
+        self.driver.open(dev)
+        self.driver.enableOutput(False)
         self.settings(1, 12.0, 2.0)
         self.settings(2, 3.6, 0.1)
 
@@ -34,19 +43,19 @@ class PSU(device, gpd3303s.GPD3303S):
         :param current: float, default 0.1 A
         :return: boolean (state)
         """
-        self.setVoltage(channel, voltage)
-        self.setCurrent(channel, current)
+        self.driver.setVoltage(channel, voltage)
+        self.driver.setCurrent(channel, current)
         self.logger.info(f"set settings. ch: {channel}, voltage: {voltage}, current: {current}")
         return self.state
 
     def on(self):
-        self.enableOutput(True)
+        self.driver.enableOutput(True)
         self.state = True
         self.logger.info("turned on")
         time.sleep(1)
 
     def off(self):
-        self.enableOutput(False)
+        self.driver.enableOutput(False)
         self.logger.info("turned off")
         self.state = False
 
@@ -67,14 +76,14 @@ class PSU0(PSU):
             cls._instance = PSU0()
         return cls._instance
 
-    def __init__(self, dev="/dev/PSU_0"):
+    def __init__(self, dev="/dev/PSU_0", simulating=False):
 
         if PSU0._instance:
             raise Exception(f"ERROR: {str(type(self))} has already been initialized. please call with {str(type(self).__name__)}.Instance()")
         else:
             PSU0._instance = self
 
-        super().__init__(dev)
+        super().__init__(dev, simulating=simulating)
         #self.state = False
         #self.open(dev)
         #self.enableOutput(False)
@@ -97,14 +106,14 @@ class PSU1(PSU):
             cls._instance = PSU1()
         return cls._instance
 
-    def __init__(self, dev="/dev/PSU_1"):
+    def __init__(self, dev="/dev/PSU_1", simulating=False):
 
         if PSU1._instance:
             raise Exception(f"ERROR: {str(type(self))} has already been initialized. please call with {str(type(self).__name__)}.Instance()")
         else:
             PSU1._instance = self
 
-        super().__init__(dev)
+        super().__init__(dev, simulating=simulating)
         #self.state = False
         #self.open(dev)
         #self.enableOutput(False)
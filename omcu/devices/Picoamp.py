@@ -13,20 +13,23 @@ class Picoamp(serial_device):
 
     _instance = None
 
+    # READ? replies after all ARM:COUN measurements are taken
+    command_timeouts = {"READ?": 60, "*RST": 5}
+
     @classmethod
     def Instance(cls):
         if not cls._instance:
             cls._instance = Picoamp()
         return cls._instance
 
-    def __init__(self, dev="/dev/Picoamp"):
+    def __init__(self, dev="/dev/Picoamp", simulating=False):
 
         if Picoamp._instance:
             raise Exception(f"ERROR: {str(type(self))} has already been initialized. please call with {str(type(self).__name__)}.Instance()")
         else:
             Picoamp._instance = self
 
-        super().__init__(dev=dev)
+        super().__init__(dev=dev, simulating=simulating)
 
         startup = ['*RST', 'SENS:CURR:RANG:AUTO ON', 'SENS2:CURR:RANG:AUTO ON', 'SYST:AZER ON', 'SYST:AZER OFF']
         for i in startup:
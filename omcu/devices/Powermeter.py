@@ -1,5 +1,5 @@
 #!/usr/bin/python3
-from devices.device import serial_device
+from devices.device import cached_parameter, serial_device
 
 
 class Powermeter(serial_device):
@@ -48,8 +48,9 @@ class Powermeter(serial_device):
 
         self.serial_io(f'ECHO {state}')
         self.logger.info(f"set echo to {state}")
-        return self.get_echo()
+        return self.get_echo(refresh=True)
 
+    @cached_parameter("echo")
     def get_echo(self):
         """
         This is a function to get information about the echo set
@@ -69,8 +70,9 @@ class Powermeter(serial_device):
         """
         self.serial_io(f'PM:L {lamb}')
         self.logger.info(f"set lambda to {lamb}")
-        return self.get_lambda()
+        return self.get_lambda(refresh=True)
 
+    @cached_parameter("lambda")
     def get_lambda(self):
         """
         This is a function to get information about the selected wavelength
@@ -89,8 +91,9 @@ class Powermeter(serial_device):
         """
         self.serial_io(f'PM:CHAN {ch}')  # power meter channel
         self.logger.info(f"set channel to {ch}")
-        return self.get_channel()
+        return self.get_channel(refresh=True)
 
+    @cached_parameter("channel")
     def get_channel(self):
         """
         This is a function to get information about the selected power meter channel
@@ -111,8 +114,9 @@ class Powermeter(serial_device):
         """
         self.serial_io(f'PM:DS:BUF {buf}')  # buffer behavior
         self.logger.info(f"set buffer to {buf}")
-        return self.get_buffer()
+        return self.get_buffer(refresh=True)
 
+    @cached_parameter("buffer")
     def get_buffer(self):
         """
         This is a function to get information about the selected buffer behavior
@@ -179,7 +183,7 @@ class Powermeter(serial_device):
                 looks something like this: [-1.295755E-011, -1.295711E-011, -1.295667E-011, -1.295623E-011]
 
         """
-        s = self.serial_io(f'PM:DS:GET? {num}', multi_line=True)  # returns a number of measurements collected
+        s = self.serial_io(f'PM:DS:GET? {num}', multi_line=True, end_marker="End of Data")  # returns a number of measurements collected
 
         # print(s)    # prints something like this:
                     # Detector SN: 2003
@@ -230,8 +234,9 @@ class Powermeter(serial_device):
         """
         self.serial_io(f'PM:DS:INT {intv}')  # selects the Data Store Interval
         self.logger.info(f"set inerval to {intv}")
-        return self.get_interval()
+        return self.get_interval(refresh=True)
 
+    @cached_parameter("interval")
     def get_interval(self):
         """
         This is a function to get information about the selected Data Store Interval
@@ -257,8 +262,9 @@ class Powermeter(serial_device):
         """
         self.serial_io(f'PM:MODE {mode}')  # selects the acquisition mode
         self.logger.info(f"set mode to {mode}")
-        return self.get_mode()
+        return self.get_mode(refresh=True)
 
+    @cached_parameter("mode")
     def get_mode(self):
         """
         This is a function to get the present acquisition mode
@@ -1,7 +1,10 @@
 #!/usr/bin/python3
+import contextlib
+import threading
 import time
 
-from devices.device import serial_device
+import config
+from devices.device import cached_parameter, serial_device
 from devices.PSU import PSU1
 
 
@@ -13,40 +16,103 @@ class Rotation(serial_device):
 
     _instance = None
 
+    # moves reply only once the stage arrived
+    command_timeouts = {"goHome": 300, "goX": 300, "goY": 300}
+
     @classmethod
     def Instance(cls):
         if not cls._instance:
             cls._instance = Rotation()
         return cls._instance
 
-    def __init__(self, dev="/dev/Rotation",  delay=0.1):
+    def __init__(self, dev="/dev/Rotation", simulating=False, delay=0.1):
 
         if Rotation._instance:
             raise Exception(f"ERROR: {str(type(self))} has already been initialized. please call with {str(type(self).__name__)}.Instance()")
         else:
             Rotation._instance = self
 
-        super().__init__(dev, delay=delay)
+        super().__init__(dev, simulating=simulating, delay=delay)
 
         # somehow the first i/o on the RS is always buggy. Send dummy message to avoid bugs
         self.serial_io(' ')
         self.current_theta = None
         self.current_phi   = None
+
+        # moves per axis since the last homing. axes are homed again after config.ROTATION_REHOME_INTERVAL moves
+        self.moves_since_home = {"phi": 0, "theta": 0}
+
+        # motion session state, see motion_session()
+        self.session_depth     = 0
+        self.idle_timeout      = None
+        self.idle_timer        = None
+        self.last_move_time    = 0
         self.go_home()
 
+    @contextlib.contextmanager
+    def motion_session(self, idle_timeout=None):
+        """
+        Keeps the steppers (PSU1) powered for a sequence of moves instead of power cycling them for every move,
+        which costs >1.2 s each (PSU1.on() blocks 1 s). For safety, the power is turned off if no move happened
+        for idle_timeout seconds (default: config.ROTATION_SESSION_IDLE_TIMEOUT) and turned on again on the next move.
+        Sessions can be nested, the outermost one turns the power off at its end.
+        :param idle_timeout: Float, seconds
+        """
+        with self.lock:
+            if not self.session_depth:
+                self.idle_timeout = idle_timeout if idle_timeout is not None else config.ROTATION_SESSION_IDLE_TIMEOUT
+            self.session_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.session_depth -= 1
+                if not self.session_depth:
+                    if self.idle_timer: self.idle_timer.cancel()
+                    self.idle_timer = None
+                    if PSU1.Instance().is_on():
+                        time.sleep(0.2)
+                        PSU1.Instance().off()
+
+    def _begin_move(self):
+        # powers the steppers, if not done yet by a motion session
+        if not PSU1.Instance().is_on():
+            PSU1.Instance().on()
+
+    def _end_move(self):
+        # outside of a motion session the power is turned off after every move
+        self.last_move_time = time.monotonic()
+        if not self.session_depth:
+            time.sleep(0.2)
+            PSU1.Instance().off()
+            return
+        if self.idle_timer: self.idle_timer.cancel()
+        self.idle_timer = threading.Timer(self.idle_timeout, self._idle_off)
+        self.idle_timer.daemon = True
+        self.idle_timer.start()
+
+    def _idle_off(self):
+        with self.lock:
+            # a move may have happened while waiting for the lock
+            if not self.session_depth or time.monotonic() - self.last_move_time < self.idle_timeout: return
+            if PSU1.Instance().is_on():
+                self.logger.info(f"no move for {self.idle_timeout} s, turning off the steppers")
+                PSU1.Instance().off()
+
     def go_home(self):
         """
         Sends the Rotation stage to its home position (0,0).
         """
-        PSU1.Instance().on()
-        self.logger.info(f"returning to home position")
-        hpY = self.serial_io(f'goHomeY', wait_for=": ").split(':')[1]
-        hpX = self.serial_io(f'goHomeX', wait_for=": ").split(':')[1]
-        time.sleep(0.2)
-        PSU1.Instance().off()
-        self.current_phi   = 0
-        self.current_theta = 0
-        return [float(hpY), float(hpX)]
+        with self.lock:
+            self._begin_move()
+            self.logger.info(f"returning to home position")
+            hpY = self.serial_io(f'goHomeY', wait_for=": ").split(':')[1]
+            hpX = self.serial_io(f'goHomeX', wait_for=": ").split(':')[1]
+            self._end_move()
+            self.current_phi   = 0
+            self.current_theta = 0
+            self.moves_since_home = {"phi": 0, "theta": 0}
+            return [float(hpY), float(hpX)]
 
     def set_position(self, phi, theta):
         """
@@ -64,50 +130,68 @@ class Rotation(serial_device):
         posX = self.serial_io(f'getPositionX', wait_for=": ").split(':')[1]
         return [float(posY), float(posX)]
 
+    def needs_homing(self, axis):
+        """
+        True if the axis has to be homed before the next move: position unknown,
+        or config.ROTATION_REHOME_INTERVAL moves since the last homing (bounds the drift of the relative moves)
+        """
+        current = self.current_phi if axis == "phi" else self.current_theta
+        return current is None or self.moves_since_home[axis] + 1 >= config.ROTATION_REHOME_INTERVAL
+
     def set_phi(self, phi):
         """
-        Controls the upper stepper.
+        Controls the upper stepper. Moves directly from the current position, homing only if needs_homing().
         :param phi: Float (0-360 in 5000 steps)
         """
 
         if self.current_phi == phi:
             return float(self.serial_io(f'getPositionY', wait_for=": ").split(':')[1])
 
-        PSU1.Instance().on()
-        self.current_phi = phi
-        self.logger.info(f"rotating to phi: {phi}")
-        self.serial_io(f'goHomeY', wait_for=": ")
-        phi_pos = self.serial_io(f'goY {phi}', wait_for=": ").split(':')[1]
-        time.sleep(0.2)
-        PSU1.Instance().off()
+        with self.lock:
+            self._begin_move()
+            self.logger.info(f"rotating to phi: {phi}")
+            if self.needs_homing("phi"):
+                self.serial_io(f'goHomeY', wait_for=": ")
+                self.moves_since_home["phi"] = 0
+            else:
+                self.moves_since_home["phi"] += 1
+            self.current_phi = phi
+            phi_pos = self.serial_io(f'goY {phi}', wait_for=": ").split(':')[1]
+            self._end_move()
         return float(phi_pos)
 
     def set_theta(self, theta):
         """
-        Controls the lower stepper.
+        Controls the lower stepper. Moves directly from the current position, homing only if needs_homing().
         :param theta: Float (0-360 in 5000 steps)
         """
 
         if self.current_theta == theta:
             return float(self.serial_io(f'getPositionX', wait_for=": ").split(':')[1])
 
-        PSU1.Instance().on()
-        self.current_theta = theta
-        self.logger.info(f"rotating to theta: {theta}")
-        self.serial_io(f'goHomeX', wait_for=": ")
-        theta_pos = self.serial_io(f'goX {theta}', wait_for=": ").split(':')[1]
-        time.sleep(0.2)
-        PSU1.Instance().off()
+        with self.lock:
+            self._begin_move()
+            self.logger.info(f"rotating to theta: {theta}")
+            if self.needs_homing("theta"):
+                self.serial_io(f'goHomeX', wait_for=": ")
+                self.moves_since_home["theta"] = 0
+            else:
+                self.moves_since_home["theta"] += 1
+            self.current_theta = theta
+            theta_pos = self.serial_io(f'goX {theta}', wait_for=": ").split(':')[1]
+            self._end_move()
         return float(theta_pos) / 5000. * 360 #conversion between steps and degree 360deg = 5000 steps
 
     def set_speed(self, speed):
         """
-        sets the delay time in-between single steps in milliseconds. Minimum value is 300.
+        sets the delay time in-between single steps in microseconds. Minimum value is 300.
+        The firmware waits with delayMicroseconds(), which is only accurate up to 16383 and overflows above 32767.
         :param speed: Float (0-360 in 5000 steps)
         """
         self.logger.info(f"setting rotation speed to {speed}")
         speed_str = self.serial_io(f'setspeed {speed}', wait_for=": ").split(':')[1]
         speed_val = float(speed_str)
+        self.invalidate_cache("speed")
         if speed_val > 16383:
             self.logger.warning(f"speed {speed_val} too high, the delay might be not accurate anymore.")
             print('the delay might be not accurate anymore.')
@@ -116,9 +200,10 @@ class Rotation(serial_device):
             print('delaytime to large for int. Will produce very short delays')
         return speed_val
 
+    @cached_parameter("speed")
     def get_speed(self):
         """
-        Returns the delay time in-between single steps in milliseconds. Minimum value is 300.
+        Returns the delay time in-between single steps in microseconds (config.ROTATION_SPEED_UNIT). Minimum value is 300.
         """
         speed_str = self.serial_io('getspeed', wait_for=": ").split(':')[1]
         speed_val = float(speed_str)
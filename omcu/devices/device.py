@@ -1,11 +1,32 @@
 #!/usr/bin/python3
+import functools
 import logging
+import threading
 import time
 
+import config
+
 from devices.sim_serial import sim_serial #self written stuff to simulate a serial port
 from serial import Serial, PARITY_NONE, STOPBITS_ONE, EIGHTBITS # the python serial package
 
 
+def cached_parameter(name, ttl=None):
+
+    """
+    Decorator for getters of parameters that only this software changes (tune value, frequency, ...).
+    The value is served from the device cache within its TTL: ttl, else config.DEVICE_CACHE_TTL_PER_PARAMETER["<Device>.<name>"],
+    else config.DEVICE_CACHE_TTL. getter(refresh=True) always queries the device (used by the setters for their readback,
+    which keeps the cache written through). Measured quantities (temperature, power, voltage) must not be cached.
+    """
+
+    def decorator(getter):
+        @functools.wraps(getter)
+        def wrapper(self, refresh=False):
+            return self.cached(name, lambda: getter(self), refresh=refresh, ttl=ttl)
+        return wrapper
+    return decorator
+
+
 class device:
 
     """
@@ -23,6 +44,11 @@ class serial_device(device):
     Masterclass for serial devices
     """
 
+    # latency budgets in s: reply deadline of commands starting with the given prefix. set by the devices
+    command_timeouts = {}
+    default_timeout  = 2   # s, for all other commands
+    idle_timeout     = 0.5 # s of silence that ends a multi_line reply without end marker
+
     def __init__(self, dev, simulating=False, delay=0.1):
         
         """
@@ -33,7 +59,14 @@ class serial_device(device):
         super().__init__()
 
         self.delay = delay
-        self.simulating = simulating
+        self.simulating = simulating or config.SIMULATING
+
+        # one lock per device: serial transactions of different devices may run in parallel (see utils.Snapshot),
+        # transactions on the same port never interleave. reentrant, so composite queries can hold it as well
+        self.lock = threading.RLock()
+
+        # parameter name -> (value, time of query), see cached_parameter
+        self._parameter_cache = {}
 
         baudrate_dict = {
             "/dev/Laser_control" : 19200,
@@ -45,7 +78,7 @@ class serial_device(device):
         assert dev in baudrate_dict
         
         # select if serial or sim_serial
-        if simulating:
+        if self.simulating:
             serial_connection = sim_serial
             self.delay = .01  # set default delay
         else:
@@ -61,29 +94,65 @@ class serial_device(device):
                                         timeout=2
                                         )
 
+    def cached(self, name, query, refresh=False, ttl=None):
+
+        """
+        returns the cached value of parameter name if younger than its TTL, otherwise query() and caches the result
+        """
+
+        if ttl is None:
+            ttl = config.DEVICE_CACHE_TTL_PER_PARAMETER.get(f"{type(self).__name__}.{name}", config.DEVICE_CACHE_TTL)
+
+        with self.lock:
+            if not refresh and name in self._parameter_cache:
+                value, timestamp = self._parameter_cache[name]
+                if time.monotonic() - timestamp < ttl:
+                    return value
+            value = query()
+            # an empty reply means the device did not answer, it is queried again next time
+            if not (isinstance(value, str) and not value):
+                self._parameter_cache[name] = (value, time.monotonic())
+            return value
+
+    def invalidate_cache(self, name=None):
+        # drops one (or all) cached parameters, e.g. after a power cycle of the device
+        with self.lock:
+            if name is None: self._parameter_cache.clear()
+            else: self._parameter_cache.pop(name, None)
+
     def serial_io(self, cmd: str,
                         read_only: bool=False,
                         delay: float=None, 
                         line_ending: str='\r\n',
                         wait_for: str=None,
                         multi_line: bool=False,
-                        codec = "utf-8") -> str:
+                        codec = "utf-8",
+                        timeout: float=None,
+                        end_marker: str=None) -> str:
 
         """
         For communication with the serial port. Flashes buffers of both input and output,
         does command formatting and writes the command to the output buffer.
-        After a delay, a line is read from the input buffer and returned.
+        The reply is read as soon as it arrives (up to its line ending, prompt or end marker),
+        bounded by a deadline instead of a fixed delay.
 
         PARAMETERS
         ----------
         cmd: Str, bytes, optional
         read_only: only reads line, doesnt write
-        delay: float or None, optional
+        delay: float or None, optional. fixed settle time after writing (only if given or config.SERIAL_FIXED_DELAY)
         line_ending: bytes, optional
         wait_for: reads lines consecutively until str is reached
-        multiline: reads through serial.readlines()
+        multiline: reads lines until end_marker is reached, or until the device stays silent for idle_timeout
+        timeout: latency budget of the command in s. default from command_timeouts, else default_timeout
+        end_marker: str marking the last line of a multi_line reply
         """
 
+        with self.lock:
+            return self._serial_io(cmd, read_only, delay, line_ending, wait_for, multi_line, timeout, end_marker)
+
+    def _serial_io(self, cmd, read_only, delay, line_ending, wait_for, multi_line, timeout, end_marker):
+
         # only read, dont write
         if read_only:
             return_str = self.serial.readline()
@@ -94,8 +163,8 @@ class serial_device(device):
         self.serial.reset_input_buffer()
         self.serial.reset_output_buffer()
 
-        # delay override
-        if delay is None:
+        # fixed delay only on request (legacy behaviour)
+        if delay is None and config.SERIAL_FIXED_DELAY:
             delay = self.delay
 
         # encode cmd
@@ -106,25 +175,56 @@ class serial_device(device):
 
         #read and write
         self.serial.write(cmd)
-        time.sleep(delay)
+        if delay: time.sleep(delay)
+
+        deadline = time.monotonic() + self.latency_budget(cmd.decode(errors="ignore"), timeout)
 
         # wait for a set of characters to appear in the output string
         if wait_for:
             while True:
-                return_str = self.serial.readline()
-                if wait_for in return_str.decode():
+                return_str = self._read_line(deadline)
+                if wait_for in return_str.decode(errors="ignore"):
                     break
-                time.sleep(delay)
+                if time.monotonic() >= deadline:
+                    self.logger.error(f"no reply containing '{wait_for}' to {cmd} within its latency budget")
+                    raise TimeoutError(f"{type(self).__name__}: no reply containing '{wait_for}' to {cmd}")
 
-        #read everything thats available
+        #read all lines of the reply
         elif multi_line:
-            return_str = b''
-            return_lst = self.serial.readlines()
-            for string in return_lst:
-                return_str += string
+            return_str = self._read_lines(deadline, end_marker)
 
         #Default: read until a line ending is reached
         else:
-            return_str = self.serial.readline()
+            return_str = self._read_line(deadline)
         self.logger.debug(f'Serial write cmd: {cmd}; return {return_str}')
         return return_str.decode(errors="ignore")
+
+    def latency_budget(self, cmd, timeout=None):
+        # time in s a command may take to reply. the longest matching prefix in command_timeouts wins
+        if timeout is not None: return timeout
+        matches = [prefix for prefix in self.command_timeouts if cmd.startswith(prefix)]
+        if matches: return self.command_timeouts[max(matches, key=len)]
+        return self.default_timeout
+
+    def _set_timeout(self, timeout):
+        if self.serial.timeout != timeout:
+            self.serial.timeout = timeout
+
+    def _read_line(self, deadline, idle_timeout=None):
+        # returns as soon as the line ending arrives, at the latest at the deadline (or after idle_timeout)
+        remaining = max(deadline - time.monotonic(), 0)
+        self._set_timeout(remaining if idle_timeout is None else min(idle_timeout, remaining))
+        return self.serial.read_until(b'\n')
+
+    def _read_lines(self, deadline, end_marker=None):
+        # reads lines until end_marker is part of a line. without end marker until no further line
+        # arrives within idle_timeout (replaces readlines(), which always waited for the full port timeout)
+        return_str = b''
+        while time.monotonic() < deadline:
+            line = self._read_line(deadline, idle_timeout=None if end_marker or not return_str else self.idle_timeout)
+            return_str += line
+            if not line.endswith(b'\n'):
+                break
+            if end_marker and end_marker in line.decode(errors="ignore"):
+                break
+        return return_str
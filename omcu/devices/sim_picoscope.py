@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+import logging
+import time
+
+import config
+import numpy as np
+from devices.sim_setup import sim_setup
+from utils.WaveformBatch import channelInputRanges
+
+
+class sim_picoscope:
+
+    """
+    Simulated Picoscope backend (see devices.Picoscope). Generates PMT waveforms as raw ADC codes:
+    single / multi photoelectron pulses with poisson occupancy, gaussian SPE gain spectrum, transit time
+    with TTS jitter, baseline noise, dark pulses and the trigger edge of the laser.
+    The capture (trigger rate) and transfer time of the hardware are modelled and slept if config.PICOSCOPE_SIM_REALTIME.
+
+    The pulse parameters are attributes. With the simulated setup (config.SIMULATING), occupancy and gain follow
+    laser, rotation stage and uBase of devices.sim_setup at every capture
+    """
+
+    def __init__(self, trigger_ch = 0, signal_ch = 2, trigger_threshold = 2500, pre_trigger_samples = 100, post_trigger_samples = 250):
+
+        self.logger = logging.getLogger(type(self).__name__)
+        self.rng    = np.random.default_rng(config.PICOSCOPE_SIM_SEED)
+
+        self.channel_trg  = trigger_ch
+        self.channel_sgnl = signal_ch
+        self.trigger_threshold = trigger_threshold
+
+        # same limits and ranges as the 6424E in the setup
+        self.max_nwf        = int ( 5e9 / (2 * post_trigger_samples + pre_trigger_samples))
+        self.voltrange_trg  = 9
+        self.voltrange_sgnl = 3
+        self.max_adc        = 32512
+        self.dt_block       = 0.8   # ns, timebase 2
+        self.dt_stream      = 3.2   # ns, timebase 4
+
+        self.noOfPreTriggerSamples  = pre_trigger_samples
+        self.noOfPostTriggerSamples = post_trigger_samples
+        self.nSamples = pre_trigger_samples + post_trigger_samples
+
+        # PMT and light
+        self.occupancy      = config.PICOSCOPE_SIM_OCCUPANCY       # fraction of waveforms with >= 1 pe
+        self.gain           = config.PICOSCOPE_SIM_GAIN
+        self.gain_spread    = config.PICOSCOPE_SIM_GAIN_SPREAD     # relative sigma of the SPE charge
+        self.transit_time   = config.PICOSCOPE_SIM_TRANSIT_TIME    # ns after the trigger edge
+        self.tts            = config.PICOSCOPE_SIM_TTS             # ns, sigma
+        self.pulse_width    = 1.5                                  # ns, sigma of the gaussian pulse
+        self.noise          = config.PICOSCOPE_SIM_NOISE           # mV, sigma of the baseline
+        self.dark_rate      = config.PICOSCOPE_SIM_DARK_RATE       # Hz
+        self.trigger_rate   = config.PICOSCOPE_SIM_TRIGGER_RATE    # Hz, laser pulse rate
+        self.trigger_height = 3300                                 # mV
+        self.trigger_time   = 8                                    # ns, laser sync edge in the waveform
+        self.trigger_jitter = 0.1                                  # ns
+
+        self.logger.info("simulated Picoscope initialized")
+
+
+    def close_connection(self):
+        self.logger.info("simulated picoscope closed")
+
+
+    #---------------------------
+
+
+    def _follow_setup(self):
+        if not config.SIMULATING: return
+        setup = sim_setup.Instance()
+        self.occupancy = setup.occupancy()
+        self.gain      = setup.gain()
+        if setup.laser.ld: self.trigger_rate = setup.laser.frequency
+
+    def _charge_to_amplitude(self, charge):
+        # peak of a gaussian pulse in mV carrying the charge in C over 50 Ohm
+        return charge * 50 / (self.pulse_width * 1e-9 * np.sqrt(2 * np.pi)) * 1e3
+
+    def _add_pulses(self, signal, rows, times, dt):
+
+        # adds negative pulses of SPE charges at the given waveform rows and times [ns]
+
+        if not len(rows): return
+        charge = self.gain * 1.602176634e-19 * np.clip(self.rng.normal(1, self.gain_spread, len(rows)), 0.05, None)
+        amplitude = self._charge_to_amplitude(charge)
+
+        half   = int(np.ceil(4 * self.pulse_width / dt))
+        center = np.round(times / dt).astype(int)
+        cols   = center[:, None] + np.arange(-half, half + 1)[None, :]
+        shape  = np.exp(-0.5 * ((cols * dt - times[:, None]) / self.pulse_width)**2)
+
+        valid = (cols >= 0) & (cols < signal.shape[1])
+        rows  = np.broadcast_to(rows[:, None], cols.shape)
+        np.add.at(signal, (rows[valid], cols[valid]), -(amplitude[:, None] * shape)[valid])
+
+    def _add_dark_pulses(self, signal, dt):
+        window = signal.shape[1] * dt * 1e-9
+        nr     = self.rng.poisson(self.dark_rate * window * signal.shape[0])
+        self._add_pulses(signal, self.rng.integers(0, signal.shape[0], nr), self.rng.uniform(0, signal.shape[1] * dt, nr), dt)
+
+    def _to_adc(self, mV, range):
+        adc = mV * (self.max_adc / channelInputRanges[range])
+        return np.clip(np.round(adc), -self.max_adc, self.max_adc).astype(np.int16)
+
+    def _wait(self, start, capture_time, nr_bytes):
+        # sleeps the rest of the modelled capture and transfer time
+        if not config.PICOSCOPE_SIM_REALTIME: return
+        remaining = capture_time + nr_bytes / config.PICOSCOPE_SIM_TRANSFER_RATE - (time.monotonic() - start)
+        if remaining > 0: time.sleep(remaining)
+
+
+    def run_block(self, nr_waveforms):
+
+        start = time.monotonic()
+        dt    = self.dt_block
+        self._follow_setup()
+        timevals = np.arange(self.nSamples, dtype=np.float32) * np.float32(dt)
+
+        # trigger edge of the laser sync, the pulses follow after the transit time
+        trigger_time = self.trigger_time + self.rng.normal(0, self.trigger_jitter, nr_waveforms)
+        edge = np.clip((timevals[None, :] - trigger_time[:, None]) / 2 + 0.5, 0, 1)
+        trigger_adc = self._to_adc(edge * self.trigger_height, self.voltrange_trg)
+
+        # photoelectrons: poisson with mean -ln(1 - occupancy) per waveform
+        signal = self.rng.normal(0, self.noise, (nr_waveforms, self.nSamples)).astype(np.float32)
+        mu     = -np.log(1 - min(self.occupancy, 0.999999))
+        npe    = self.rng.poisson(mu, nr_waveforms)
+        rows   = np.repeat(np.arange(nr_waveforms), npe)
+        times  = trigger_time[rows] + self.transit_time + self.rng.normal(0, self.tts, len(rows))
+        self._add_pulses(signal, rows, times, dt)
+        self._add_dark_pulses(signal, dt)
+
+        signal_adc = self._to_adc(signal, self.voltrange_sgnl)
+
+        self._wait(start, nr_waveforms / self.trigger_rate, trigger_adc.nbytes + signal_adc.nbytes)
+        self.logger.info(f"simulated block measurement of {nr_waveforms} Waveforms performed. trigger_ch: {self.channel_trg}, signal_ch: {self.channel_sgnl}")
+        return timevals, trigger_adc, signal_adc
+
+
+    def run_stream(self, nr_samples, nr_waveforms):
+
+        # dark count measurement: noise and dark pulses only (laser off)
+
+        start = time.monotonic()
+        dt    = self.dt_stream
+        self._follow_setup()
+        timevals = np.arange(nr_samples, dtype=np.float32) * np.float32(dt)
+
+        signal = self.rng.normal(0, self.noise, (nr_waveforms, nr_samples)).astype(np.float32)
+        self._add_dark_pulses(signal, dt)
+        signal_adc = self._to_adc(signal, self.voltrange_sgnl)
+
+        self._wait(start, nr_waveforms * nr_samples * dt * 1e-9, signal_adc.nbytes)
+        self.logger.info(f"simulated block measurement of {nr_waveforms} Waveforms of {nr_samples} samples performed. signal_ch: {self.channel_sgnl}")
+        return timevals, signal_adc
@@ -1,39 +1,76 @@
 #!/usr/bin/python3
+import collections
 import logging
+import time
 
-import numpy as np
+import config
+from devices.sim_setup import sim_setup
 
 
 class sim_serial:
-    def __init__(self, *args, **kwargs):
+
+    """
+    Simulated serial port (same methods as serial.Serial), connected to the device model of the port in
+    devices.sim_setup. A written command is handled by the model, its reply lines become readable after the
+    modelled latency. Reads wait for them like a real port, at most for the port timeout.
+    With config.SIM_REALTIME = False the replies are available at once
+    """
+
+    def __init__(self, port, *args, **kwargs):
         self.logger = logging.getLogger(type(self).__name__)
-        self.logger.debug(f'Initialized with - args: {args}; kwargs: {kwargs}')
+        self.logger.debug(f'Initialized with - port: {port}, args: {args}; kwargs: {kwargs}')
+        self.port    = port
+        self.timeout = kwargs.get("timeout", None)
+        self.device  = sim_setup.Instance().device(port)
+        self.pending = collections.deque()   # (time the line is complete, line)
 
-    @staticmethod  # function does not need self
-    def readline():
-        return_bytes = 'test str /n'
-        return return_bytes.encode()
+    def write(self, bytes_str):
+        cmd = bytes_str.decode().strip()
+        self.logger.debug(f'SerialWrite: {cmd}')
+        now = time.monotonic()
+        for delay, line in self.device.handle(cmd):
+            self.pending.append((now + delay if config.SIM_REALTIME else now, (line + "\r\n").encode()))
+        return len(bytes_str)
 
-    @staticmethod  # function does not need self
-    def readlines():
-        return_bytes = 'test str /n'
-        return return_bytes.encode()
+    def _wait(self, until):
+        if config.SIM_REALTIME:
+            remaining = until - time.monotonic()
+            if remaining > 0: time.sleep(remaining)
 
-    @staticmethod
-    def read():
-        return f'{np.random.randint(0, 10)}'.encode()  # return one item
+    def read_until(self, expected=b'\n', size=None):
+        # next reply line, b'' if none is complete within the timeout
+        deadline = time.monotonic() + self.timeout if self.timeout is not None else float("inf")
+        if not self.pending or self.pending[0][0] > deadline:
+            self._wait(deadline if self.timeout is not None else time.monotonic())
+            return b''
+        ready, line = self.pending.popleft()
+        self._wait(ready)
+        return line
 
-    @staticmethod
-    def inWaiting():
-        return np.random.random() < .8  # the probability is smaller to be False as True
+    def readline(self):
+        return self.read_until()
 
-    @staticmethod
-    def reset_input_buffer():
-        pass
+    def readlines(self):
+        lines = []
+        while self.pending:
+            line = self.read_until()
+            if not line: break
+            lines.append(line)
+        return lines
+
+    @property
+    def in_waiting(self):
+        now = time.monotonic()
+        return sum(len(line) for ready, line in self.pending if ready <= now)
 
-    @staticmethod
-    def reset_output_buffer():
+    def inWaiting(self):
+        return self.in_waiting
+
+    def reset_input_buffer(self):
+        self.pending.clear()
+
+    def reset_output_buffer(self):
         pass
 
-    def write(self, bytes_str):
-        self.logger.debug(f'SerialWrite: {bytes_str.decode().strip()}')  # .strip() to remove tailing '/n'
+    def close(self):
+        pass
@@ -0,0 +1,480 @@
+#!/usr/bin/python3
+import logging
+import re
+import time
+
+import config
+import numpy as np
+
+# simulated OMCU setup (config.SIMULATING, --simulate). one stateful model per device, speaking the command grammar
+# of the real device over devices.sim_serial (the PSUs over the gpd3303s driver API). the models share the state
+# of the setup: the light at the PMT follows laser tune, laser temperature and the angles of the stage, the gain
+# follows the Dy10 of the uBase. devices.sim_picoscope takes occupancy and gain from here.
+#
+# a model handles a command with handle(cmd) and returns the reply lines with the time in s after the write
+# at which each line is complete. commands without reply return [] (the real devices stay silent as well)
+
+
+def _line_time(line, baudrate):
+    # transfer time of a line (10 bits per character)
+    return (len(line) + 2) * 10 / baudrate
+
+
+class sim_device:
+
+    """
+    Masterclass of the simulated devices
+    """
+
+    baudrate        = 9600
+    processing_time = 0.01  # s, until a reply starts
+
+    def __init__(self, setup):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.setup  = setup
+        self.rng    = setup.rng
+
+    def reply(self, *lines, delay=0):
+        # reply lines, each one complete after the processing (and delay) plus its transfer time
+        replies, t = [], self.processing_time + delay
+        for line in lines:
+            t += _line_time(line, self.baudrate)
+            replies.append((t, line))
+        return replies
+
+    def handle(self, cmd):
+        raise NotImplementedError
+
+    def unknown(self, cmd):
+        self.logger.warning(f"unknown command {cmd!r}")
+        return []
+
+
+class sim_laser(sim_device):
+
+    """
+    Picosecond laser controller EIG2000DX. Replies with the state line of the parameter, also to set commands
+    """
+
+    baudrate = 19200
+
+    # light model: mean nr of photoelectrons at the PMT (frontal) falls exponentially with the tune value
+    mu_ref          = 0.105   # at tune_ref, 10 kHz, warm laser
+    tune_ref        = 705
+    tune_scale      = 50      # tune values per e-fold
+    # laser head warms up while emitting, the output power drops with the temperature
+    temp_ambient    = 25.0    # C
+    temp_rise       = 3.0     # C when emitting
+    temp_tau        = 15*60   # s
+    temp_coefficient = -0.01  # relative power change per C
+
+    def __init__(self, setup):
+        super().__init__(setup)
+        self.ld        = 0
+        self.cw        = 0
+        self.cwl       = 0
+        self.edge      = 1
+        self.source    = 0
+        self.level     = 0      # mV
+        self.tune_mode = 1
+        self.tune      = 700
+        self.frequency = 1000   # Hz
+        self.temp      = self.temp_ambient
+        self.temp_time = time.monotonic()
+
+    def temperature(self):
+        # relaxes towards the ambient (off) or the warm (emitting) temperature
+        now = time.monotonic()
+        target = self.temp_ambient + (self.temp_rise if self.ld else 0)
+        self.temp += (target - self.temp) * (1 - np.exp(-(now - self.temp_time) / self.temp_tau))
+        self.temp_time = now
+        return self.temp
+
+    def mean_photoelectrons(self):
+        # frontal mean nr of photoelectrons per pulse, 0 without emission
+        if not self.ld: return 0.
+        temp_factor = 1 + self.temp_coefficient * (self.temperature() - self.temp_ambient - self.temp_rise)
+        return self.mu_ref * np.exp(-(self.tune - self.tune_ref) / self.tune_scale) * max(temp_factor, 0)
+
+    def _state_lines(self):
+        return [f"interlock:\t\t\tdisabled",
+                f"laser emission:\t\t{'on' if self.ld else 'off'}",
+                f"CW emission:\t\t{'on' if self.cw else 'off'}",
+                f"trigger source:\t\t{['internal', 'ext. adjustable', 'ext. TTL'][self.source]}",
+                f"trigger edge:\t\t{'rising' if self.edge else 'falling'}",
+                f"tune mode:\t\t\t{'auto' if self.tune_mode else 'manual'}",
+                f"tune value: {self.tune/10:12.2f} %",
+                f"laser head temp.: {self.temperature():10.2f} C",
+                f"int. frequency: {self.frequency:11.0f} Hz",
+                f"ext. frequency: {0:11.0f} Hz",
+                f"trigger level: {self.level/1000:+10.2f} V"]
+
+    def handle(self, cmd):
+
+        match = re.fullmatch(r"(\w+)\s*(=\s*(\S+)|\?)", cmd)
+        if not match: return self.unknown(cmd)
+        name, value = match.group(1), match.group(3)
+
+        if value is not None:
+            value = float(value)
+            if   name == "ld":   self.temperature(); self.ld = int(value)
+            elif name == "cw":   self.cw = int(value)
+            elif name == "cwl":  self.cwl = int(np.clip(value, 0, 100))
+            elif name == "te":   self.edge = int(value)
+            elif name == "ts":   self.source = int(value)
+            elif name == "tl":   self.level = np.clip(value, -4800, 4800)
+            elif name == "tm":   self.tune_mode = int(value)
+            elif name == "tune":
+                # the tune value is only accepted in manual tune mode
+                if not self.tune_mode: self.tune = int(np.clip(value, 0, 1000))
+            elif name == "f":    self.frequency = int(np.clip(value, 25, 125000000))
+            else: return self.unknown(cmd)
+
+        if name == "state":  return self.reply(*self._state_lines())
+        if name == "ld":     return self.reply(f"pulsed laser emission: {'on' if self.ld else 'off'}")
+        if name == "cw":     return self.reply(f"CW laser emission: {'on' if self.cw else 'off'}")
+        if name == "cwl":    return self.reply(f"CW output power: {self.cwl} %")
+        if name == "te":     return self.reply(f"trigger edge: {'rising' if self.edge else 'falling'}")
+        if name == "ts":     return self.reply(f"trigger source: {['internal', 'ext. adjustable', 'ext. TTL'][self.source]}")
+        if name == "tl":     return self.reply(f"trigger level: {self.level/1000:+10.2f} V")
+        if name == "tm":     return self.reply(f"tune mode: {'auto' if self.tune_mode else 'manual'}")
+        if name == "tune":   return self.reply(f"tune value: {self.tune/10:12.2f} %")
+        if name == "f":      return self.reply(f"int. frequency: {self.frequency:11.0f} Hz")
+        if name == "lht":    return self.reply(f"laser head temp.: {self.temperature():10.2f} C")
+        if name == "ldtemp": return self.reply(f"LD temperature indicator: good")
+        return self.unknown(cmd)
+
+
+class sim_rotation(sim_device):
+
+    """
+    Rotation stage: 2 stepper axes (X: theta, Y: phi) on an arduino. Positions are counted in steps, moves reply
+    once the axis arrived. The steppers only move while PSU1 is on: unpowered, the step counter changes
+    but the axis stays where it is. Homing moves to the reference switch
+    """
+
+    baudrate        = 9600
+    home_search     = 1.0   # s, search of the reference switch
+
+    def __init__(self, setup):
+        super().__init__(setup)
+        self.steps     = {"X": 0, "Y": 0}   # step counter of the controller
+        self.physical  = {"X": 0, "Y": 0}   # actual position of the axis in steps
+        self.speed     = 300                # delay between steps in µs (config.ROTATION_SPEED_UNIT)
+
+    def angle(self, axis):
+        return self.physical[axis] / config.ROTATION_STEPS_PER_TURN * 360
+
+    def _move(self, axis, target, homing=False):
+        # returns the travel time in s
+        self.steps[axis] = target
+        if not self.setup.psu("/dev/PSU_1").output:
+            self.logger.warning(f"axis {axis} is not powered (PSU1 off), it does not move")
+            return 0
+        travel = abs(target - self.physical[axis]) * self.speed * config.ROTATION_SPEED_UNIT
+        self.physical[axis] = target
+        return travel + (self.home_search if homing else 0)
+
+    def handle(self, cmd):
+
+        if not cmd.strip(): return self.reply("unknown command")
+
+        match = re.fullmatch(r"goHome([XY])", cmd)
+        if match:
+            axis = match.group(1)
+            return self.reply(f"home position {axis}: 0", delay=self._move(axis, 0, homing=True))
+
+        match = re.fullmatch(r"go([XY])\s+(\S+)", cmd)
+        if match:
+            axis   = match.group(1)
+            target = int(round(float(match.group(2)) / 360 * config.ROTATION_STEPS_PER_TURN))
+            return self.reply(f"position {axis}: {target}", delay=self._move(axis, target))
+
+        match = re.fullmatch(r"getPosition([XY])", cmd)
+        if match: return self.reply(f"position {match.group(1)}: {self.steps[match.group(1)]}")
+
+        match = re.fullmatch(r"getIR([XY])", cmd)
+        if match: return self.reply(f"IR {match.group(1)}: {int(self.physical[match.group(1)] == 0)}")
+
+        match = re.fullmatch(r"setspeed\s+(\S+)", cmd)
+        if match:
+            self.speed = int(float(match.group(1)))
+            return self.reply(f"speed: {self.speed}")
+
+        if cmd == "getspeed": return self.reply(f"speed: {self.speed}")
+        return self.unknown(cmd)
+
+
+class sim_ubase(sim_device):
+
+    """
+    uBase of the PMT. The Dy10 voltage ramps with limited rate to the set value and settles exponentially,
+    readings are averages with noise
+    """
+
+    baudrate        = 57600
+    processing_time = 0.05    # s, averaged readings
+    uid             = "0056006b 344b5009 20333353"
+
+    ramp_rate  = 2.0    # V/s of Dy10
+    settle_tau = 1.5    # s, exponential approach after the ramp
+    noise      = 0.01   # V
+
+    def __init__(self, setup):
+        super().__init__(setup)
+        self.start    = 0.
+        self.target   = 0.
+        self.set_time = time.monotonic()
+        self.sleeping = 0
+
+    def dy10(self):
+        # noiseless Dy10: linear ramp to the target, then exponential settling of the remaining 10 %
+        t    = time.monotonic() - self.set_time
+        step = self.target - self.start
+        ramp = 0.9 * abs(step) / self.ramp_rate
+        if t < ramp:
+            return self.start + np.sign(step) * self.ramp_rate * t
+        return self.target - 0.1 * step * np.exp(-(t - ramp) / self.settle_tau)
+
+    def handle(self, cmd):
+
+        match = re.fullmatch(r"Uquickscan\s+(\S+)", cmd)
+        if match:
+            self.start, self.target, self.set_time = self.dy10(), float(match.group(1)), time.monotonic()
+            return self.reply(f"quickscan {int(self.target)}")
+
+        match = re.fullmatch(r"Usleepenable\s+(\S+)", cmd)
+        if match:
+            self.sleeping = int(match.group(1))
+            return self.reply(f"sleep {self.sleeping}")
+
+        dy10 = self.dy10()
+        if cmd == "Uget_avg_v10":   return self.reply(f"{dy10 + self.rng.normal(0, self.noise):.3f}")
+        if cmd == "Uget_avg_di10":  return self.reply(f"{dy10 * 0.012 + self.rng.normal(0, 0.001):.4f}")
+        if cmd == "Uget_avg_isup":  return self.reply(f"{4.2 + dy10 * 0.01 + self.rng.normal(0, 0.05):.3f}")
+        if cmd == "Uget_avg_vsup":  return self.reply(f"{3.3 + self.rng.normal(0, 0.005):.3f}")
+        if cmd == "Uget_avg_frac":  return self.reply(f"{0.5 + self.rng.normal(0, 0.01):.3f}")
+        if cmd == "Uget_uid":       return self.reply(self.uid)
+        if cmd == "Ureportavg":
+            return self.reply(f"v10 {dy10:.3f}", f"di10 {dy10 * 0.012:.4f}", f"isup {4.2 + dy10 * 0.01:.3f}",
+                              f"vsup {3.3:.3f}", f"frac {0.5:.3f}")
+        return self.unknown(cmd)
+
+
+class sim_powermeter(sim_device):
+
+    """
+    Newport 2936-R optical power meter with echo off: set commands are not answered.
+    The power follows the light of the laser. The data store fills with one value per interval while running
+    """
+
+    baudrate        = 38400
+    power_ref       = 2e-9     # W at sim_laser.mu_ref and 10 kHz
+    noise           = 2e-13    # W
+    sample_interval = 1e-3     # s per store interval
+    buffer_size     = 10000
+
+    settings_map = {"ECHO": "echo", "PM:L": "lambda", "PM:CHAN": "channel", "PM:DS:BUF": "buffer",
+                    "PM:DS:INT": "interval", "PM:MODE": "mode", "PM:ZEROVAL": "offset"}
+
+    def __init__(self, setup):
+        super().__init__(setup)
+        self.settings  = {"echo": 1, "lambda": 405, "channel": 1, "buffer": 0, "interval": 1, "mode": 0, "offset": 0.}
+        self.running   = 0
+        self.store     = []
+        self.store_on  = 0
+        self.store_time = time.monotonic()
+
+    def power(self):
+        laser = self.setup.laser
+        light = self.power_ref * laser.mean_photoelectrons() / laser.mu_ref * laser.frequency / 10e3
+        return light + self.rng.normal(0, self.noise) - self.settings["offset"] if self.running else 0.
+
+    def _fill_store(self):
+        # values collected since the last access
+        now = time.monotonic()
+        if self.store_on and self.running:
+            nr = int((now - self.store_time) / (self.sample_interval * self.settings["interval"]))
+            if self.settings["buffer"] == 0: nr = min(nr, self.buffer_size - len(self.store))
+            self.store += [self.power() for _ in range(max(nr, 0))]
+            self.store = self.store[-self.buffer_size:]
+            self.store_time += nr * self.sample_interval * self.settings["interval"]
+        else:
+            self.store_time = now
+
+    def _get_data(self, selection):
+        if selection.startswith("+"):   values = self.store[-int(selection[1:]):]
+        elif selection.startswith("-"): values = self.store[:int(selection[1:])]
+        elif "-" in selection:
+            first, last = (int(i) for i in selection.split("-"))
+            values = self.store[first - 1:last]
+        else:                           values = self.store[int(selection) - 1:int(selection)]
+        header = ["Detector SN: 2003", "IDN: NEWPORT 2936-R v1.2.3 08/04/15 SN24777", f"Wavelength: {self.settings['lambda']}",
+                  "Attenuator Status: Off", "Range Mode: Auto", f"Store Interval: {self.settings['interval']}",
+                  "Analog Filter: 12.5kHz", "Digital Filter: 1000", "Mode: CW Continuous", "Responsivity: 1.737366E-001",
+                  "Units: W", "End of Header"]
+        return self.reply(*header, *[f"{value:E}" for value in values], "End of Data")
+
+    def handle(self, cmd):
+
+        self._fill_store()
+        parts = cmd.split()
+        name, value = parts[0].upper(), parts[1] if len(parts) > 1 else None
+
+        if name.rstrip("?") in self.settings_map:
+            key = self.settings_map[name.rstrip("?")]
+            if name.endswith("?"): return self.reply(f"{self.settings[key]:E}" if key == "offset" else f"{self.settings[key]}")
+            self.settings[key] = float(value) if key == "offset" else int(value)
+            return []
+
+        if name == "PM:P?":      return self.reply(f"{self.power():E}")
+        if name == "PM:RUN":     self.running = int(value); return []
+        if name == "PM:RUN?":    return self.reply(f"{self.running}")
+        if name == "PM:DS:CL":   self.store = []; return []
+        if name == "PM:DS:C?":   return self.reply(f"{len(self.store)}")
+        if name == "PM:DS:EN":   self.store_on = int(value); return []
+        if name == "PM:DS:EN?":  return self.reply(f"{int(self.store_on and len(self.store) < self.buffer_size)}")
+        if name == "PM:DS:GET?": return self._get_data(value)
+        if name == "PM:ZEROSTO": self.settings["offset"] += self.power(); return []
+        return self.unknown(cmd)
+
+
+class sim_picoamp(sim_device):
+
+    """
+    Keithley 6482 picoamperemeter: SCPI, set commands are not answered. READ? replies after all ARM:COUN readings
+    """
+
+    baudrate     = 57600
+    reading_time = 0.02     # s per reading
+    dark_current = 2e-12    # A
+    responsivity = 0.17     # A/W of the photodiodes
+
+    def __init__(self, setup):
+        super().__init__(setup)
+        self.elements = ["CURR1", "CURR2"]
+        self.count    = 1
+
+    def _current(self, ch):
+        power = self.setup.powermeter.power_ref * self.setup.laser.mean_photoelectrons() / self.setup.laser.mu_ref
+        light = power * self.responsivity * (1 if ch == 1 else 0.5)
+        return light + self.dark_current + self.rng.normal(0, 1e-13)
+
+    def handle(self, cmd):
+
+        name, _, value = cmd.partition(" ")
+        name = name.upper()
+
+        if name == "*IDN?":      return self.reply("KEITHLEY INSTRUMENTS INC.,MODEL 6482,4470000,A01")
+        if name == "FORM:ELEM":  self.elements = [element.strip().upper() for element in value.split(",")]; return []
+        if name == "ARM:COUN":   self.count = int(value); return []
+        if name == "READ?":
+            readings = []
+            for i in range(self.count):
+                for element in self.elements:
+                    readings.append(f"{self._current(int(element[-1])):+.6E}" if element.startswith("CURR") else f"{i * self.reading_time:+.6E}")
+            return self.reply(",".join(readings), delay=self.count * self.reading_time)
+        if name in ("*RST", "TRIG:DEL", "INIT", "SYST:AZER") or name.startswith("SENS"): return []
+        return self.unknown(cmd)
+
+
+class sim_gpd3303s:
+
+    """
+    GW Instek GPD-3303S power supply, same methods as the gpd3303s driver. The commands need the USB round trip
+    """
+
+    command_time = 0.02  # s
+
+    def __init__(self, setup):
+        self.logger   = logging.getLogger(type(self).__name__)
+        self.setup    = setup
+        self.output   = False
+        self.voltage  = {1: 0., 2: 0.}
+        self.current  = {1: 0., 2: 0.}
+
+    def _command(self):
+        if config.SIM_REALTIME: time.sleep(self.command_time)
+
+    def open(self, port, readTimeOut=1, writeTimeOut=1):
+        self._command()
+
+    def enableOutput(self, enable):
+        self._command()
+        self.output = bool(enable)
+
+    def setVoltage(self, channel, voltage):
+        self._command()
+        self.voltage[channel] = voltage
+
+    def setCurrent(self, channel, current):
+        self._command()
+        self.current[channel] = current
+
+
+class sim_setup:
+
+    """
+    Shared state of the simulated devices
+    """
+
+    _instance = None
+
+    @classmethod
+    def Instance(cls):
+        if not cls._instance:
+            cls._instance = sim_setup()
+        return cls._instance
+
+    def __init__(self):
+
+        if sim_setup._instance:
+            raise Exception(f"ERROR: {str(type(self))} has already been initialized. please call with {str(type(self).__name__)}.Instance()")
+        else:
+            sim_setup._instance = self
+
+        self.logger = logging.getLogger(type(self).__name__)
+        self.rng    = np.random.default_rng(config.PICOSCOPE_SIM_SEED)
+
+        self.laser      = sim_laser(self)
+        self.rotation   = sim_rotation(self)
+        self.ubase      = sim_ubase(self)
+        self.powermeter = sim_powermeter(self)
+        self.picoamp    = sim_picoamp(self)
+        self.devices = {"/dev/Laser_control": self.laser,
+                        "/dev/Rotation":      self.rotation,
+                        "/dev/uBase":         self.ubase,
+                        "/dev/Powermeter":    self.powermeter,
+                        "/dev/Picoamp":       self.picoamp,
+                        "/dev/PSU_0":         sim_gpd3303s(self),
+                        "/dev/PSU_1":         sim_gpd3303s(self)}
+        self.logger.info("simulated OMCU setup initialized")
+
+    def device(self, dev):
+        if dev not in self.devices:
+            raise Exception(f"ERROR: no simulation of the device {dev}")
+        return self.devices[dev]
+
+    def psu(self, dev):
+        return self.devices[dev]
+
+    #---------------------------
+
+    # PMT model
+    gain_ref     = 5e6
+    dy10_ref     = 87      # V, Dy10 of gain_ref
+    gain_exponent = 7.0    # gain ~ Dy10^k
+
+    def acceptance(self):
+        # relative light yield at the angles of the stage: falls off with the polar angle theta,
+        # slight azimuthal dependence (photocathode inhomogeneity)
+        theta = np.radians(self.rotation.angle("X"))
+        phi   = np.radians(self.rotation.angle("Y"))
+        return max(np.cos(theta), 0)**0.5 * (1 + 0.05 * np.cos(phi))
+
+    def occupancy(self):
+        return 1 - np.exp(-self.laser.mean_photoelectrons() * self.acceptance())
+
+    def gain(self):
+        dy10 = max(self.ubase.dy10(), 0)
+        return self.gain_ref * (dy10 / self.dy10_ref)**self.gain_exponent
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
-import time
-
-from devices.device import serial_device
+import config
+from devices.device import cached_parameter, serial_device
+from utils.Settling import SettlingModel, wait_until_settled
 
 
 class uBase(serial_device):
@@ -29,12 +29,20 @@ class uBase(serial_device):
         super().__init__(dev=dev, simulating=simulating, delay=delay)
 
         self.vmax = 120
+        self.settling_model = SettlingModel()
         self.setSleeping(0)
 
 
 #-----------------------------------------------------------
 
-    def SetVoltage(self, Voltage:float, tolerance:float=0.1, max_iter:int=60, wait_time:float=1, initial_wait:float=5) -> float:
+    def SetVoltage(self, Voltage:float, tolerance:float=None, timeout:float=None) -> float:
+
+        # sets the HV and waits until the Dy10 readback is settled (utils.Settling): fast sampling until
+        # the readings are stable at the set value, instead of a fixed wait and 1 s polls.
+        # the settling times are learned per step size, the predicted part of the wait is slept through
+
+        tolerance = tolerance if tolerance is not None else config.UBASE_SETTLE_TOLERANCE
+        timeout   = timeout   if timeout   is not None else config.UBASE_SETTLE_TIMEOUT
 
         self.logger.info(f"setting Dy10 voltage to {Voltage} V")
         if Voltage > self.vmax:
@@ -42,20 +50,21 @@ class uBase(serial_device):
             Voltage = self.vmax
 
         # output voltage is 12*Dy10
-        Dy10 = round(Voltage)    
+        Dy10 = round(Voltage)
+        step = Dy10 - self.getDy10()
         self.setDy10(Dy10)
 
-        time.sleep(initial_wait)
-
-        iter = 0
-        while abs(Voltage - self.getDy10()) > tolerance:
-            iter += 1
-            time.sleep(wait_time)
-            if iter >= max_iter:
-                self.logger.warning("Voltage does not adjust in time!")
-                break
+        value, settling_time, settled = wait_until_settled(self.getDy10, Dy10, tolerance, timeout,
+                                                           sample_interval=config.UBASE_SETTLE_SAMPLE_INTERVAL,
+                                                           window=config.UBASE_SETTLE_WINDOW,
+                                                           predicted_time=self.settling_model.predict(step))
+        if settled:
+            self.settling_model.add(step, settling_time)
+            self.logger.debug(f"Dy10 settled at {round(value, 3)} V after {round(settling_time, 1)} s (step of {round(step, 1)} V)")
+        else:
+            self.logger.warning("Voltage does not adjust in time!")
 
-        return self.getDy10()
+        return value
 
 #-----------------------------------------------------------
 
@@ -83,6 +92,7 @@ class uBase(serial_device):
         frac = self.serial_io(f'Uget_avg_frac').strip()
         return float(frac)
 
+    @cached_parameter("uid")
     def getUID(self):
         return self.serial_io(f'Uget_uid').strip()
 
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+import logging
+import threading
+
+import numpy as np
+
+# nr of waveforms per scan point derived from a statistical target instead of a fixed count.
+# the occupancy (and gain / TTS spread) expected at the next point is estimated from the already analysed
+# neighbouring points, the nr of waveforms is chosen so the point gets the required nr of signal waveforms.
+# the estimate can not extrapolate (e.g. the falloff towards the edge of the photocathode), so the capture
+# is topped up if it fell short of nr_of_signals (TestingProcedures.measure_point)
+
+
+class WaveformCountPlanner:
+
+    # default:          nr of waveforms as long as nothing is known (and for non-adaptive scans)
+    # target_signals:   nr of signal waveforms per point
+    # target_gain_error: relative statistical error of the mean gain
+    # target_tts_error: relative statistical error of the transit time spread
+    # periods:          period per coordinate of the scan points (e.g. 360 for phi), None if not periodic
+
+    def __init__(self, default, target_signals=None, target_gain_error=None, target_tts_error=None,
+                 min_waveforms=None, max_waveforms=None, periods=None, nr_neighbours=4, margin=1.2):
+
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.default           = int(default)
+        self.target_signals    = target_signals
+        self.target_gain_error = target_gain_error
+        self.target_tts_error  = target_tts_error
+        self.min_waveforms     = int(min_waveforms) if min_waveforms else 1
+        self.max_waveforms     = int(max_waveforms) if max_waveforms else self.default
+        self.periods           = periods
+        self.nr_neighbours     = nr_neighbours
+        self.margin            = margin   # safety factor on the estimated nr of waveforms
+
+        # analysed points, filled by the ScanPipeline worker
+        self.lock   = threading.Lock()
+        self.points = []
+        self.values = []   # (occupancy fraction, relative gain sigma) per point
+
+    @property
+    def adaptive(self):
+        return bool(self.target_signals or self.target_gain_error or self.target_tts_error)
+
+    def add(self, point, metadict):
+
+        # metadict of the analysed point. points not analysed because of 0 occupancy count as occupancy 0
+
+        occ  = max(float(metadict["occ [%]"]), 0) / 100
+        gain = float(metadict["gain"])
+        rel_gain_sigma = float(metadict["gain spread"]) / 2.3548 / gain if gain > 0 else np.nan
+        with self.lock:
+            self.points.append(np.atleast_1d(np.asarray(point, dtype=float)))
+            self.values.append((occ, rel_gain_sigma))
+
+    def _distance(self, a, b):
+        delta = np.abs(a - b)
+        if self.periods:
+            for i, period in enumerate(self.periods):
+                if period: delta[i] = min(delta[i], period - delta[i] % period)
+        return np.sqrt(np.sum(delta**2))
+
+    def _estimate(self, point):
+
+        # inverse distance weighted occupancy and relative gain sigma of the nearest analysed points, None if there are none
+
+        with self.lock:
+            if not self.points: return None
+            point     = np.atleast_1d(np.asarray(point, dtype=float))
+            distances = np.array([self._distance(point, p) for p in self.points])
+            values    = np.array(self.values)
+
+        nearest = np.argsort(distances)[:self.nr_neighbours]
+        weights = 1 / (distances[nearest] + 1e-9)
+        occ     = np.average(values[nearest, 0], weights=weights)
+        sigmas  = values[nearest, 1]
+        valid   = np.isfinite(sigmas)
+        rel_gain_sigma = np.average(sigmas[valid], weights=weights[valid]) if valid.any() else None
+        return occ, rel_gain_sigma
+
+    def required_signals(self, rel_gain_sigma=None):
+
+        required = [self.target_signals or 0]
+        if self.target_gain_error and rel_gain_sigma:
+            required.append((rel_gain_sigma / self.target_gain_error)**2)
+        if self.target_tts_error:
+            # relative error of a width from N samples: 1/sqrt(2(N-1))
+            required.append(1 / (2 * self.target_tts_error**2) + 1)
+        return max(required)
+
+    def nr_of_signals(self, point):
+
+        # nr of signal waveforms the point should get, None if not adaptive
+
+        if not self.adaptive: return None
+
+        estimate = self._estimate(point)
+        return int(np.ceil(self.required_signals(estimate[1] if estimate else None)))
+
+    def nr_of_waveforms(self, point):
+
+        if not self.adaptive: return self.default
+
+        estimate = self._estimate(point)
+        if estimate is None: return self.default
+
+        # no signals at the neighbours (e.g. outside of the photocathode): the minimum, topped up if it finds signals
+        occ, rel_gain_sigma = estimate
+        if occ <= 0: return self.min_waveforms
+
+        nr_waveforms = self.required_signals(rel_gain_sigma) / occ * self.margin
+        nr_waveforms = int(np.clip(np.ceil(nr_waveforms), self.min_waveforms, self.max_waveforms))
+        self.logger.debug(f"expecting occupancy of {round(occ, 4)} at {point}, measuring {nr_waveforms} waveforms")
+        return nr_waveforms
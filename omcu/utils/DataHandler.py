@@ -8,6 +8,7 @@ import h5py
 import numpy as np
 from matplotlib import pyplot as plt
 from utils.Measurement import Measurement, DCS_Measurement
+from utils.Statistics import WaveformStatistics
 from scipy import stats
 
 
@@ -78,18 +79,26 @@ class DataHandler:
     
     def recalculate_metadicts(self):
 
+        # measurements are analysed in chunks of config.ANALYSIS_CHUNK_SIZE waveforms read from the file (constant memory)
+        # with utils.Statistics.WaveformStatistics, the same accumulators measure_metadict uses, whether loaded or not.
+        # dark count data are a single trace per point and are analysed as a whole
+
         with h5py.File(os.path.join(self.filepath, self.filename), "r") as h5:
 
             for data in self.measurements:
 
-                clear = False
-                if not data.waveforms:
-                    clear = True
-                    data.read_from_file(hdf5_connection=h5)
+                if isinstance(data, DCS_Measurement):
+                    loaded = data.signal is not None and len(data.signal) > 0
+                    if not loaded: data.read_from_file(hdf5_connection=h5)
+                    data.measure_metadict(data.metadict["sgnl threshold [mV]"], only_dark_counts=True)
+                    if not loaded: data.clear()
+                    continue
 
-                signal_threshold = data.metadict["sgnl threshold [mV]"]
-                data.measure_metadict(signal_threshold, only_waveform_characteristics=True)
-                if clear: data.clear()
+                data.read_metadict_from_file(hdf5_connection=h5)
+                statistics = WaveformStatistics(data.metadict["sgnl threshold [mV]"])
+                for chunk in data.read_chunks_from_file(hdf5_connection=h5):
+                    statistics.update(chunk)
+                data.metadict.update(statistics.finalize())
 
 ###-----------------------------------------------------------------
 
@@ -2,20 +2,18 @@
 
 import logging
 import os
-from datetime import datetime
+from concurrent.futures import Future
 
 import config
 import h5py
 import numpy as np
-from devices.Laser import Laser
-from devices.Powermeter import Powermeter
-from devices.Rotation import Rotation
-from devices.uBase import uBase
 from matplotlib import pyplot as plt
 from scipy import optimize
 from scipy.signal import find_peaks
 from scipy.stats import norm
-from utils.Waveform import Waveform
+from utils.Snapshot import snapshot_devices
+from utils.Timeline import StageTimeline
+from utils.WaveformBatch import WaveformBatch, adc2mV, channelInputRanges
 
 
 #placed here to avoid circular imports
@@ -23,6 +21,42 @@ def gaussian(x, a, mu, sigma):
     return a * np.exp(- (x - mu) ** 2 / (2 * sigma ** 2))
 
 
+def fit_gaussian(data, nr_bins=500):
+
+    # fits a gaussian to the histogram of data. returns mean and FWHM, (0,0) if not possible
+
+    data = np.extract(np.isfinite(data), data)
+
+    if len(data) == 0: return 0,0
+
+    try:
+        hist, bins = np.histogram(data, bins=nr_bins)
+    except: return 0,0
+
+    return fit_gaussian_histogram(hist, bins)
+
+
+def fit_gaussian_histogram(hist, bins, with_error=False):
+
+    # fits a gaussian to an already filled histogram (e.g. merged by utils.Statistics). returns mean and FWHM, (0,0) if not possible
+    # with_error: also returns the fit uncertainty of the mean (from the covariance of the fit), inf if not possible
+
+    failed = (0,0,np.inf) if with_error else (0,0)
+    if not np.count_nonzero(hist): return failed
+
+    try:
+        mask = hist[:] != 0
+        x_fit = bins[:-1][mask] + np.diff(bins)[0] / 2
+        y_fit = hist[mask]
+
+        popt, pcov = optimize.curve_fit(gaussian, x_fit, y_fit, p0=[np.max(y_fit), np.mean(x_fit), np.std(x_fit)])
+        FWHM = abs(2 * np.sqrt(2 * np.log(2)) * popt[2])
+        if with_error: return popt[1], FWHM, np.sqrt(pcov[1,1])
+        return popt[1], FWHM
+
+    except: return failed
+
+
 class Measurement:
 
     # class designed to handle a measurement (multiple waveforms taken in bulk)
@@ -32,17 +66,24 @@ class Measurement:
                  signal_data=np.array([]),
                  trigger_data=np.array([]),
                  time_data=np.array([]),
+                 trigger_time_data=np.array([]),
                  metadict=None,
                  filename=None,
                  filepath=None,
                  hdf5_key=None,
-                 pmt_id  =None):
+                 pmt_id  =None,
+                 signal_range=None,
+                 trigger_range=None,
+                 max_adc=None):
 
         self.logger = logging.getLogger(type(self).__name__)
         self.logger.debug(f"{type(self).__name__} initialized")
 
         self.filtered_by_threshold = False
 
+        # dataset attributes describing the raw ADC storage, not part of the metadict
+        self.storage_attributes = ["signal adc range", "trigger adc range", "max adc"]
+
         self.default_metadict = {
                 "pmt_id":                      -1,
                 "time":                        -1,
@@ -84,7 +125,8 @@ class Measurement:
         self.metadict  = self.default_metadict
 
         if waveform_list or signal_data.size or trigger_data.size or time_data.size:
-            self.setWaveforms(waveforms=waveform_list, signal=signal_data, trigger=trigger_data, time=time_data)
+            self.setWaveforms(waveforms=waveform_list, signal=signal_data, trigger=trigger_data, time=time_data, trigger_time=trigger_time_data,
+                              signal_range=signal_range, trigger_range=trigger_range, max_adc=max_adc)
 
         if metadict:
             self.setMetadict(metadict)
@@ -96,16 +138,25 @@ class Measurement:
 
 ###-----------------------------------------------------------------
 
-    def setWaveforms(self, waveforms = None, signal = np.array([]), trigger = np.array([]), time = np.array([])):
+    def setWaveforms(self, waveforms = None, signal = np.array([]), trigger = np.array([]), time = np.array([]), trigger_time = np.array([]),
+                     signal_range = None, trigger_range = None, max_adc = None):
+
+        # the trigger trace may be replaced by the per-waveform trigger times (see WaveformBatch.trigger_crossing_time)
+
         if waveforms:
             if signal.size or trigger.size or time.size:
                 self.logger.warning("Both Waveforms and signal arrays handed to data struct. Will only use waveforms!")
-            self.waveforms = waveforms
-        elif signal.size and trigger.size and time.size:
-            self.waveforms = []
-            for time_i, signal_i, trigger_i in zip(time, signal, trigger):
-                self.waveforms.append(Waveform(time=time_i, signal=signal_i, trigger=trigger_i))
-        else: raise Exception("ERROR: either waveforms or signal, trigger and time arrays need to be handed over")
+            self.waveforms = waveforms if isinstance(waveforms, WaveformBatch) else WaveformBatch.from_waveforms(waveforms)
+        elif signal.size and time.size and (trigger.size or trigger_time.size):
+            self.waveforms = self._make_batch(time, signal, trigger, trigger_time, signal_range, trigger_range, max_adc)
+        else: raise Exception("ERROR: either waveforms or signal, trigger (or trigger time) and time arrays need to be handed over")
+
+    @staticmethod
+    def _make_batch(time, signal, trigger = np.array([]), trigger_time = np.array([]), signal_range = None, trigger_range = None, max_adc = None):
+        return WaveformBatch(time=time, signal=signal,
+                             trigger=trigger if trigger.size else None,
+                             trigger_time=trigger_time if trigger_time.size else None,
+                             signal_range=signal_range, trigger_range=trigger_range, max_adc=max_adc)
 
     def getWaveforms(self):
         return self.waveforms
@@ -154,200 +205,96 @@ class Measurement:
 ###-----------------------------------------------------------------
 
     def calculate_occ(self, signal_threshold):
-        if not self.waveforms: self.logger.warning("calculating occupancy without having Waveforms stored!")
+        if not self.waveforms:
+            self.logger.warning("calculating occupancy without having Waveforms stored!")
+            return 0
         if self.filtered_by_threshold:
             print("WARNING: calculating occupancy on filtered Dataset. Value might be incorrect")
             self.logger.warning("calculating occupancy on filtered Dataset. Value might be incorrect")
-        i = 0
-        for wf in self.waveforms:
-            if wf.min_value < signal_threshold: i +=1
-        if float(len(self.waveforms)) == 0: return 0,0
-        return float(i)/float(len(self.waveforms))
+        return float(np.count_nonzero(self.waveforms.min_value < signal_threshold))/float(len(self.waveforms))
     
     
     def calculate_avg_amplitude(self, signal_threshold, nr_bins=500):
-        if not self.waveforms: self.logger.warning("calculating occupancy without having Waveforms stored!")
-        amplitudes = np.array([])
-        for wf in self.waveforms:
-            if wf.min_value < signal_threshold:
-                amplitudes = np.append(amplitudes, wf.min_value)
-        amplitudes = np.extract(np.isfinite(amplitudes), amplitudes)
-
-        if len(amplitudes) == 0: return 0,0
-
-        try:
-            hist, bins = np.histogram(amplitudes, bins=nr_bins)
-
-            mask = np.ones(nr_bins, dtype=bool) & (hist[:] != 0)
-            x_fit = bins[:-1][mask] + np.diff(bins)[0] / 2
-            y_fit = hist[mask]
-
-            popt, _ = optimize.curve_fit(gaussian, x_fit, y_fit, p0=[np.max(y_fit), np.mean(x_fit), np.std(x_fit)])
-            FWHM = abs(2 * np.sqrt(2 * np.log(2)) * popt[2])
-            return popt[1], FWHM
-        
-        except: return 0,0
+        if not self.waveforms:
+            self.logger.warning("calculating occupancy without having Waveforms stored!")
+            return 0,0
+        amplitudes = self.waveforms.min_value[self.waveforms.min_value < signal_threshold]
+        return fit_gaussian(amplitudes, nr_bins)
         
 
 
     def calculate_gain(self, signal_threshold, nr_bins = 500):
-        if not self.waveforms: self.logger.warning("calculating gain without having Waveforms stored!")
-        gains = np.array([])
-        for wf in self.waveforms:
-            if wf.min_value < signal_threshold:
-                gains = np.append(gains, wf.calculate_gain())
-        gains = np.extract(np.isfinite(gains), gains)
-        
-        if len(gains) == 0: return 0,0
-
-        try:
-            hist, bins = np.histogram(gains, bins=nr_bins)
-
-            mask = np.ones(nr_bins, dtype=bool) & (hist[:] != 0)
-            x_fit = bins[:-1][mask] + np.diff(bins)[0] / 2
-            y_fit = hist[mask]
-
-            popt, _ = optimize.curve_fit(gaussian, x_fit, y_fit, p0=[np.max(y_fit), np.mean(x_fit), np.std(x_fit)])
-            FWHM = abs(2 * np.sqrt(2 * np.log(2)) * popt[2])
-            return popt[1], FWHM
-        
-        except: return 0,0
+        if not self.waveforms:
+            self.logger.warning("calculating gain without having Waveforms stored!")
+            return 0,0
+        gains = self.waveforms[self.waveforms.min_value < signal_threshold].gain
+
+        # binning of the metadict (config.ANALYSIS_BINNING_GAIN), so the tuning, its stop rule
+        # (utils.Statistics.GainPrecision) and the stored gain are the same estimator
+        from utils.Statistics import Histogram   # placed here to avoid circular imports
+        histogram = Histogram(*config.ANALYSIS_BINNING_GAIN)
+        histogram.update(gains)
+        if not histogram.covers():
+            # the gains are in memory: fit the histogram over their own range instead
+            self.logger.warning(f"{round(histogram.out_of_range * 100, 1)} % of the gains are outside of config.ANALYSIS_BINNING_GAIN, "
+                                f"falling back to the binning of the data range")
+            return fit_gaussian(gains, nr_bins)
+        return histogram.finalize(nr_bins)
 
     def validate_gain(self, delta=10):
         return (self.metadict["gain"] - self.calculate_gain(self.metadict["sgnl_threshold"])[0]) < delta
 
 
     def calculate_charge(self, signal_threshold, nr_bins=500):
-        if not self.waveforms: self.logger.warning("calculating charge without having Waveforms stored!")
-        charges = np.array([])
-        for wf in self.waveforms:
-            if wf.min_value < signal_threshold: charges = np.append(charges, wf.calculate_charge())
-        charges = np.extract(np.isfinite(charges), charges)
-        
-        if len(charges) == 0: return 0,0
-
-        try:
-            hist, bins = np.histogram(charges, bins=nr_bins)
-
-            mask = np.ones(nr_bins, dtype=bool) & (hist[:] != 0)
-            x_fit = bins[:-1][mask] + np.diff(bins)[0] / 2
-            y_fit = hist[mask]
-
-            popt, _ = optimize.curve_fit(gaussian, x_fit, y_fit, p0=[np.max(y_fit), np.mean(x_fit), np.std(x_fit)])
-            FWHM = abs(2 * np.sqrt(2 * np.log(2)) * popt[2])
-            return popt[1], FWHM
-        
-        except: return 0,0
+        if not self.waveforms:
+            self.logger.warning("calculating charge without having Waveforms stored!")
+            return 0,0
+        charges = self.waveforms[self.waveforms.min_value < signal_threshold].charge
+        return fit_gaussian(charges, nr_bins)
     
 
     def calculate_ptv(self, signal_threshold, nr_bins=500):
-        if not self.waveforms: self.logger.warning("calculating peak to valley ratio without having Waveforms stored!")
-        ptv = np.array([])
-        for wf in self.waveforms:
-            if wf.min_value < signal_threshold:
-                ptv = np.append(ptv, wf.peak_to_valley_ratio)
-        ptv = np.extract(np.isfinite(ptv), ptv)
-        
-        if len(ptv) == 0: return 0,0
-
-        try:
-            hist, bins = np.histogram(ptv, bins=nr_bins)
-
-            mask = np.ones(nr_bins, dtype=bool) & (hist[:] != 0)
-            x_fit = bins[:-1][mask] + np.diff(bins)[0] / 2
-            y_fit = hist[mask]
-
-            popt, _ = optimize.curve_fit(gaussian, x_fit, y_fit, p0=[np.max(y_fit), np.mean(x_fit), np.std(x_fit)])
-            FWHM = abs(2 * np.sqrt(2 * np.log(2)) * popt[2])
-            return popt[1], FWHM
-        
-        except: return 0,0
+        if not self.waveforms:
+            self.logger.warning("calculating peak to valley ratio without having Waveforms stored!")
+            return 0,0
+        ptv = self.waveforms[self.waveforms.min_value < signal_threshold].peak_to_valley_ratio
+        return fit_gaussian(ptv, nr_bins)
 
 
     def calculate_baseline(self, signal_threshold, nr_bins=500):
-        if not self.waveforms: self.logger.warning("calculating baseline without having Waveforms stored!")
-        baseline = np.array([])
-        for wf in self.waveforms:
-            if wf.min_value < signal_threshold:
-                baseline = np.append(baseline, wf.baseline)
-        baseline = np.extract(np.isfinite(baseline), baseline)
-        
-        if len(baseline) == 0: return 0,0
-
-        try:
-            hist, bins = np.histogram(baseline, bins=nr_bins)
-
-            mask = np.ones(nr_bins, dtype=bool) & (hist[:] != 0)
-            x_fit = bins[:-1][mask] + np.diff(bins)[0] / 2
-            y_fit = hist[mask]
-
-            popt, _ = optimize.curve_fit(gaussian, x_fit, y_fit, p0=[np.max(y_fit), np.mean(x_fit), np.std(x_fit)])
-            FWHM = abs(2 * np.sqrt(2 * np.log(2)) * popt[2])
-            return popt[1], FWHM
-        
-        except: return 0,0
+        if not self.waveforms:
+            self.logger.warning("calculating baseline without having Waveforms stored!")
+            return 0,0
+        baseline = self.waveforms[self.waveforms.min_value < signal_threshold].baseline
+        return fit_gaussian(baseline, nr_bins)
 
 
     def calculate_rise_time(self, signal_threshold, nr_bins=500):
-        if not self.waveforms: self.logger.warning("calculating rise time without having Waveforms stored!")
-        rise_times = np.array([])
-        for wf in self.waveforms:
-            if wf.min_value < signal_threshold: rise_times = np.append(rise_times, wf.rise_time)
-        rise_times = np.extract(np.isfinite(rise_times), rise_times)
-        
-        if len(rise_times) == 0: return 0,0
-
-        try:
-            hist, bins = np.histogram(rise_times, bins=nr_bins)
-
-            mask = np.ones(nr_bins, dtype=bool) & (hist[:] != 0)
-            x_fit = bins[:-1][mask] + np.diff(bins)[0] / 2
-            y_fit = hist[mask]
-
-            popt, _ = optimize.curve_fit(gaussian, x_fit, y_fit, p0=[np.max(y_fit), np.mean(x_fit), np.std(x_fit)])
-            FWHM = abs(2 * np.sqrt(2 * np.log(2)) * popt[2])
-            return popt[1], FWHM
-        
-        except: return 0,0
+        if not self.waveforms:
+            self.logger.warning("calculating rise time without having Waveforms stored!")
+            return 0,0
+        rise_times = self.waveforms[self.waveforms.min_value < signal_threshold].rise_time
+        return fit_gaussian(rise_times, nr_bins)
 
 
     def calculate_transit_time(self, signal_threshold, nr_bins = 5000):
-
-        if not self.waveforms: self.logger.warning("calculating transit time without having Waveforms stored!")
-        transit_times = np.array([])
-        for wf in self.waveforms:
-            if wf.min_value < signal_threshold: transit_times = np.append(transit_times, wf.transit_time)
-        transit_times = np.extract(np.isfinite(transit_times), transit_times)
-        
-        if len(transit_times) == 0: return 0,0
-
-        try:
-            hist, bins = np.histogram(transit_times, bins=nr_bins)
-
-            mask = np.ones(nr_bins, dtype=bool) & (hist[:] != 0)
-            x_fit = bins[:-1][mask] + np.diff(bins)[0] / 2
-            y_fit = hist[mask]
-
-            popt, _ = optimize.curve_fit(gaussian, x_fit, y_fit, p0=[np.max(y_fit), np.mean(x_fit), np.std(x_fit)])
-            FWHM = abs(2 * np.sqrt(2 * np.log(2)) * popt[2])
-            return popt[1], FWHM
-        
-        except: return 0,0
+        if not self.waveforms:
+            self.logger.warning("calculating transit time without having Waveforms stored!")
+            return 0,0
+        transit_times = self.waveforms[self.waveforms.min_value < signal_threshold].transit_time
+        return fit_gaussian(transit_times, nr_bins)
 
 
     def get_average_wf(self):
         if not self.waveforms: self.logger.warning("calculating average WF without having Waveforms stored!")
-        xValues = np.array([wf.time for wf in self.waveforms])
-        averageX = np.mean(xValues, axis=0)
-        yValues = np.array([wf.signal for wf in self.waveforms])
-        averageY = np.mean(yValues, axis=0)
+        averageX = self.waveforms.time
+        averageY = np.mean(self.waveforms.signal, axis=0)
         return (averageX, averageY)
 
 
     def get_baseline_mean(self):
         if not self.waveforms: self.logger.warning("calculating baseline without having Waveforms stored!")
-        means = [wf.mean for wf in self.waveforms]
-        mean, FWHM = norm.fit(means)
+        mean, FWHM = norm.fit(self.waveforms.mean)
         return mean, FWHM
         # return np.mean(means), np.std(means)
 
@@ -356,54 +303,70 @@ class Measurement:
         if not self.waveforms: self.logger.warning("subtracting baseline without having Waveforms stored!")
         if baseline == None:
             baseline = self.get_baseline_mean()
-        for wf in self.waveforms:
-            wf.subtract_baseline(baseline[0])
+        self.waveforms.subtract_baseline(baseline[0])
 
 
     def filter_by_threshold(self, signal_threshold):
         if not self.waveforms: self.logger.warning("filter Waveforms without having Waveforms stored!")
-        self.waveforms = [wf for wf in self.waveforms if wf.min_value <= signal_threshold]
+        self.waveforms = self.waveforms[self.waveforms.min_value <= signal_threshold]
         self.filtered_by_threshold = True
 
 
     def filter_by_gain(self, gain_threshold):
         if not self.waveforms: self.logger.warning("filter Waveforms without having Waveforms stored!")
-        self.waveforms = [wf for wf in self.waveforms if wf.calculate_gain() >= gain_threshold]
+        self.waveforms = self.waveforms[self.waveforms.gain >= gain_threshold]
         self.filtered_by_threshold = True
 
 
-    def measure_metadict(self, signal_threshold, only_waveform_characteristics=False):
+    def measure_waveform_characteristics(self, signal_threshold, nr_bins=500, nr_bins_transit_time=5000):
+
+        # the stored waveforms are analysed as a single chunk with the accumulators of utils.Statistics.WaveformStatistics,
+        # the same path as the chunk-wise analysis of data on file (DataHandler.recalculate_metadicts) or of chunked captures.
+        # the histograms do not depend on the chunking, so the fitted values are identical. only the baseline
+        # (running mean and variance) can differ by floating point rounding between one chunk and merged chunks.
+        # returns the waveform part of the metadict
+
+        if not self.waveforms:
+            self.logger.warning("calculating waveform characteristics without having Waveforms stored!")
+            return {}
+        if self.filtered_by_threshold:
+            print("WARNING: calculating occupancy on filtered Dataset. Value might be incorrect")
+            self.logger.warning("calculating occupancy on filtered Dataset. Value might be incorrect")
+
+        from utils.Statistics import WaveformStatistics   # placed here to avoid circular imports
+
+        statistics = WaveformStatistics(signal_threshold)
+        statistics.update(self.waveforms)
+        return statistics.finalize(nr_bins, nr_bins_transit_time)
+
+
+    def measure_metadict(self, signal_threshold, only_waveform_characteristics=False, only_device_metadata=False, snapshot=None):
+
+        # only_device_metadata: read only the device states (has to happen before the setup changes),
+        # the waveform characteristics can then be added later, e.g. by the worker of utils.Pipeline.ScanPipeline
+        # snapshot: device states (or a Future of them) from utils.Snapshot, queried now if None
 
         meta_dict = self.metadict
         
         if not only_waveform_characteristics:	
+            with StageTimeline.Instance().stage("device metadata wait"):
+                if snapshot is None: snapshot = snapshot_devices()
+                if isinstance(snapshot, Future): snapshot = snapshot.result()
+
             meta_dict["pmt_id"]                = self.getPMT_ID() if self.getPMT_ID() else -1
-            meta_dict["time"]                  = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            meta_dict["theta [°]"]             = round( Rotation.Instance().get_position()[1],    2)
-            meta_dict["phi [°]"]               = round( Rotation.Instance().get_position()[0],    2)
-            meta_dict["Dy10 [V]"]              = round( uBase.Instance().getDy10(),               2)
-            meta_dict["Powermeter [pW]"]       = round( Powermeter.Instance().get_power() * 1e12, 3)
-            meta_dict["Laser satus"]           = Laser.Instance().get_ld()
-            meta_dict["Laser temp [°C]"]       = round( Laser.Instance().get_temp(),              2)
-            meta_dict["Laser tune [%]"]        = round( Laser.Instance().get_tune_value()/10,     2)
-            meta_dict["Laser pulse freq [Hz]"] = round( Laser.Instance().get_freq(),              2)
-            meta_dict["sgnl threshold [mV]"]   = round( signal_threshold,                         2)
+            meta_dict["time"]                  = snapshot["time"]
+            meta_dict["theta [°]"]             = round( snapshot["theta [°]"],             2)
+            meta_dict["phi [°]"]               = round( snapshot["phi [°]"],               2)
+            meta_dict["Dy10 [V]"]              = round( snapshot["Dy10 [V]"],              2)
+            meta_dict["Powermeter [pW]"]       = round( snapshot["Powermeter [pW]"],       3)
+            meta_dict["Laser satus"]           = snapshot["Laser satus"]
+            meta_dict["Laser temp [°C]"]       = round( snapshot["Laser temp [°C]"],       2)
+            meta_dict["Laser tune [%]"]        = round( snapshot["Laser tune [%]"],        2)
+            meta_dict["Laser pulse freq [Hz]"] = round( snapshot["Laser pulse freq [Hz]"], 2)
+            meta_dict["sgnl threshold [mV]"]   = round( signal_threshold,                  2)
                 
-        meta_dict["occ [%]"]                     = round(self.calculate_occ(signal_threshold) * 100,          3)
-        meta_dict["avg amplitude [mV]"]          = round(self.calculate_avg_amplitude(signal_threshold)[0],   3)
-        meta_dict["std amplitude [mV]"]          = round(self.calculate_avg_amplitude(signal_threshold)[1],   3)
-        meta_dict["gain"]                        = round(self.calculate_gain(signal_threshold)[0],            3)
-        meta_dict["gain spread"]                 = round(self.calculate_gain(signal_threshold)[1],            3)
-        meta_dict["charge [pC]"]                 = round(self.calculate_charge(signal_threshold)[0] * 1e12,   3)
-        meta_dict["charge spread [pC]"]          = round(self.calculate_charge(signal_threshold)[1] * 1e12,   3)
-        meta_dict["rise time [ns]"]              = round(self.calculate_rise_time(signal_threshold)[0],       3)
-        meta_dict["rise time spread [ns]"]       = round(self.calculate_rise_time(signal_threshold)[1],       3)
-        meta_dict["transit time [ns]"]           = round(self.calculate_transit_time(signal_threshold)[0],    3)
-        meta_dict["transit time spread [ns]"]    = round(self.calculate_transit_time(signal_threshold)[1],    3)
-        meta_dict["baseline [mV]"]               = round(self.calculate_baseline(signal_threshold)[0],        3)
-        meta_dict["baseline spread [mV]"]        = round(self.calculate_baseline(signal_threshold)[1],        3)
-        meta_dict["peak to valley ratio"]        = round(self.calculate_ptv(signal_threshold)[0],             3)
-        meta_dict["peak to valley ratio spread"] = round(self.calculate_ptv(signal_threshold)[1],             3)
+        if not only_device_metadata:
+            meta_dict.update(self.measure_waveform_characteristics(signal_threshold))
 
         self.setMetadict(meta_dict)
 
@@ -411,7 +374,26 @@ class Measurement:
 
 ###-----------------------------------------------------------------
 
-    def write_to_file(self, hdf5_connection=None):
+    def write_to_file(self, hdf5_connection=None, raw_adc=None):
+
+        # raw_adc: store int16 ADC codes instead of float32 mV. defaults to config.STORE_RAW_ADC
+        self._write_waveforms(hdf5_connection, raw_adc, append=False)
+
+
+    def append_to_file(self, hdf5_connection=None, raw_adc=None):
+
+        # appends the waveforms to the datasets under the hdf5 key, which are created (resizable) on the first call.
+        # used to write the chunks of a scan point one after another (TestingProcedures.measure_point).
+        # raw_adc only matters for the first chunk, later chunks follow the existing dataset
+        self._write_waveforms(hdf5_connection, raw_adc, append=True)
+
+
+    def _write_waveforms(self, hdf5_connection, raw_adc, append):
+
+        if raw_adc is None: raw_adc = config.STORE_RAW_ADC
+        if raw_adc and not self.waveforms.is_raw:
+            self.logger.warning("raw ADC storage requested without unmodified ADC data stored. Will store mV instead.")
+            raw_adc = False
 
         close_on_end = False
         if not hdf5_connection:
@@ -419,15 +401,56 @@ class Measurement:
             close_on_end = True
 
         h5_key = self.hdf5_key if self.hdf5_key else f"HV{self.metadict['Dy10 [V]']}/theta{self.metadict['theta [°]']}/phi{self.metadict['phi [°]']}"
-        dataset = hdf5_connection.create_dataset(f"{h5_key}/dataset",
-                                                 (len(self.waveforms), len(self.waveforms[0].time), 3),
-                                                 dtype=np.float32,
-                                                 compression="gzip",
-                                                 compression_opts=6)
 
-        dataset[:,:,0] = [wf.time for wf in self.waveforms]
-        dataset[:,:,1] = [wf.signal for wf in self.waveforms]
-        dataset[:,:,2] = [wf.trigger for wf in self.waveforms]
+        # layout: one shared time axis, one trigger time per waveform, channels of the dataset are (signal, [trigger])
+        # the trigger trace is only written if it was kept (config.PICOSCOPE_STORE_TRIGGER_TRACE)
+        store_trigger = self.waveforms.has_trigger_trace
+        nr_waveforms  = len(self.waveforms)
+
+        if append and f"{h5_key}/dataset" in hdf5_connection:
+
+            dataset      = hdf5_connection[f"{h5_key}/dataset"]
+            trigger_time = hdf5_connection[f"{h5_key}/trigger_time"]
+
+            raw_adc       = np.issubdtype(dataset.dtype, np.integer)
+            store_trigger = dataset.shape[2] > 1
+            if raw_adc and not self.waveforms.is_raw:
+                raise Exception(f"ERROR: cannot append mV data to the raw ADC dataset {h5_key}")
+            if store_trigger and not self.waveforms.has_trigger_trace:
+                raise Exception(f"ERROR: cannot append data without trigger trace to the dataset {h5_key}")
+
+            start = dataset.shape[0]
+            dataset.resize(start + nr_waveforms, axis=0)
+            trigger_time.resize(start + nr_waveforms, axis=0)
+
+        else:
+
+            start = 0
+            hdf5_connection.create_dataset(f"{h5_key}/time", data=self.waveforms.time, dtype=np.float32)
+            trigger_time = hdf5_connection.create_dataset(f"{h5_key}/trigger_time",
+                                                          (nr_waveforms,),
+                                                          maxshape=(None,) if append else None,
+                                                          dtype=np.float32)
+            dataset = hdf5_connection.create_dataset(f"{h5_key}/dataset",
+                                                     (nr_waveforms, self.waveforms.nr_samples, 2 if store_trigger else 1),
+                                                     maxshape=(None, self.waveforms.nr_samples, 2 if store_trigger else 1) if append else None,
+                                                     dtype=np.int16 if raw_adc else np.float32,
+                                                     compression="gzip",
+                                                     compression_opts=6)
+            if raw_adc:
+                dataset.attrs["signal adc range"]  = self.waveforms.signal_range
+                dataset.attrs["max adc"]           = self.waveforms.max_adc
+                if store_trigger: dataset.attrs["trigger adc range"] = self.waveforms.trigger_range
+
+        rows = slice(start, start + nr_waveforms)
+        trigger_time[rows] = self.waveforms.trigger_time
+
+        if raw_adc:
+            dataset[rows,:,0] = self.waveforms.signal_adc
+            if store_trigger: dataset[rows,:,1] = self.waveforms.trigger_adc
+        else:
+            dataset[rows,:,0] = self.waveforms.signal
+            if store_trigger: dataset[rows,:,1] = self.waveforms.trigger
 
         for key in self.metadict:
             dataset.attrs[key] = self.metadict[key]
@@ -447,13 +470,63 @@ class Measurement:
 
         metadict = {}
         for key in dataset.attrs.keys():
+            if key in self.storage_attributes: continue
             metadict[key] = dataset.attrs[key]
         self.setMetadict(metadict)
 
-        self.setWaveforms(time=dataset[:,:,0], signal=dataset[:,:,1], trigger=dataset[:,:,2])
+        self.setWaveforms(**self._read_waveforms(hdf5_connection[self.hdf5_key], slice(None)))
 
         if close_on_end:
             hdf5_connection.close()
+
+
+    def read_chunks_from_file(self, hdf5_connection=None, chunk_size=None):
+
+        # generator of WaveformBatches of at most chunk_size waveforms (config.ANALYSIS_CHUNK_SIZE) read from the file,
+        # to be analysed with the accumulators of utils.Statistics in constant memory.
+        # the stored waveforms of the Measurement are not touched
+
+        if not chunk_size: chunk_size = config.ANALYSIS_CHUNK_SIZE
+
+        close_on_end = False
+        if not hdf5_connection:
+            hdf5_connection = h5py.File(os.path.join(self.filepath,self.filename), 'r')
+            close_on_end = True
+
+        group = hdf5_connection[self.hdf5_key]
+        nr_waveforms = group["dataset"].shape[0]
+
+        try:
+            for start in range(0, nr_waveforms, chunk_size):
+                yield self._make_batch(**self._read_waveforms(group, slice(start, start + chunk_size)))
+        finally:
+            if close_on_end:
+                hdf5_connection.close()
+
+
+    def _read_waveforms(self, group, rows):
+
+        # reads the given rows of the waveform data of an hdf5 group. returns the arguments of setWaveforms
+
+        dataset = group["dataset"]
+
+        if "time" not in group:
+            # legacy layout: channels (time, signal, trigger) with the time axis repeated for every waveform
+            return dict(time=dataset[0,:,0], signal=dataset[rows,:,1], trigger=dataset[rows,:,2])
+
+        # trigger trace (second channel) and trigger times are both optional, at least one of them is stored
+        arrays = dict(time         = group["time"][:],
+                      signal       = dataset[rows,:,0],
+                      trigger      = dataset[rows,:,1]            if dataset.shape[2] > 1    else np.array([]),
+                      trigger_time = group["trigger_time"][rows]  if "trigger_time" in group else np.array([]))
+
+        if np.issubdtype(dataset.dtype, np.integer):
+            # raw ADC codes, converted to mV when first needed
+            arrays["signal_range"]  = int(dataset.attrs["signal adc range"])
+            arrays["trigger_range"] = int(dataset.attrs["trigger adc range"]) if arrays["trigger"].size else None
+            arrays["max_adc"]       = int(dataset.attrs["max adc"])
+
+        return arrays
     
 
     def read_metadict_from_file(self, hdf5_connection = None):
@@ -467,6 +540,7 @@ class Measurement:
 
         metadict = {}
         for key in dataset.attrs.keys():
+            if key in self.storage_attributes: continue
             metadict[key] = dataset.attrs[key]
         self.setMetadict(metadict)
 
@@ -619,15 +693,9 @@ class Measurement:
 
     def plot_ampl_to_gain(self):
 
-        ampl_list = []
-        gain_list = []
-        for wf in self.waveforms:
-            ampl_list.append(wf.min_value)
-            gain_list.append(wf.calculate_gain())
-
         fig, ax = plt.subplots()
 
-        ax.scatter(np.array(ampl_list), np.array(gain_list))
+        ax.scatter(self.waveforms.min_value, self.waveforms.gain)
 
         ax.set_xlabel("amplitude [mV]")
         ax.set_ylabel("gain")
@@ -654,10 +722,10 @@ class Measurement:
         if mode not in ["amplitude", "gain", "charge", "amplitude_all"]:
             return
 
-        if mode == "amplitude": data = [wf.min_value for wf in self.waveforms]
-        if mode == "gain":      data = [wf.calculate_gain() for wf in self.waveforms]
-        if mode == "charge":    data = [wf.calculate_charge() for wf in self.waveforms]
-        if mode == "amplitude_all": data = [value for wf in self.waveforms for value in wf.signal]
+        if mode == "amplitude": data = self.waveforms.min_value
+        if mode == "gain":      data = self.waveforms.gain
+        if mode == "charge":    data = self.waveforms.charge
+        if mode == "amplitude_all": data = self.waveforms.signal.ravel()
 
         if not nr_bins:
             nr_bins = min(max(int(len(data) / 100), 10), 500)
@@ -724,7 +792,7 @@ class Measurement:
             print(f"plotting transit times without having Waveforms stored!")
             return
 
-        transit_times = [wf.transit_time for wf in self.waveforms]
+        transit_times = self.waveforms.transit_time
 
         if not nr_bins:
             nr_bins = max(int(len(transit_times) / 100), 10)
@@ -789,13 +857,23 @@ class DCS_Measurement:
                  filename=None,
                  filepath=None,
                  hdf5_key=None,
-                 pmt_id  =None):
+                 pmt_id  =None,
+                 signal_range=None,
+                 max_adc=None):
 
         self.logger = logging.getLogger(type(self).__name__)
         self.logger.debug(f"{type(self).__name__} initialized")
 
         self.filtered_by_threshold = False
 
+        # dataset attributes describing the raw ADC storage, not part of the metadict
+        self.storage_attributes = ["signal adc range", "max adc"]
+
+        self.signal_adc   = None
+        self._signal      = None
+        self.signal_range = signal_range
+        self.max_adc      = max_adc
+
         self.default_metadict = {
                 "pmt_id":                   -1,
                 "time":                     -1,
@@ -816,7 +894,7 @@ class DCS_Measurement:
         self.metadict  = self.default_metadict
 
         if signal_data.size or time_data.size:
-            self.setData(signal=signal_data, time=time_data)
+            self.setData(signal=signal_data, time=time_data, signal_range=signal_range, max_adc=max_adc)
 
         if metadict:
             self.setMetadict(metadict)
@@ -828,13 +906,35 @@ class DCS_Measurement:
 
 ###-----------------------------------------------------------------
 
-    def setData(self, signal = np.array([]), time = np.array([])):
+    def setData(self, signal = np.array([]), time = np.array([]), signal_range = None, max_adc = None):
         if signal.size and time.size:
-            assert signal.size == time.size
-            self.signal = np.array(signal)
+            # legacy data carries one (identical) time row per waveform
+            if time.ndim == 2: time = time[0]
+            assert signal.shape[-1] == time.size
+            if np.issubdtype(signal.dtype, np.integer):
+                # raw ADC codes, converted to mV when first needed
+                assert signal_range is not None and max_adc, "raw ADC data need a voltage range and max_adc"
+                self.signal_range = signal_range
+                self.max_adc      = max_adc
+                self.signal_adc   = np.array(signal)
+                self._signal      = None
+            else:
+                self.signal = np.array(signal)
             self.time   = np.array(time)
         else: raise Exception("ERROR: either waveforms or signal, trigger and time arrays need to be handed over")
 
+    @property
+    def signal(self):
+        if self._signal is None and self.signal_adc is not None:
+            self._signal = adc2mV(self.signal_adc, self.signal_range, self.max_adc)
+        return self._signal
+
+    @signal.setter
+    def signal(self, value):
+        # the mV data do not match the ADC codes anymore
+        self._signal    = value
+        self.signal_adc = None
+
     def getSignal(self):
         return self.signal
     
@@ -880,7 +980,7 @@ class DCS_Measurement:
 ###-----------------------------------------------------------------
 
     def __len__(self):
-        return len(self.signal)
+        return len(self.signal_adc if self.signal_adc is not None else self.signal)
 
 ###-----------------------------------------------------------------
 
@@ -889,37 +989,54 @@ class DCS_Measurement:
 
 
     def subtract_baseline(self, baseline=None):
-        if not self.signal: self.logger.warning("subtracting baseline without having signal stored!")
+        if self.signal is None: self.logger.warning("subtracting baseline without having signal stored!")
         if baseline == None:
             baseline = self.get_baseline_mean()
         self.signal = self.signal - baseline
 
 
     def get_darkcounts(self, signal_threshold):
-        peaks, _ = find_peaks(-self.signal.flatten(), height=-signal_threshold)
+        if self.signal_adc is not None and self._signal is None:
+            # count on the ADC codes directly, the threshold is converted instead of the data
+            scale = channelInputRanges[self.signal_range] / self.max_adc
+            peaks, _ = find_peaks(-self.signal_adc.ravel().astype(np.int32), height=-signal_threshold/scale)
+        else:
+            peaks, _ = find_peaks(-self.signal.ravel(), height=-signal_threshold)
         return len(peaks)
     
 
     def get_measurement_time(self):
-        return self.time[:,-1].sum() / 1_000_000_000 # convert ns -> s
-
-
-    def measure_metadict(self, signal_threshold):
-
-        meta_dict = {
-            "pmt_id":                 self.getPMT_ID() if self.getPMT_ID() else -1,
-            "time":                   datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "theta [°]":              round( Rotation.Instance().get_position()[1],     3),
-            "phi [°]":                round( Rotation.Instance().get_position()[0],     3),
-            "Dy10 [V]":               round( uBase.Instance().getDy10(),                3),
-            "Powermeter [pW]":        round( Powermeter.Instance().get_power() * 1e12,  3),
-            "Laser satus":            Laser.Instance().get_ld()                           ,
-            "sgnl threshold [mV]":    round( signal_threshold,                          3)
-            }
+        return self.time[-1] * len(self) / 1_000_000_000 # convert ns -> s
+
+
+    def measure_metadict(self, signal_threshold, only_dark_counts=False, only_device_metadata=False, snapshot=None):
+
+        # only_device_metadata: read only the device states (has to happen before the setup changes),
+        # the dark counts can then be added later, e.g. by the worker of utils.Pipeline.ScanPipeline
+        # snapshot: device states (or a Future of them) from utils.Snapshot, queried now if None
+
+        if only_dark_counts:
+            meta_dict = self.metadict
+        else:
+            with StageTimeline.Instance().stage("device metadata wait"):
+                if snapshot is None: snapshot = snapshot_devices()
+                if isinstance(snapshot, Future): snapshot = snapshot.result()
+
+            meta_dict = {
+                "pmt_id":                 self.getPMT_ID() if self.getPMT_ID() else -1,
+                "time":                   snapshot["time"],
+                "theta [°]":              round( snapshot["theta [°]"],        3),
+                "phi [°]":                round( snapshot["phi [°]"],          3),
+                "Dy10 [V]":               round( snapshot["Dy10 [V]"],         3),
+                "Powermeter [pW]":        round( snapshot["Powermeter [pW]"],  3),
+                "Laser satus":            snapshot["Laser satus"]               ,
+                "sgnl threshold [mV]":    round( signal_threshold,             3)
+                }
                 
-        meta_dict["measurement time [s]"]  = round(self.get_measurement_time(), 6)
-        meta_dict["dark counts"]           = self.get_darkcounts(signal_threshold)
-        meta_dict["dark rate [Hz]"]        = meta_dict["dark counts"] / meta_dict["measurement time [s]"]
+        if not only_device_metadata:
+            meta_dict["measurement time [s]"]  = round(self.get_measurement_time(), 6)
+            meta_dict["dark counts"]           = self.get_darkcounts(signal_threshold)
+            meta_dict["dark rate [Hz]"]        = meta_dict["dark counts"] / meta_dict["measurement time [s]"]
 
         self.setMetadict(meta_dict)
 
@@ -927,7 +1044,14 @@ class DCS_Measurement:
 
 ###-----------------------------------------------------------------
 
-    def write_to_file(self, hdf5_connection=None):
+    def write_to_file(self, hdf5_connection=None, raw_adc=None):
+
+        # raw_adc: store int16 ADC codes instead of float32 mV. defaults to config.STORE_RAW_ADC
+
+        if raw_adc is None: raw_adc = config.STORE_RAW_ADC
+        if raw_adc and self.signal_adc is None:
+            self.logger.warning("raw ADC storage requested without unmodified ADC data stored. Will store mV instead.")
+            raw_adc = False
 
         close_on_end = False
         if not hdf5_connection:
@@ -936,14 +1060,20 @@ class DCS_Measurement:
 
         h5_key = self.hdf5_key if self.hdf5_key else f"HV{self.metadict['Dy10 [V]']}/theta{self.metadict['theta [°]']}/phi{self.metadict['phi [°]']}"
 
+        # layout: one shared time axis, the only channel of the dataset is the signal
+        hdf5_connection.create_dataset(f"{h5_key}/time", data=self.time, dtype=np.float32)
+        data = self.signal_adc if raw_adc else self.signal
         dataset = hdf5_connection.create_dataset(f"{h5_key}/dataset",
-                                                 (self.signal.shape[0], self.signal.shape[1], 2),
-                                                 dtype=np.float32,
+                                                 (data.shape[0], data.shape[1], 1),
+                                                 dtype=np.int16 if raw_adc else np.float32,
                                                  compression="gzip",
                                                  compression_opts=6)
 
-        dataset[:,:,0] = self.time
-        dataset[:,:,1] = self.signal
+        dataset[:,:,0] = data
+
+        if raw_adc:
+            dataset.attrs["signal adc range"] = self.signal_range
+            dataset.attrs["max adc"]          = self.max_adc
 
         for key in self.metadict:
             dataset.attrs[key] = self.metadict[key]
@@ -963,10 +1093,21 @@ class DCS_Measurement:
 
         metadict = {}
         for key in dataset.attrs.keys():
+            if key in self.storage_attributes: continue
             metadict[key] = dataset.attrs[key]
         self.setMetadict(metadict)
 
-        self.setData(time=dataset[:,:,0], signal=dataset[:,:,1])
+        if "time" in hdf5_connection[self.hdf5_key] and np.issubdtype(dataset.dtype, np.integer):
+            # raw ADC codes, converted to mV when first needed
+            self.setData(time=hdf5_connection[self.hdf5_key]["time"][:],
+                         signal=dataset[:,:,0],
+                         signal_range=int(dataset.attrs["signal adc range"]),
+                         max_adc=int(dataset.attrs["max adc"]))
+        elif "time" in hdf5_connection[self.hdf5_key]:
+            self.setData(time=hdf5_connection[self.hdf5_key]["time"][:], signal=dataset[:,:,0])
+        else:
+            # legacy layout: channels (time, signal) with the time axis repeated for every waveform
+            self.setData(time=dataset[0,:,0], signal=dataset[:,:,1])
 
         if close_on_end:
             hdf5_connection.close()
@@ -983,6 +1124,7 @@ class DCS_Measurement:
 
         metadict = {}
         for key in dataset.attrs.keys():
+            if key in self.storage_attributes: continue
             metadict[key] = dataset.attrs[key]
         self.setMetadict(metadict)
 
@@ -995,7 +1137,8 @@ class DCS_Measurement:
         # clears the data (in an attempt to use less memory when not needed)
 
         del self.time
-        del self.signal
+        self._signal    = None
+        self.signal_adc = None
 
     ###-----------------------------------------------------------------
 
@@ -1014,7 +1157,7 @@ class DCS_Measurement:
             start_idx = max(0, idx - 150)
             end_idx = min(len(flat_signal), idx + 150)
             range = end_idx - start_idx
-            ax.plot(self.time[0][0:range], flat_signal[start_idx:end_idx], color=c)
+            ax.plot(self.time[0:range], flat_signal[start_idx:end_idx], color=c)
         
         # set axis labels and title
         ax.set_xlabel('Time')
@@ -1046,7 +1189,7 @@ class DCS_Measurement:
 
         fig, ax = plt.subplots()
 
-        ax.plot(self.time[0][0:len(average_peak)], average_peak)
+        ax.plot(self.time[0:len(average_peak)], average_peak)
 
         # set axis labels and title
         ax.set_xlabel('Time')
@@ -1069,7 +1212,7 @@ class DCS_Measurement:
         peak_indices, _ = find_peaks(-flat_signal, height=-signal_threshold)
 
         peak_diffs = np.diff(peak_indices)
-        timebase = np.diff(self.time[0])[0]
+        timebase = np.diff(self.time)[0]
         data = peak_diffs * timebase
 
         if not nr_bins:
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+import itertools
+import logging
+
+import config
+
+# ordering of scan grids for the rotation stage and a timing model of its stepper axes.
+# the axes move directly between points and are only homed every config.ROTATION_REHOME_INTERVAL moves
+# (see Rotation.needs_homing), so the travel is minimal if neighbouring points are close: serpentine ordering
+
+
+def serpentine(outer_list, inner_list):
+
+    # boustrophedon ordering of the grid outer x inner: the inner axis runs forth and back
+    # instead of returning to its start for every outer value
+
+    points = []
+    for i, outer in enumerate(outer_list):
+        inner_values = list(inner_list) if i % 2 == 0 else list(inner_list)[::-1]
+        points += [(outer, inner) for inner in inner_values]
+    return points
+
+
+class MotionModel:
+
+    # time a move of the stage takes: fixed overhead (PSU on/off, settling) plus the steps times the step delay.
+    # homing travels back to 0 first. the step delay is read from the stage (Rotation.get_speed) if not given
+
+    def __init__(self, step_delay=None, rehome_interval=None):
+
+        self.steps_per_degree = config.ROTATION_STEPS_PER_TURN / 360
+        self.rehome_interval  = rehome_interval if rehome_interval else config.ROTATION_REHOME_INTERVAL
+
+        if step_delay is None:
+            try:
+                from devices.Rotation import Rotation
+                step_delay = Rotation.Instance().get_speed() * config.ROTATION_SPEED_UNIT
+            except Exception:
+                logging.getLogger("OMCU").warning("could not read the rotation speed, using config.ROTATION_STEP_DELAY for the motion model")
+                step_delay = config.ROTATION_STEP_DELAY
+        self.step_delay = step_delay
+
+    def travel_time(self, start, target):
+        return abs(target - start) * self.steps_per_degree * self.step_delay
+
+    def move_time(self, start, target, homing=False):
+        if start == target: return 0
+        if homing: return config.ROTATION_MOVE_OVERHEAD + config.ROTATION_HOMING_OVERHEAD + self.travel_time(start, 0) + self.travel_time(0, target)
+        return config.ROTATION_MOVE_OVERHEAD + self.travel_time(start, target)
+
+    def path_time(self, points, start=(0, 0)):
+
+        # estimated time to move along points = [(phi, theta), ...], starting at the homed position,
+        # with the homing interval applied per axis like Rotation.set_position does
+
+        total = 0
+        position = list(start)
+        moves = [0, 0]
+        for point in points:
+            for axis in (0, 1):
+                if point[axis] == position[axis]: continue
+                homing = moves[axis] + 1 >= self.rehome_interval
+                total += self.move_time(position[axis], point[axis], homing)
+                moves[axis] = 0 if homing else moves[axis] + 1
+                position[axis] = point[axis]
+        return total
+
+
+class MotionPlanner:
+
+    # orders the points of an angular scan for minimal stage travel
+
+    def __init__(self, model=None):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.model  = model if model else MotionModel()
+
+    def plan_grid(self, phi_list, theta_list):
+
+        # returns the points (phi, theta) of the grid phi_list x theta_list in the fastest of the candidate orders:
+        # row by row (old order) and serpentine with either axis as outer axis
+
+        phi_list, theta_list = list(phi_list), list(theta_list)
+
+        candidates = {
+            "row by row":          list(itertools.product(phi_list, theta_list)),
+            "serpentine in theta": serpentine(phi_list, theta_list),
+            "serpentine in phi":   [(phi, theta) for theta, phi in serpentine(theta_list, phi_list)],
+            }
+        times = {name: self.model.path_time(points) for name, points in candidates.items()}
+        best  = min(times, key=times.get)
+
+        self.logger.info(f"estimated stage travel time: " + ", ".join(f"{name}: {round(t/60, 1)} min" for name, t in times.items()) + f". using {best}")
+        self.estimated_time = times[best]
+        return candidates[best]
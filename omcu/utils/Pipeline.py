@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+import logging
+import queue
+import threading
+
+import config
+from utils.Timeline import StageTimeline
+
+
+class ScanPipeline:
+
+    # runs the analysis and writing of captured datasets in a background worker thread,
+    # so it hides behind the moving / HV settling / capturing of the next point on the main thread.
+    #
+    # everything that talks to devices (capture, device metadata) has to stay on the main thread,
+    # the worker only calls process(dataset, *args). at most max_queued datasets wait for the worker
+    # (bounds the memory), submit() blocks if the queue is full.
+    # with max_queued = 0 the datasets are processed right away on the main thread.
+    # a dataset the worker fails on is logged with its HDF5 key, the queued datasets of the other points are still
+    # processed. the first error is raised on the main thread with the next submit() (ends the scan) or in close().
+    #
+    # usage:
+    #     with ScanPipeline(process) as pipeline:
+    #         for point in points:
+    #             ... set up, capture, read device metadata ...
+    #             pipeline.submit(dataset)
+
+    def __init__(self, process, max_queued = None):
+
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.process    = process
+        self.max_queued = config.PIPELINE_QUEUE_SIZE if max_queued is None else max_queued
+
+        self.error    = None
+        self.queue    = None
+        self.worker   = None
+        self.timeline = StageTimeline.Instance()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # finish the queued datasets also if the main thread failed, so the captured data is not lost
+        self.close(raise_error = exc_type is None)
+
+    def start(self):
+        if not self.max_queued: return
+        self.queue  = queue.Queue(maxsize=self.max_queued)
+        self.worker = threading.Thread(target=self._work, name=type(self).__name__, daemon=True)
+        self.worker.start()
+
+    def submit(self, dataset, *args):
+        # args are handed to process after the dataset (e.g. the scan point).
+        # the worker times its stages for the scan point of the caller (utils.Timeline).
+        # the dataset is queued before an earlier error is raised, so it is processed as well
+        if self.worker is None:
+            self.process(dataset, *args)
+        else:
+            with self.timeline.stage("pipeline wait"):
+                self.queue.put((dataset, args, self.timeline.current()))
+        self._raise_worker_error()
+
+    def close(self, raise_error = True):
+        if self.worker is not None:
+            self.queue.put(None)
+            with self.timeline.stage("pipeline wait"):
+                self.worker.join()
+            self.worker = None
+        if raise_error: self._raise_worker_error()
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None: return
+            dataset, args, context = item
+            try:
+                with self.timeline.attach(context):
+                    self.process(dataset, *args)
+            except Exception as error:
+                self.logger.exception(f"error while processing dataset {dataset.getHDF5_Key()} in the background, its data is not stored completely")
+                if self.error is None: self.error = error
+
+    def _raise_worker_error(self):
+        if self.error:
+            error, self.error = self.error, None
+            raise error
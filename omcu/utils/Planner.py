@@ -0,0 +1,475 @@
+#!/usr/bin/python3
+
+import collections
+import csv
+import glob
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import numpy as np
+from utils.MotionPlanner import MotionModel, MotionPlanner
+from utils.Settling import SettlingModel
+
+# prediction of the duration and data size of the configured run (omcu --plan), without any device.
+# every stage of a scan point (see utils.Timeline) has a latency model. the models start from the PLAN_* priors of
+# the config and are calibrated with the timelines of earlier runs:
+#     capture, ADC conversion, metadict, HDF5 write:  offset + rate * captured samples, per procedure and thread
+#     move:            motion model of the rotation stage (utils.MotionPlanner), scaled to the measured move times
+#     HV settling:     offset + rate * |Dy10 step| (utils.Settling.SettlingModel)
+#     laser tune, device metadata wait, tuning, procedure overhead: mean of the measured times
+# the data size is the captured samples times the bytes per captured sample of the data files of the earlier runs
+# (compression and filtering included), the uncompressed size times PLAN_COMPRESSION if there are none.
+# with the ScanPipeline (PIPELINE_QUEUE_SIZE > 0) a point takes the longer of the main thread and the background work
+#
+# the prediction is for *_NR_OF_WAVEFORMS per point. a scan with a statistical target (*_TARGET_*) adapts the nr per point
+# (utils.AdaptiveSampling, tops up included) between *_MIN_NR_OF_WAVEFORMS and *_MAX_NR_OF_WAVEFORMS, which bound the
+# prediction. the uncalibrated tuning assumes full captures, with TUNE_SEQUENTIAL they can stop after the first chunk
+
+
+# procedures in the order of a run: prefix of the config keys, name in the timeline
+PROCEDURES = {"DCS":  "dark count scan",
+              "PCS":  "photocathode scan",
+              "FHVS": "frontal HV scan",
+              "CLS":  "charge linearity scan"}
+
+PROCEDURE_FLAGS = {"DCS": "DARK_COUNT_SCAN", "PCS": "PHOTOCATHODE_SCAN", "FHVS": "FRONTAL_HV_SCAN", "CLS": "CHARGE_LINEARITY_SCAN"}
+
+BLOCK_SAMPLES = 350     # pre + post trigger samples of the block measurements (devices.Picoscope)
+STREAM_DT     = 3.2e-9  # s per sample of the stream measurements (timebase 4)
+
+# stages of a scan point that scale with the captured samples
+SAMPLE_STAGES = [("main",       "capture"),
+                 ("main",       "ADC conversion"),
+                 ("background", "ADC conversion"),
+                 ("background", "metadict"),
+                 ("background", "HDF5 write")]
+
+
+class LatencyModel:
+
+    # time of a stage as a function of the nr of samples: t = offset + rate * samples.
+    # least squares fit of the observations, t / samples if they all have the same size, the prior until there are min_observations
+
+    def __init__(self, prior_rate=0., prior_offset=0., min_observations=3):
+        self.prior_rate       = prior_rate
+        self.prior_offset     = prior_offset
+        self.min_observations = min_observations
+        self.observations     = []
+
+    def add(self, samples, time):
+        if samples > 0: self.observations.append((samples, time))
+
+    @property
+    def calibrated(self):
+        return len(self.observations) >= self.min_observations
+
+    def predict(self, samples):
+
+        if not self.calibrated: return self.prior_offset + self.prior_rate * samples
+
+        sizes, times = np.array(self.observations, dtype=float).T
+        if np.ptp(sizes) > 0:
+            rate, offset = np.polyfit(sizes, times, 1)
+            if rate < 0:   rate, offset = 0., np.mean(times)
+            if offset < 0: rate, offset = np.sum(times) / np.sum(sizes), 0.
+        else:
+            rate, offset = np.sum(times) / np.sum(sizes), 0.
+        return max(0., offset + rate * samples)
+
+
+class MeanModel:
+
+    # mean of the observed times, the prior until there is one
+
+    def __init__(self, prior=0.):
+        self.prior        = prior
+        self.observations = []
+
+    def add(self, time):
+        self.observations.append(time)
+
+    @property
+    def calibrated(self):
+        return len(self.observations) > 0
+
+    def predict(self):
+        return float(np.mean(self.observations)) if self.observations else self.prior
+
+
+def find_timelines(out_path, filename, nr_runs):
+
+    # timelines of the latest nr_runs runs in out_path (one directory per PMT)
+    paths = glob.glob(os.path.join(out_path, "*", filename))
+    return sorted(paths, key=os.path.getmtime)[-nr_runs:] if nr_runs else []
+
+
+class RunPlanner:
+
+    def __init__(self, config, cooldown_time=None, out_path=None):
+
+        # config: the config module of the run (may differ from the default one with --config)
+
+        self.logger = logging.getLogger(type(self).__name__)
+        self.config = config
+        self.cooldown_time = config.COOLDOWN_TIME if cooldown_time is None else cooldown_time
+        self.out_path      = config.OUT_PATH      if out_path      is None else out_path
+        self.timelines = []
+
+        # samples -> s per (procedure, thread, stage). the captures of the dark count scan are streams
+        bytes_per_sample = 4 / config.PLAN_TRANSFER_RATE   # signal and trigger, int16
+        self.stages = {}
+        for abbr, name in PROCEDURES.items():
+            capture_rate = STREAM_DT if abbr == "DCS" else 1 / (BLOCK_SAMPLES * config.PLAN_TRIGGER_RATE)
+            self.stages[(name, "main", "capture")] = LatencyModel(prior_rate=capture_rate + bytes_per_sample)
+            # PLAN_PROCESSING_TIME is shared by the background stages
+            for thread, stage in SAMPLE_STAGES[1:]:
+                prior_rate = config.PLAN_PROCESSING_TIME / 3 if thread == "background" else 0.
+                self.stages[(name, thread, stage)] = LatencyModel(prior_rate=prior_rate)
+
+        self.metadata_wait = {name: MeanModel()                                    for name in PROCEDURES.values()}
+        self.tuning        = {name: MeanModel()                                    for name in PROCEDURES.values()}
+        self.overhead      = {name: MeanModel(prior=config.PLAN_PROCEDURE_OVERHEAD) for name in PROCEDURES.values()}
+        self.laser_tune    = MeanModel(prior=0.1)
+        self.setup         = MeanModel(prior=config.PLAN_SETUP_OVERHEAD)
+        self.analysis      = MeanModel()   # s per captured sample of the run
+
+        window = config.UBASE_SETTLE_WINDOW * config.UBASE_SETTLE_SAMPLE_INTERVAL
+        self.settling       = SettlingModel(nr_observations=10000)
+        self.settling_prior = lambda step: window + abs(step) / config.PLAN_HV_RAMP_RATE
+
+        self.motion       = MotionModel(step_delay=config.ROTATION_STEP_DELAY, rehome_interval=config.ROTATION_REHOME_INTERVAL)
+        self.motion_times = [0., 0.]   # measured, predicted move time of the earlier runs
+
+        self.bytes = {name: [0., 0.] for name in PROCEDURES.values()}   # file size, captured samples of the earlier runs
+
+    #---------------------------
+
+    def calibrate(self, paths):
+
+        # paths: timeline files or run directories containing one
+
+        for path in paths:
+            if os.path.isdir(path): path = os.path.join(path, self.config.TIMELINE_FILE)
+            if not os.path.isfile(path):
+                print(f"WARNING: no timeline found at {path}, not used for the calibration")
+                continue
+            try:
+                self._calibrate_run(path)
+                self.timelines.append(path)
+            except (KeyError, ValueError) as error:
+                print(f"WARNING: could not read the timeline {path} ({error}), not used for the calibration")
+
+    def _calibrate_run(self, path):
+
+        with open(path, newline="") as file:
+            rows = sorted(csv.DictReader(file), key=lambda row: float(row["start [s]"]))
+        run_dir = os.path.dirname(path)
+
+        points    = collections.OrderedDict()   # (procedure, point) -> {"size", (thread, stage) -> s}
+        main_time = collections.defaultdict(float)
+        procedure_time = {}
+        analysis_time  = None
+        run_samples    = 0
+        for row in rows:
+            procedure, point, stage, thread = row["procedure"], row["point"], row["stage"], row["thread"]
+            duration = float(row["duration [s]"])
+
+            if not procedure:
+                if stage in PROCEDURES.values(): procedure_time[stage] = duration
+                if stage == "analysis":          analysis_time = duration
+                continue
+            if procedure not in PROCEDURES.values(): continue
+            if thread == "main": main_time[procedure] += duration
+
+            if not point:
+                if stage == "tuning": self.tuning[procedure].add(duration)
+                continue
+
+            entry = points.setdefault((procedure, point), collections.defaultdict(float))
+            entry[(thread, stage)] += duration
+            if stage == "capture" and row.get("size"):
+                entry["size"] += int(row["size"])
+                run_samples   += int(row["size"])
+
+        # stages per point
+        previous_HV = {}
+        moves = []
+        for (procedure, point), entry in points.items():
+            size = entry["size"]
+            if size:
+                for thread, stage in SAMPLE_STAGES:
+                    self.stages[(procedure, thread, stage)].add(size, entry[(thread, stage)])
+                self.bytes[procedure][1] += size
+            self.metadata_wait[procedure].add(entry[("main", "device metadata wait")])
+
+            if ("main", "laser tune") in entry:
+                self.laser_tune.add(entry[("main", "laser tune")])
+            if ("main", "HV settling") in entry:
+                HV = float(point.split("/")[0].split()[1])
+                if procedure in previous_HV: self.settling.add(HV - previous_HV[procedure], entry[("main", "HV settling")])
+                previous_HV[procedure] = HV
+            if ("main", "move") in entry:
+                theta, phi = (float(part.split()[1]) for part in point.split("/"))
+                moves.append(((phi, theta), entry[("main", "move")]))
+
+        if moves:
+            self.motion_times[0] += sum(duration for _, duration in moves)
+            self.motion_times[1] += self.motion.path_time([point for point, _ in moves])
+
+        # main thread time of the procedures not covered by a stage
+        for procedure, duration in procedure_time.items():
+            self.overhead[procedure].add(max(duration - main_time[procedure], 0))
+
+        # connecting and checking the devices, from the run summary
+        summary_path = os.path.join(run_dir, self.config.TIMELINE_SUMMARY_FILE) if self.config.TIMELINE_SUMMARY_FILE else None
+        if summary_path and os.path.isfile(summary_path):
+            with open(summary_path) as file:
+                run = json.load(file)["procedures"].get("run", {})
+            if "other" in run.get("main", {}) and run.get("wall time [s]"):
+                self.setup.add(run["main"]["other"]["total [s]"])
+
+        if analysis_time is not None and run_samples:
+            self.analysis.add(analysis_time / run_samples)
+
+        # bytes per captured sample of the data files
+        for abbr, procedure in PROCEDURES.items():
+            datafile = os.path.join(run_dir, getattr(self.config, f"{abbr}_DATAFILE"))
+            if not os.path.isfile(datafile) or not any(p == procedure for p, _ in points): continue
+            self.bytes[procedure][0] += os.path.getsize(datafile)
+
+    #---------------------------
+
+    def _settling_time(self, step):
+        predicted = self.settling.predict(step)
+        return predicted if predicted is not None else self.settling_prior(step)
+
+    def _bytes_per_sample(self, procedure):
+        size, samples = self.bytes[procedure]
+        if size and samples: return size / samples
+        channels = 2 if self.config.PICOSCOPE_STORE_TRIGGER_TRACE and procedure != PROCEDURES["DCS"] else 1
+        return (2 if self.config.STORE_RAW_ADC else 4) * channels * self.config.PLAN_COMPRESSION
+
+    def _adaptive(self, abbr):
+        return abbr != "DCS" and any(getattr(self.config, f"{abbr}_TARGET_{target}", None) for target in ("SIGNALS", "GAIN_ERROR", "TTS_ERROR"))
+
+    def _nr_of_waveforms(self, abbr):
+
+        # nominal, fewest and most waveforms per point (like utils.AdaptiveSampling.WaveformCountPlanner)
+
+        default = getattr(self.config, f"{abbr}_NR_OF_WAVEFORMS")
+        if not self._adaptive(abbr): return default, default, default
+        low  = getattr(self.config, f"{abbr}_MIN_NR_OF_WAVEFORMS") or 1
+        high = getattr(self.config, f"{abbr}_MAX_NR_OF_WAVEFORMS") or default
+        return default, min(low, default), max(high, default)
+
+    def _samples(self, abbr, nr_waveforms):
+        # captured samples per point
+        if abbr == "DCS": return self.config.DCS_NR_OF_SAMPLES * self.config.DCS_NR_OF_WAVEFORMS
+        return BLOCK_SAMPLES * nr_waveforms
+
+    def _setup_times(self, abbr):
+
+        # time of the setup (move, HV, laser tune) of every point of the procedure
+
+        config = self.config
+        if abbr == "PCS":
+            planner = MotionPlanner(self.motion)
+            planner.logger.disabled = True
+            points  = planner.plan_grid(config.PCS_PHI_LIST, config.PCS_THETA_LIST)
+            scale   = self.motion_times[0] / self.motion_times[1] if self.motion_times[1] else 1.
+            # the path is planned as a whole, its time is spread evenly over the points
+            return [scale * planner.estimated_time / len(points)] * len(points) if points else []
+
+        if abbr == "FHVS":
+            HVs = list(config.FHVS_HV_LIST)
+            steps = np.diff([config.COOLDOWN_HV] + HVs)
+            return [self._settling_time(step) for step in steps]
+
+        if abbr == "CLS":
+            return [self.laser_tune.predict()] * len(config.CLS_LASER_TUNE_LIST)
+
+        # DCS: the HV is set once for all iterations
+        HVs = list(config.DCS_HV_LIST)
+        steps = np.diff([config.COOLDOWN_HV] + HVs)
+        times = []
+        for step in steps:
+            times += [self._settling_time(step)] + [0.] * (config.DCS_NR_OF_ITERATIONS - 1)
+        return times
+
+    def _tuning_time(self, abbr, procedure):
+
+        # nominal, shortest and longest time of the tuning
+
+        config = self.config
+        if abbr == "DCS" or getattr(config, f"{abbr}_TUNE_MODE") == "none": return 0., 0., 0.
+        if self.tuning[procedure].calibrated:
+            tuning = self.tuning[procedure].predict()
+            return tuning, tuning, tuning
+
+        # prior: every iteration captures the full nr of tuning waveforms, with TUNE_SEQUENTIAL at least one chunk
+        def iterations(nr_waveforms):
+            step = self.stages[(procedure, "main", "capture")].predict(BLOCK_SAMPLES * nr_waveforms) + self._settling_time(1)
+            return getattr(config, f"{abbr}_TUNE_MAX_ITER") * step
+
+        waveforms = getattr(config, f"{abbr}_TUNE_NR_OF_WAVEFORMS")
+        high = iterations(waveforms)
+        low  = iterations(min(config.SEQUENTIAL_CHUNK_SIZE, waveforms)) if config.TUNE_SEQUENTIAL else high
+        return high, low, high
+
+    def _scan_time(self, procedure, setup, sleep, samples):
+
+        # time of the scan points with samples per point: total, main thread and background per point
+
+        main = sum(self.stages[(procedure, "main", stage)].predict(samples) for stage in ("capture", "ADC conversion"))
+        main += sleep + self.metadata_wait[procedure].predict()
+        background = sum(self.stages[(procedure, "background", stage)].predict(samples) for _, stage in SAMPLE_STAGES[2:])
+
+        if self.config.PIPELINE_QUEUE_SIZE:
+            scan = sum(max(main + t, background) for t in setup) + (background if setup else 0.)
+        else:
+            scan = sum(main + t + background for t in setup)
+        return scan, main, background
+
+    def plan_procedure(self, abbr):
+
+        # the ranges are (fewest, most) waveforms per point, with the shortest and longest tuning
+
+        procedure = PROCEDURES[abbr]
+        setup = self._setup_times(abbr)
+        sleep = getattr(self.config, f"{abbr}_MEASUREMENT_SLEEP")
+        nominal, low, high = self._nr_of_waveforms(abbr)
+        samples = {nr_waveforms: self._samples(abbr, nr_waveforms) for nr_waveforms in (nominal, low, high)}
+
+        scan, main, background = self._scan_time(procedure, setup, sleep, samples[nominal])
+        tuning, tuning_low, tuning_high = self._tuning_time(abbr, procedure)
+        overhead  = self.overhead[procedure].predict()
+        nr_points = len(setup)
+        bytes_per_sample = self._bytes_per_sample(procedure)
+
+        return {"points":              nr_points,
+                "adaptive":            self._adaptive(abbr),
+                "waveforms per point": nominal,
+                "waveforms range":     (low, high),
+                "samples":             nr_points * samples[nominal],
+                "samples range":       (nr_points * samples[low], nr_points * samples[high]),
+                "setup [s]":           sum(setup),
+                "main per point [s]":  main,
+                "background per point [s]": background,
+                "tuning [s]":          tuning,
+                "tuning range [s]":    (tuning_low, tuning_high),
+                "duration [s]":        scan + tuning + overhead,
+                "duration range [s]":  (self._scan_time(procedure, setup, sleep, samples[low])[0]  + tuning_low  + overhead,
+                                        self._scan_time(procedure, setup, sleep, samples[high])[0] + tuning_high + overhead),
+                "data size [B]":       nr_points * samples[nominal] * bytes_per_sample,
+                "data size range [B]": (nr_points * samples[low] * bytes_per_sample, nr_points * samples[high] * bytes_per_sample),
+                "data file":           getattr(self.config, f"{abbr}_DATAFILE")}
+
+    def plan(self):
+
+        config = self.config
+        plan = {"procedures": {}}
+        for abbr, procedure in PROCEDURES.items():
+            if getattr(config, PROCEDURE_FLAGS[abbr]): plan["procedures"][procedure] = self.plan_procedure(abbr)
+
+        def total(key):
+            return sum(entry[key] for entry in plan["procedures"].values())
+
+        def total_range(key):
+            return tuple(sum(entry[key][i] for entry in plan["procedures"].values()) for i in (0, 1))
+
+        analysis_rate = self.analysis.predict() if config.ANALYSIS_PERFORM else 0.
+        plan["setup [s]"]         = self.setup.predict()
+        plan["cooldown [s]"]      = 60 * self.cooldown_time + self._settling_time(config.COOLDOWN_HV)
+        plan["laser warm-up [s]"] = 60 * config.LASER_SETUP_TIME
+        plan["analysis [s]"]      = analysis_rate * total("samples")
+        fixed = plan["setup [s]"] + plan["cooldown [s]"] + plan["laser warm-up [s]"]
+        plan["duration [s]"]      = fixed + plan["analysis [s]"] + total("duration [s]")
+        plan["duration range [s]"] = tuple(fixed + analysis_rate * samples + duration
+                                           for samples, duration in zip(total_range("samples range"), total_range("duration range [s]")))
+        plan["data size [B]"]       = total("data size [B]")
+        plan["data size range [B]"] = total_range("data size range [B]")
+        return plan
+
+    def uncalibrated(self):
+
+        # models of the planned run still at their priors
+
+        names = []
+        for abbr, procedure in PROCEDURES.items():
+            if not getattr(self.config, PROCEDURE_FLAGS[abbr]): continue
+            if not self.stages[(procedure, "main", "capture")].calibrated: names.append(f"{procedure}: stages")
+            if not all(self.bytes[procedure]):                             names.append(f"{procedure}: data size")
+            if abbr != "DCS" and getattr(self.config, f"{abbr}_TUNE_MODE") != "none" and not self.tuning[procedure].calibrated:
+                names.append(f"{procedure}: tuning")
+        if self.config.PHOTOCATHODE_SCAN and not self.motion_times[1]:                 names.append("rotation stage moves")
+        if (self.config.FRONTAL_HV_SCAN or self.config.DARK_COUNT_SCAN) and self.settling.predict(1) is None: names.append("HV settling")
+        if self.config.ANALYSIS_PERFORM and not self.analysis.calibrated:             names.append("analysis (not included)")
+        return names
+
+    #---------------------------
+
+    def report(self):
+
+        config = self.config
+        plan   = self.plan()
+
+        def duration(seconds):
+            return f"{int(seconds // 3600)}:{int(seconds % 3600 // 60):02d}:{int(seconds % 60):02d} h"
+
+        def size(nr_bytes):
+            return f"{nr_bytes / 1e9:8.2f} GB"
+
+        def print_range(entry, waveforms=("", "")):
+            # fewest / most waveforms per point (adaptive scans) and shortest / longest tuning (TUNE_SEQUENTIAL)
+            if entry["duration range [s]"][0] == entry["duration range [s]"][1] and entry["data size range [B]"][0] == entry["data size range [B]"][1]: return
+            for i, label in enumerate(("  at least", "  at most")):
+                print(f"{label:<24}{'':>8}{waveforms[i]:>12}{duration(entry['duration range [s]'][i]):>16}{size(entry['data size range [B]'][i]):>12}")
+
+        print(f"\nplanned run, calibrated with {len(self.timelines)} timeline(s):")
+        for path in self.timelines: print(f"    {path}")
+
+        print(f"\n{'':<24}{'points':>8}{'waveforms':>12}{'duration':>16}{'data':>12}")
+        print(f"{'setup and checks':<24}{'':>20}{duration(plan['setup [s]']):>16}")
+        print(f"{'cooldown':<24}{'':>20}{duration(plan['cooldown [s]']):>16}")
+        for procedure, entry in plan["procedures"].items():
+            # the laser warms up after the dark count scan
+            if procedure != PROCEDURES["DCS"] and procedure == next(p for p in plan["procedures"] if p != PROCEDURES["DCS"]):
+                print(f"{'laser warm-up':<24}{'':>20}{duration(plan['laser warm-up [s]']):>16}")
+            print(f"{procedure:<24}{entry['points']:>8}{entry['waveforms per point']:>12}{duration(entry['duration [s]']):>16}{size(entry['data size [B]']):>12}  {entry['data file']}")
+            print_range(entry, entry["waveforms range"])
+        print(f"{'analysis':<24}{'':>20}{duration(plan['analysis [s]']):>16}")
+        print(f"{'total':<24}{'':>20}{duration(plan['duration [s]']):>16}{size(plan['data size [B]']):>12}")
+        print_range(plan)
+
+        end = datetime.now() + timedelta(seconds=plan["duration [s]"])
+        print(f"\nexpected end if started now: {end.strftime('%Y-%m-%d %H:%M')}")
+
+        print("\nper point:")
+        for procedure, entry in plan["procedures"].items():
+            bottleneck = "background (analysis and writing)" if config.PIPELINE_QUEUE_SIZE and entry["background per point [s]"] > entry["main per point [s]"] else "main thread (setup and capture)"
+            print(f"    {procedure:<24} setup {entry['setup [s]'] / max(entry['points'], 1):8.2f} s  main {entry['main per point [s]']:8.2f} s  "
+                  f"background {entry['background per point [s]']:8.2f} s  tuning {entry['tuning [s]']:7.1f} s  limited by {bottleneck}")
+
+        adaptive = [procedure for procedure, entry in plan["procedures"].items() if entry["adaptive"]]
+        if adaptive:
+            print(f"\nadaptive nr of waveforms (*_TARGET_*) in {', '.join(adaptive)}: planned with *_NR_OF_WAVEFORMS per point, "
+                  f"bounded by *_MIN_NR_OF_WAVEFORMS and *_MAX_NR_OF_WAVEFORMS (at least / at most)")
+        if any(entry["tuning range [s]"][0] < entry["tuning range [s]"][1] for entry in plan["procedures"].values()):
+            print("sequential tuning (TUNE_SEQUENTIAL): the uncalibrated tuning is planned with full captures, at least one chunk per iteration")
+
+        if os.path.isdir(self.out_path):
+            free = shutil.disk_usage(self.out_path).free
+            print(f"\nfree space in {self.out_path}: {size(free).strip()}")
+            if plan["data size [B]"] > free:
+                print("WARNING: the planned data do not fit into the output path!")
+            elif plan["data size range [B]"][1] > free:
+                print(f"WARNING: the adaptive scans may not fit into the output path (at most {size(plan['data size range [B]'][1]).strip()})!")
+
+        uncalibrated = self.uncalibrated()
+        if uncalibrated:
+            print("\nnot calibrated by earlier runs (priors of config.PLAN_*): " + ", ".join(uncalibrated))
+
+        return plan
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+import collections
+import time
+
+import numpy as np
+
+# detection of a settled readback value (e.g. the uBase HV after a voltage step).
+# instead of a fixed wait and 1 s polls, the value is sampled fast and considered settled as soon as
+# the last samples are statistically stable at the target: mean within the tolerance, small spread and no slope.
+# SettlingModel learns how long steps of a given size take, so the first part of the wait can be slept through
+
+
+class SettlingDetector:
+
+    def __init__(self, target, tolerance, window=5):
+
+        # target, tolerance: the settled value has to be within target +- tolerance
+        # window:            nr of samples judged at once
+
+        self.target    = target
+        self.tolerance = tolerance
+        self.samples   = collections.deque(maxlen=window)
+
+    def add(self, t, value):
+        self.samples.append((t, value))
+
+    @property
+    def value(self):
+        return np.mean([value for _, value in self.samples])
+
+    def is_settled(self):
+
+        if len(self.samples) < self.samples.maxlen: return False
+
+        t, values = np.array(self.samples).T
+        if abs(values.mean() - self.target) > self.tolerance: return False
+        if values.std() > self.tolerance / 2:                 return False
+
+        # slope of a linear fit: the value must not drift by more than half the tolerance over the window
+        if t[-1] > t[0]:
+            slope = np.polyfit(t - t[0], values, 1)[0]
+            if abs(slope) * (t[-1] - t[0]) > self.tolerance / 2: return False
+
+        return True
+
+
+class SettlingModel:
+
+    # settling time as a function of the step size: t = offset + rate * |step|,
+    # least squares fit of the last nr_observations settled steps
+
+    def __init__(self, nr_observations=50, min_observations=3):
+        self.observations     = collections.deque(maxlen=nr_observations)
+        self.min_observations = min_observations
+
+    def add(self, step, settling_time):
+        self.observations.append((abs(step), settling_time))
+
+    def predict(self, step):
+
+        # predicted settling time in s, None if not enough observations yet
+
+        if len(self.observations) < self.min_observations: return None
+
+        steps, times = np.array(self.observations).T
+        if np.ptp(steps) > 0:
+            rate, offset = np.polyfit(steps, times, 1)
+            predicted = offset + max(rate, 0) * abs(step)
+        else:
+            predicted = np.median(times)
+        return max(0., float(predicted))
+
+
+def wait_until_settled(read, target, tolerance, timeout, sample_interval=0.2, window=5, predicted_time=None, predicted_fraction=0.8):
+
+    # samples read() every sample_interval until the value is settled at target (see SettlingDetector).
+    # if a predicted settling time is given, the first predicted_fraction of it is slept without sampling.
+    # returns (settled value or last read value, settling time in s, settled?).
+    # the settling time is taken at the first sample of the stable window
+
+    start    = time.monotonic()
+    detector = SettlingDetector(target, tolerance, window=window)
+
+    if predicted_time:
+        time.sleep(min(predicted_time * predicted_fraction, timeout))
+
+    value = None
+    while True:
+        value = read()
+        now = time.monotonic()
+        detector.add(now, value)
+        if detector.is_settled(): return detector.value, detector.samples[0][0] - start, True
+        if now - start >= timeout:  return value, now - start, False
+        time.sleep(sample_interval)
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import MappingProxyType
+
+from devices.Laser import Laser
+from devices.Powermeter import Powermeter
+from devices.Rotation import Rotation
+from devices.uBase import uBase
+from utils.Timeline import StageTimeline
+
+# snapshot of the device states stored in the metadicts.
+# the serial devices are independent, so they are queried in parallel (one task per device,
+# holding its lock) instead of one after another. values are not rounded, keys are the metadict keys
+
+_device_executor   = ThreadPoolExecutor(max_workers=4, thread_name_prefix="snapshot-device")
+_snapshot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot")
+
+
+def _query_rotation():
+    rotation = Rotation.Instance()
+    with rotation.lock:
+        phi, theta = rotation.get_position()
+    return {"theta [°]": theta, "phi [°]": phi}
+
+
+def _query_ubase():
+    return {"Dy10 [V]": uBase.Instance().getDy10()}
+
+
+def _query_powermeter():
+    return {"Powermeter [pW]": Powermeter.Instance().get_power() * 1e12}
+
+
+def _query_laser():
+    laser = Laser.Instance()
+    with laser.lock:
+        return {"Laser satus":           laser.get_ld(),
+                "Laser temp [°C]":       laser.get_temp(),
+                "Laser tune [%]":        laser.get_tune_value()/10,
+                "Laser pulse freq [Hz]": laser.get_freq()}
+
+
+def snapshot_devices():
+
+    # returns an immutable mapping of the current device states
+
+    snapshot = {"time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    futures  = [_device_executor.submit(query) for query in (_query_rotation, _query_ubase, _query_powermeter, _query_laser)]
+    for future in futures:
+        snapshot.update(future.result())
+    return MappingProxyType(snapshot)
+
+
+def snapshot_devices_async():
+
+    # starts snapshot_devices() in the background, e.g. while the Picoscope captures. returns a Future
+
+    timeline = StageTimeline.Instance()
+    context  = timeline.current()
+
+    def query():
+        with timeline.attach(context), timeline.stage("device metadata"):
+            return snapshot_devices()
+    return _snapshot_executor.submit(query)
@@ -0,0 +1,343 @@
+#!/usr/bin/python3
+
+import logging
+
+import config
+import numpy as np
+from scipy.stats import norm
+from utils.Measurement import fit_gaussian_histogram
+
+# mergeable accumulators for the waveform characteristics of the metadict.
+# every accumulator supports update(chunk), merge(other) and finalize(), so a measurement can be
+# analysed in chunks (Picoscope.block_measurement_chunks, Measurement.read_chunks_from_file) or in shards
+# with constant memory. only the finalized, merged histograms are fitted.
+
+
+class OccupancyCounter:
+
+    def __init__(self):
+        self.nr_total  = 0
+        self.nr_signal = 0
+
+    def update(self, has_signal):
+        has_signal = np.asarray(has_signal, dtype=bool)
+        self.nr_total  += has_signal.size
+        self.nr_signal += int(np.count_nonzero(has_signal))
+
+    def merge(self, other):
+        self.nr_total  += other.nr_total
+        self.nr_signal += other.nr_signal
+        return self
+
+    def finalize(self):
+        # occupancy in %
+        if not self.nr_total: return 0
+        return self.nr_signal / self.nr_total * 100
+
+
+class Histogram:
+
+    # histogram with fixed binning, so histograms of different chunks can simply be added
+
+    def __init__(self, min_value, max_value, nr_bins):
+        self.bins      = np.linspace(min_value, max_value, int(nr_bins) + 1)
+        self.counts    = np.zeros(int(nr_bins), dtype=np.int64)
+        self.underflow = 0
+        self.overflow  = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        low, high = self.bins[0], self.bins[-1]
+        self.underflow += int(np.count_nonzero(values < low))
+        self.overflow  += int(np.count_nonzero(values > high))
+
+        # bin index computed directly, np.histogram searches the (fine) bin edges for every value.
+        # the upper edge belongs to the last bin, like in np.histogram
+        inside = values[(values >= low) & (values <= high)]
+        index  = ((inside - low) * (len(self.counts) / (high - low))).astype(np.int64)
+        np.add.at(self.counts, np.minimum(index, len(self.counts) - 1), 1)
+
+    def merge(self, other):
+        assert np.array_equal(self.bins, other.bins), "only histograms with identical binning can be merged"
+        self.counts    += other.counts
+        self.underflow += other.underflow
+        self.overflow  += other.overflow
+        return self
+
+    @property
+    def nr_entries(self):
+        return int(self.counts.sum())
+
+    @property
+    def out_of_range(self):
+        # fraction of the values outside of the binning (underflow and overflow)
+        missed = self.underflow + self.overflow
+        return missed / (self.nr_entries + missed) if missed else 0.
+
+    def covers(self):
+        # False if more than config.ANALYSIS_MAX_OUT_OF_RANGE of the values missed the binning, the fit would be biased.
+        # up to config.ANALYSIS_MAX_OUT_OF_RANGE_COUNT outliers are accepted in any case
+        if self.underflow + self.overflow <= config.ANALYSIS_MAX_OUT_OF_RANGE_COUNT: return True
+        return self.out_of_range <= config.ANALYSIS_MAX_OUT_OF_RANGE
+
+    def rebinned(self, nr_bins=500):
+
+        # cuts the histogram to its filled range and merges neighbouring bins,
+        # so the filled range is covered by about nr_bins bins (like np.histogram on the raw data)
+
+        filled = np.flatnonzero(self.counts)
+        if not filled.size: return self.counts[:0], self.bins[:1]
+
+        start, stop = filled[0], filled[-1] + 1
+        factor = max(1, (stop - start) // nr_bins)
+        stop   = start + int(np.ceil((stop - start) / factor)) * factor
+
+        counts = np.zeros(stop - start, dtype=np.int64)
+        filled_counts = self.counts[start:stop]
+        counts[:len(filled_counts)] = filled_counts
+        counts = counts.reshape(-1, factor).sum(axis=1)
+
+        width = self.bins[1] - self.bins[0]
+        return counts, self.bins[0] + width * np.arange(start, stop + 1, factor)
+
+    def finalize(self, nr_bins=500, with_error=False):
+        # gaussian fit of the merged histogram. returns mean and FWHM, (0,0) if not possible
+        # with_error: also returns the fit uncertainty of the mean
+        # if the binning does not cover the values (covers()) the fit is invalid and (0,0) is returned as well
+        if not self.covers():
+            logging.getLogger("OMCU").warning(f"histogram over [{self.bins[0]}, {self.bins[-1]}] missed {self.underflow} underflow and {self.overflow} overflow "
+                                              f"of {self.nr_entries + self.underflow + self.overflow} entries, fit is invalid. check config.ANALYSIS_BINNING_*")
+            return (0,0,np.inf) if with_error else (0,0)
+        if self.underflow or self.overflow:
+            logging.getLogger("OMCU").debug(f"histogram over [{self.bins[0]}, {self.bins[-1]}] missed {self.underflow} underflow and {self.overflow} overflow entries")
+        return fit_gaussian_histogram(*self.rebinned(nr_bins), with_error=with_error)
+
+
+class RunningMoments:
+
+    # mean and variance with Welford's algorithm, merged chunk-wise (Chan et al.)
+
+    def __init__(self):
+        self.n    = 0
+        self.mean = 0.
+        self.M2   = 0.
+
+    def _combine(self, n, mean, M2):
+        if not n: return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.M2   += M2 + delta**2 * self.n * n / total
+        self.n     = total
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if not values.size: return
+        mean = values.mean()
+        self._combine(values.size, mean, float(np.sum((values - mean)**2)))
+
+    def merge(self, other):
+        self._combine(other.n, other.mean, other.M2)
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.M2 / self.n) if self.n else 0
+
+    def finalize(self):
+        # returns mean and FWHM of the equivalent gaussian, like the histogram fits, (0,0) if empty
+        if not self.n: return 0,0
+        return self.mean, 2 * np.sqrt(2 * np.log(2)) * self.std
+
+
+class WaveformStatistics:
+
+    # bundles the accumulators of all waveform characteristics of Measurement.measure_waveform_characteristics.
+    # binning (min, max, nr of bins) is taken from config.ANALYSIS_BINNING_*
+
+    def __init__(self, signal_threshold):
+
+        self.signal_threshold = signal_threshold
+
+        self.occupancy    = OccupancyCounter()
+        self.amplitude    = Histogram(*config.ANALYSIS_BINNING_AMPLITUDE)
+        self.charge       = Histogram(*config.ANALYSIS_BINNING_CHARGE)
+        self.gain         = Histogram(*config.ANALYSIS_BINNING_GAIN)
+        self.transit_time = Histogram(*config.ANALYSIS_BINNING_TRANSIT_TIME)
+        self.rise_time    = Histogram(*config.ANALYSIS_BINNING_RISE_TIME)
+        self.ptv          = Histogram(*config.ANALYSIS_BINNING_PTV)
+        self.baseline     = RunningMoments()
+
+    def update(self, waveforms):
+
+        # waveforms: utils.WaveformBatch.WaveformBatch (one chunk)
+
+        selected = waveforms.min_value < self.signal_threshold
+        self.occupancy.update(selected)
+
+        signals = waveforms[selected]
+        if not len(signals): return
+
+        self.amplitude.update(signals.min_value)
+        self.charge.update(signals.charge)
+        self.gain.update(signals.gain)
+        self.transit_time.update(signals.transit_time)
+        self.rise_time.update(signals.rise_time)
+        self.ptv.update(signals.peak_to_valley_ratio)
+        self.baseline.update(signals.baseline)
+
+    def merge(self, other):
+        assert self.signal_threshold == other.signal_threshold
+        for key in ["occupancy", "amplitude", "charge", "gain", "transit_time", "rise_time", "ptv", "baseline"]:
+            getattr(self, key).merge(getattr(other, key))
+        return self
+
+    def finalize(self, nr_bins=500, nr_bins_transit_time=5000):
+
+        # returns the waveform part of the metadict
+
+        amplitude    = self.amplitude.finalize(nr_bins)
+        gain         = self.gain.finalize(nr_bins)
+        charge       = self.charge.finalize(nr_bins)
+        rise_time    = self.rise_time.finalize(nr_bins)
+        transit_time = self.transit_time.finalize(nr_bins_transit_time)
+        baseline     = self.baseline.finalize()
+        ptv          = self.ptv.finalize(nr_bins)
+
+        return {
+            "occ [%]":                     round(self.occupancy.finalize(), 3),
+            "avg amplitude [mV]":          round(amplitude[0],           3),
+            "std amplitude [mV]":          round(amplitude[1],           3),
+            "gain":                        round(gain[0],                3),
+            "gain spread":                 round(gain[1],                3),
+            "charge [pC]":                 round(charge[0] * 1e12,       3),
+            "charge spread [pC]":          round(charge[1] * 1e12,       3),
+            "rise time [ns]":              round(rise_time[0],           3),
+            "rise time spread [ns]":       round(rise_time[1],           3),
+            "transit time [ns]":           round(transit_time[0],        3),
+            "transit time spread [ns]":    round(transit_time[1],        3),
+            "baseline [mV]":               round(baseline[0],            3),
+            "baseline spread [mV]":        round(baseline[1],            3),
+            "peak to valley ratio":        round(ptv[0],                 3),
+            "peak to valley ratio spread": round(ptv[1],                 3),
+            }
+
+
+###-----------------------------------------------------------------
+
+# stopping rules for sequential measurements (Picoscope.sequential_measurement): updated with every captured
+# chunk, done() as soon as the data decide whether the value is inside a range or reach the target precision.
+# the data are looked at after every chunk, so a stricter confidence than for a single test is used
+# (config.SEQUENTIAL_CONFIDENCE)
+
+
+def wilson_interval(nr_signal, nr_total, confidence):
+
+    # binomial confidence interval (Wilson score) of a fraction
+
+    if not nr_total: return 0., 1.
+    z  = norm.ppf(0.5 + confidence / 2)
+    p  = nr_signal / nr_total
+    center = (p + z**2 / (2 * nr_total)) / (1 + z**2 / nr_total)
+    half   = z * np.sqrt(p * (1 - p) / nr_total + z**2 / (4 * nr_total**2)) / (1 + z**2 / nr_total)
+    return center - half, center + half
+
+
+def _decided(low, high, range_min, range_max, precision):
+
+    # interval [low, high] entirely inside or outside of [range_min, range_max], or narrower than 2 * precision
+
+    if range_min is not None and range_max is not None:
+        if range_min <= low and high <= range_max: return True
+        if high < range_min or low > range_max:    return True
+    return precision is not None and (high - low) / 2 <= precision
+
+
+class OccupancyDecision:
+
+    # occupancy as fraction (like Measurement.calculate_occ): done if the confidence interval is inside / outside
+    # of [occ_min, occ_max] or its half width is below precision
+
+    def __init__(self, signal_threshold, occ_min=None, occ_max=None, precision=None, confidence=None):
+        self.signal_threshold = signal_threshold
+        self.occ_min, self.occ_max = occ_min, occ_max
+        self.precision  = precision
+        self.confidence = confidence if confidence else config.SEQUENTIAL_CONFIDENCE
+        self.occupancy  = OccupancyCounter()
+
+    def update(self, waveforms):
+        self.occupancy.update(waveforms.min_value < self.signal_threshold)
+
+    def interval(self):
+        return wilson_interval(self.occupancy.nr_signal, self.occupancy.nr_total, self.confidence)
+
+    def done(self):
+        return _decided(*self.interval(), self.occ_min, self.occ_max, self.precision)
+
+    def __str__(self):
+        low, high = self.interval()
+        return f"occupancy in [{round(low, 4)}, {round(high, 4)}] after {self.occupancy.nr_total} waveforms"
+
+
+class GainPrecision:
+
+    # gain of the signal waveforms, estimated like Measurement.calculate_gain and the metadict (gaussian fit of the
+    # histogram with the binning of config.ANALYSIS_BINNING_GAIN): done if the fitted mean +- its fit uncertainty
+    # (at the confidence) is inside / outside of [gain_min, gain_max] or the relative error is below rel_error.
+    # the fit is biased and unstable with few signals, so at least config.SEQUENTIAL_MIN_SIGNALS are needed
+    # gains outside of the binning make the fit invalid, the gain then stays undecided
+
+    def __init__(self, signal_threshold, gain_min=None, gain_max=None, rel_error=None, confidence=None, nr_bins=500):
+        self.signal_threshold = signal_threshold
+        self.gain_min, self.gain_max = gain_min, gain_max
+        self.rel_error  = rel_error
+        self.confidence = confidence if confidence else config.SEQUENTIAL_CONFIDENCE
+        self.nr_bins    = nr_bins
+        self.gain       = Histogram(*config.ANALYSIS_BINNING_GAIN)
+
+    def update(self, waveforms):
+        signals = waveforms[waveforms.min_value < self.signal_threshold]
+        if len(signals): self.gain.update(signals.gain)
+
+    def interval(self):
+        mean, _, error = self.gain.finalize(self.nr_bins, with_error=True)
+        if not mean or not np.isfinite(error): return 0., np.inf
+        half = norm.ppf(0.5 + self.confidence / 2) * error
+        return mean - half, mean + half
+
+    def done(self):
+        if self.gain.nr_entries < config.SEQUENTIAL_MIN_SIGNALS: return False
+        low, high = self.interval()
+        precision = self.rel_error * abs(low + high) / 2 if self.rel_error else None
+        return _decided(low, high, self.gain_min, self.gain_max, precision)
+
+    def __str__(self):
+        low, high = self.interval()
+        return f"gain in [{low:.4g}, {high:.4g}] from {self.gain.nr_entries} signals"
+
+
+class SignalCount:
+
+    # nr of signal waveforms: done as soon as nr_signals signal waveforms are captured
+    # (top up of the scan points in TestingProcedures.measure_point)
+
+    def __init__(self, signal_threshold, nr_signals):
+        self.signal_threshold = signal_threshold
+        self.nr_signals = nr_signals
+        self.occupancy  = OccupancyCounter()
+
+    def update(self, waveforms):
+        self.occupancy.update(waveforms.min_value < self.signal_threshold)
+
+    def expected_waveforms(self):
+        # nr of waveforms needed for nr_signals at the occupancy measured so far, inf without any signal
+        if not self.occupancy.nr_signal: return np.inf
+        return self.nr_signals * self.occupancy.nr_total / self.occupancy.nr_signal
+
+    def done(self):
+        return self.occupancy.nr_signal >= self.nr_signals
+
+    def __str__(self):
+        return f"{self.occupancy.nr_signal} of {self.nr_signals} signals in {self.occupancy.nr_total} waveforms"
@@ -1,6 +1,5 @@
 #!/usr/bin/python3
 
-import itertools
 import logging
 import os
 import time
@@ -13,67 +12,201 @@ from devices.Picoscope import Picoscope
 from devices.Rotation import Rotation
 from devices.uBase import uBase
 from scipy.signal import find_peaks
+from utils.AdaptiveSampling import WaveformCountPlanner
+from utils.MotionPlanner import MotionPlanner
+from utils.Pipeline import ScanPipeline
+from utils.Snapshot import snapshot_devices_async
+from utils.Statistics import SignalCount, WaveformStatistics
+from utils.Timeline import StageTimeline, timed_procedure
 from utils.util import tune_parameters
 
 #------------------------------------------------------------------------------
 
 
+def convert_for_writing(dataset):
+
+    # the waveforms are kept as raw ADC codes and converted to mV when first needed. data stored in mV
+    # (config.STORE_RAW_ADC off) are converted right before writing, so the conversion is timed on its own.
+    # the signal waveforms selected for the metadict are converted within the metadict
+
+    waveforms = dataset.getWaveforms()
+    if config.STORE_RAW_ADC and waveforms.is_raw: return
+    with StageTimeline.Instance().stage("ADC conversion"):
+        waveforms.convert()
+
+
+def analyse_and_write(dataset, h5_connection, signal_threshold, filter_dataset):
+
+    # CPU side of a scan point. runs in the worker of the ScanPipeline, the device metadata is already in the metadict
+
+    timeline = StageTimeline.Instance()
+
+    with timeline.stage("metadict"):
+        occupied = dataset.calculate_occ(signal_threshold)
+    if not occupied:
+        logging.getLogger("OMCU").warning(f"Measured occupancy of 0 for {dataset.getHDF5_Key()}. Will NOT store data.")
+        print(f"Measured occupancy of 0 for {dataset.getHDF5_Key()}. Will NOT store data.")
+        return
+
+    logging.getLogger("OMCU").info(f"determining dataset metadata")
+    with timeline.stage("metadict"):
+        dataset.measure_metadict(signal_threshold=signal_threshold, only_waveform_characteristics=True)
+        if filter_dataset:
+            logging.getLogger("OMCU").info(f"filtering dataset by threshold of {signal_threshold} mV")
+            dataset.filter_by_threshold(signal_threshold=signal_threshold)
+
+    convert_for_writing(dataset)
+    logging.getLogger("OMCU").info(f"writing dataset to harddrive")
+    with timeline.stage("HDF5 write"):
+        dataset.write_to_file(hdf5_connection=h5_connection)
+
+
+def analyse_and_append(dataset, h5_connection, signal_threshold, filter_dataset, statistics, last):
+
+    # analyse_and_write for one chunk of a point captured in chunks (measure_point): the chunk is added to the
+    # WaveformStatistics of the point and appended to its datasets. the metadict is finalized with the last chunk
+    # and written over the attributes. a point without any signal is removed from the file again
+
+    timeline = StageTimeline.Instance()
+
+    with timeline.stage("metadict"):
+        statistics.update(dataset.getWaveforms())
+        if last: dataset.setMetadict({**dataset.metadict, **statistics.finalize()})
+        if filter_dataset:
+            dataset.filter_by_threshold(signal_threshold=signal_threshold)
+
+    convert_for_writing(dataset)
+    with timeline.stage("HDF5 write"):
+        dataset.append_to_file(hdf5_connection=h5_connection)
+
+    if last and not statistics.occupancy.nr_signal:
+        logging.getLogger("OMCU").warning(f"Measured occupancy of 0 for {dataset.getHDF5_Key()}. Will NOT store data.")
+        print(f"Measured occupancy of 0 for {dataset.getHDF5_Key()}. Will NOT store data.")
+        del h5_connection[dataset.getHDF5_Key()]
+
+
+def analyse_write_and_count(h5_connection, signal_threshold, filter_dataset, waveform_counts):
+
+    # process function for the ScanPipeline: analyse_and_write (analyse_and_append for the chunks of a point),
+    # then hand the result of the point to the WaveformCountPlanner, which derives the nr of waveforms of the next points from it
+
+    def process(dataset, point, statistics=None, last=True):
+        if statistics is None:
+            analyse_and_write(dataset, h5_connection, signal_threshold, filter_dataset)
+        else:
+            analyse_and_append(dataset, h5_connection, signal_threshold, filter_dataset, statistics, last)
+        if last: waveform_counts.add(point, dataset.metadict)
+    return process
+
+
+def measure_point(pipeline, point, nr_waveforms, signal_threshold, filename, filepath, hdf5_key, nr_signals=None, max_waveforms=None):
+
+    # captures a scan point and hands it to the ScanPipeline, the device states are read while the Picoscope captures.
+    # more than config.PICOSCOPE_CHUNK_SIZE waveforms are captured in chunks, which the worker analyses into one
+    # WaveformStatistics and appends to the file one after another (analyse_and_append),
+    # so only the chunks waiting in the pipeline are kept in memory.
+    # nr_signals: if the point has fewer signal waveforms, it is topped up with chunks of the same size (the scope keeps
+    # its setup) until it has them or max_waveforms are captured. no top up if nr_signals can not be reached within
+    # max_waveforms at the occupancy measured so far (e.g. no signals at all).
+    # the chunks come from Picoscope.block_measurement_chunks, which also cuts the last chunk to size
+
+    picoscope     = Picoscope.Instance()
+    chunk_size    = min(nr_waveforms, config.PICOSCOPE_CHUNK_SIZE)
+    max_waveforms = max(max_waveforms if max_waveforms else nr_waveforms, nr_waveforms)
+    signals       = SignalCount(signal_threshold, nr_signals) if nr_signals else None
+
+    def chunks():
+        # the chunks of the point, then those of the top up. the chunks are only captured when asked for
+        yield from picoscope.block_measurement_chunks(nr_waveforms, chunk_size)
+        yield from picoscope.block_measurement_chunks(max_waveforms - nr_waveforms, chunk_size)
+
+    snapshot   = snapshot_devices_async()
+    statistics = None
+    captured   = 0
+    for dataset in chunks():
+
+        captured += len(dataset)
+        if signals: signals.update(dataset.getWaveforms())
+        last = captured >= max_waveforms or (captured >= nr_waveforms and (not signals or signals.done() or signals.expected_waveforms() > max_waveforms))
+        if not last and statistics is None: statistics = WaveformStatistics(signal_threshold)
+
+        dataset.setFilename(filename)
+        dataset.setFilepath(filepath)
+        dataset.setHDF5_key(hdf5_key)
+
+        # analysis and writing happen in the background during the next chunk / point
+        dataset.measure_metadict(signal_threshold=signal_threshold, only_device_metadata=True, snapshot=snapshot)
+        pipeline.submit(dataset, point, statistics, last)
+        if last: break
+
+    if signals and not signals.done():
+        logging.getLogger("OMCU").warning(f"{hdf5_key} falls short of the target: {signals}")
+    elif captured > nr_waveforms:
+        logging.getLogger("OMCU").info(f"topped up {hdf5_key} from {nr_waveforms} Waveforms: {signals}")
+
+
+#------------------------------------------------------------------------------
+
+
+@timed_procedure("photocathode scan")
 def photocathode_scan(DATA_PATH):
 
     logging.getLogger("OMCU").info(f"entering PCS measurement")
+    timeline = StageTimeline.Instance()
 
     Laser.Instance().on_pulsed()
     Rotation.Instance().go_home()
 
-    tune_parameters(tune_mode=config.PCS_TUNE_MODE,
-                    nr_waveforms=config.PCS_TUNE_NR_OF_WAVEFORMS,
-                    gain_min=config.PCS_TUNE_GAIN_MIN,
-                    gain_max=config.PCS_TUNE_GAIN_MAX,
-                    V_start=config.PCS_TUNE_V_START,
-                    V_step=config.PCS_TUNE_V_STEP,
-                    occ_min=config.PCS_TUNE_OCC_MIN,
-                    occ_max=config.PCS_TUNE_OCC_MAX,
-                    laser_start=config.PCS_TUNE_LASER_START,
-                    laser_step=config.PCS_TUNE_LASER_STEP,
-                    signal_threshold=config.PCS_TUNE_SIGNAL_THRESHOLD,
-                    iterations=config.PCS_TUNE_MAX_ITER)
+    with timeline.stage("tuning"):
+        tune_parameters(tune_mode=config.PCS_TUNE_MODE,
+                        nr_waveforms=config.PCS_TUNE_NR_OF_WAVEFORMS,
+                        gain_min=config.PCS_TUNE_GAIN_MIN,
+                        gain_max=config.PCS_TUNE_GAIN_MAX,
+                        V_start=config.PCS_TUNE_V_START,
+                        V_step=config.PCS_TUNE_V_STEP,
+                        occ_min=config.PCS_TUNE_OCC_MIN,
+                        occ_max=config.PCS_TUNE_OCC_MAX,
+                        laser_start=config.PCS_TUNE_LASER_START,
+                        laser_step=config.PCS_TUNE_LASER_STEP,
+                        signal_threshold=config.PCS_TUNE_SIGNAL_THRESHOLD,
+                        iterations=config.PCS_TUNE_MAX_ITER)
 
     start_time = time.time()
 
     print(f"\nperforming photocathode scan over:\nPhi:\t{config.PCS_PHI_LIST}\nTheta:\t{config.PCS_THETA_LIST}")
     print(f"saving data in {os.path.join(DATA_PATH, config.PCS_DATAFILE)}")
 
+    planner = MotionPlanner()
+    points  = planner.plan_grid(config.PCS_PHI_LIST, config.PCS_THETA_LIST)
+    print(f"estimated time for rotating: {round(planner.estimated_time / 60, 0)} minutes")
 
-    with h5py.File(os.path.join(DATA_PATH, config.PCS_DATAFILE), 'w') as h5_connection:
+    waveform_counts = WaveformCountPlanner(default=config.PCS_NR_OF_WAVEFORMS,
+                                           target_signals=config.PCS_TARGET_SIGNALS,
+                                           target_gain_error=config.PCS_TARGET_GAIN_ERROR,
+                                           target_tts_error=config.PCS_TARGET_TTS_ERROR,
+                                           min_waveforms=config.PCS_MIN_NR_OF_WAVEFORMS,
+                                           max_waveforms=config.PCS_MAX_NR_OF_WAVEFORMS,
+                                           periods=(360, None))
 
-        # loop through Theta, then phi
-        for phi, theta in itertools.product(config.PCS_PHI_LIST, config.PCS_THETA_LIST):  
+    with h5py.File(os.path.join(DATA_PATH, config.PCS_DATAFILE), 'w') as h5_connection, \
+         ScanPipeline(analyse_write_and_count(h5_connection, config.PCS_SIGNAL_THRESHOLD, config.PCS_FILTER_DATASET, waveform_counts)) as pipeline, \
+         Rotation.Instance().motion_session():
 
-            print(f"\nmeasuring ---- Phi: {phi}\tTheta: {theta}")
-
-            Rotation.Instance().set_position(phi, theta)
-
-            time.sleep(config.PCS_MEASUREMENT_SLEEP)
-            logging.getLogger("OMCU").info(f"measuring dataset of {config.PCS_NR_OF_WAVEFORMS} Waveforms from Picoscope")
-            dataset = Picoscope.Instance().block_measurement(config.PCS_NR_OF_WAVEFORMS)
-
-            if not dataset.calculate_occ(config.PCS_SIGNAL_THRESHOLD):
-                logging.getLogger("OMCU").warning("Measured occupancy of 0. Will NOT store data and continue with next measurement.")
-                print("Measured occupancy of 0. Will NOT store data and continue with next measurement.")
-                continue
+        # grid in serpentine order, so the stage only moves between neighbouring points
+        for phi, theta in points:
 
-            dataset.setFilename(config.PCS_DATAFILE)
-            dataset.setFilepath(DATA_PATH)
-            dataset.setHDF5_key(f"theta {theta}/phi {phi}")
+            print(f"\nmeasuring ---- Phi: {phi}\tTheta: {theta}")
+            timeline.next_point(f"theta {theta}/phi {phi}")
 
-            logging.getLogger("OMCU").info(f"determining dataset metadata")
-            dataset.measure_metadict(signal_threshold=config.PCS_SIGNAL_THRESHOLD)
-            if config.PCS_FILTER_DATASET:
-                logging.getLogger("OMCU").info(f"filtering dataset by threshold of {config.PCS_SIGNAL_THRESHOLD} mV")
-                dataset.filter_by_threshold(signal_threshold=config.PCS_SIGNAL_THRESHOLD)
+            with timeline.stage("move"):
+                Rotation.Instance().set_position(phi, theta)
 
-            logging.getLogger("OMCU").info(f"writing dataset to harddrive")
-            dataset.write_to_file(hdf5_connection=h5_connection)
+            with timeline.stage("sleep"):
+                time.sleep(config.PCS_MEASUREMENT_SLEEP)
+            nr_waveforms = waveform_counts.nr_of_waveforms((phi, theta))
+            logging.getLogger("OMCU").info(f"measuring dataset of {nr_waveforms} Waveforms from Picoscope")
+            measure_point(pipeline, (phi, theta), nr_waveforms, config.PCS_SIGNAL_THRESHOLD, config.PCS_DATAFILE, DATA_PATH, f"theta {theta}/phi {phi}",
+                          nr_signals=waveform_counts.nr_of_signals((phi, theta)), max_waveforms=waveform_counts.max_waveforms)
 
     print(f"\nFinished photocadode scan\nData located at {os.path.join(DATA_PATH, config.PCS_DATAFILE)}")
 
@@ -89,25 +222,28 @@ def photocathode_scan(DATA_PATH):
 #------------------------------------------------------------------------------
 
 
+@timed_procedure("frontal HV scan")
 def frontal_HV_scan(DATA_PATH):
 
     logging.getLogger("OMCU").info(f"entering FHVS measurement")
+    timeline = StageTimeline.Instance()
 
     Laser.Instance().on_pulsed()
     Rotation.Instance().go_home()
 
-    tune_parameters(tune_mode=config.FHVS_TUNE_MODE,
-                    nr_waveforms=config.FHVS_TUNE_NR_OF_WAVEFORMS,
-                    gain_min=config.FHVS_TUNE_GAIN_MIN,
-                    gain_max=config.FHVS_TUNE_GAIN_MAX,
-                    V_start=config.FHVS_TUNE_V_START,
-                    V_step=config.FHVS_TUNE_V_STEP,
-                    occ_min=config.FHVS_TUNE_OCC_MIN,
-                    occ_max=config.FHVS_TUNE_OCC_MAX,
-                    laser_start=config.FHVS_TUNE_LASER_START,
-                    laser_step=config.FHVS_TUNE_LASER_STEP,
-                    signal_threshold=config.FHVS_TUNE_SIGNAL_THRESHOLD,
-                    iterations=config.FHVS_TUNE_MAX_ITER)
+    with timeline.stage("tuning"):
+        tune_parameters(tune_mode=config.FHVS_TUNE_MODE,
+                        nr_waveforms=config.FHVS_TUNE_NR_OF_WAVEFORMS,
+                        gain_min=config.FHVS_TUNE_GAIN_MIN,
+                        gain_max=config.FHVS_TUNE_GAIN_MAX,
+                        V_start=config.FHVS_TUNE_V_START,
+                        V_step=config.FHVS_TUNE_V_STEP,
+                        occ_min=config.FHVS_TUNE_OCC_MIN,
+                        occ_max=config.FHVS_TUNE_OCC_MAX,
+                        laser_start=config.FHVS_TUNE_LASER_START,
+                        laser_step=config.FHVS_TUNE_LASER_STEP,
+                        signal_threshold=config.FHVS_TUNE_SIGNAL_THRESHOLD,
+                        iterations=config.FHVS_TUNE_MAX_ITER)
 
     start_time = time.time()
 
@@ -115,36 +251,32 @@ def frontal_HV_scan(DATA_PATH):
     print(f"saving data in {os.path.join(DATA_PATH, config.FHVS_DATAFILE)}")
     Rotation.Instance().go_home()
 
-    with h5py.File(os.path.join(DATA_PATH, config.FHVS_DATAFILE), 'w') as h5_connection:
+    waveform_counts = WaveformCountPlanner(default=config.FHVS_NR_OF_WAVEFORMS,
+                                           target_signals=config.FHVS_TARGET_SIGNALS,
+                                           target_gain_error=config.FHVS_TARGET_GAIN_ERROR,
+                                           target_tts_error=config.FHVS_TARGET_TTS_ERROR,
+                                           min_waveforms=config.FHVS_MIN_NR_OF_WAVEFORMS,
+                                           max_waveforms=config.FHVS_MAX_NR_OF_WAVEFORMS,
+                                           periods=None)
+
+    with h5py.File(os.path.join(DATA_PATH, config.FHVS_DATAFILE), 'w') as h5_connection, \
+         ScanPipeline(analyse_write_and_count(h5_connection, config.FHVS_SIGNAL_THRESHOLD, config.FHVS_FILTER_DATASET, waveform_counts)) as pipeline:
 
         # loop through HV
         for HV in config.FHVS_HV_LIST: 
 
             print(f"\nmeasuring ---- HV: {HV}")
+            timeline.next_point(f"HV {HV}")
 
-            uBase.Instance().SetVoltage(HV)
+            with timeline.stage("HV settling"):
+                uBase.Instance().SetVoltage(HV)
 
-            time.sleep(config.FHVS_MEASUREMENT_SLEEP)
-            logging.getLogger("OMCU").info(f"measuring dataset of {config.FHVS_NR_OF_WAVEFORMS} Waveforms from Picoscope")
-            dataset = Picoscope.Instance().block_measurement(config.FHVS_NR_OF_WAVEFORMS)
-
-            if not dataset.calculate_occ(config.FHVS_SIGNAL_THRESHOLD):
-                logging.getLogger("OMCU").warning("Measured occupancy of 0. Will NOT store data and continue with next measurement.")
-                print("Measured occupancy of 0. Will NOT store data and continue with next measurement.")
-                continue
-
-            dataset.setFilename(config.FHVS_DATAFILE)
-            dataset.setFilepath(DATA_PATH)
-            dataset.setHDF5_key(f"HV {HV}")
-
-            logging.getLogger("OMCU").info(f"determining dataset metadata")
-            dataset.measure_metadict(signal_threshold=config.FHVS_SIGNAL_THRESHOLD)
-            if config.FHVS_FILTER_DATASET:
-                logging.getLogger("OMCU").info(f"filtering dataset by threshold of {config.FHVS_SIGNAL_THRESHOLD} mV")
-                dataset.filter_by_threshold(signal_threshold=config.FHVS_SIGNAL_THRESHOLD)
-            
-            logging.getLogger("OMCU").info(f"writing dataset to harddrive")
-            dataset.write_to_file(hdf5_connection=h5_connection)
+            with timeline.stage("sleep"):
+                time.sleep(config.FHVS_MEASUREMENT_SLEEP)
+            nr_waveforms = waveform_counts.nr_of_waveforms(HV)
+            logging.getLogger("OMCU").info(f"measuring dataset of {nr_waveforms} Waveforms from Picoscope")
+            measure_point(pipeline, HV, nr_waveforms, config.FHVS_SIGNAL_THRESHOLD, config.FHVS_DATAFILE, DATA_PATH, f"HV {HV}",
+                          nr_signals=waveform_counts.nr_of_signals(HV), max_waveforms=waveform_counts.max_waveforms)
 
     print(f"\nFinished frontal HV scan\nData located at {os.path.join(DATA_PATH, config.FHVS_DATAFILE)}")
 
@@ -160,25 +292,28 @@ def frontal_HV_scan(DATA_PATH):
 #------------------------------------------------------------------------------
 
 
+@timed_procedure("charge linearity scan")
 def charge_linearity_scan(DATA_PATH):
 
     logging.getLogger("OMCU").info(f"entering CLS measurement")
+    timeline = StageTimeline.Instance()
 
     Laser.Instance().on_pulsed()
     Rotation.Instance().go_home()
 
-    tune_parameters(tune_mode=config.CLS_TUNE_MODE,
-                    nr_waveforms=config.CLS_TUNE_NR_OF_WAVEFORMS,
-                    gain_min=config.CLS_TUNE_GAIN_MIN,
-                    gain_max=config.CLS_TUNE_GAIN_MAX,
-                    V_start=config.CLS_TUNE_V_START,
-                    V_step=config.CLS_TUNE_V_STEP,
-                    occ_min=config.CLS_TUNE_OCC_MIN,
-                    occ_max=config.CLS_TUNE_OCC_MAX,
-                    laser_start=config.CLS_TUNE_LASER_START,
-                    laser_step=config.CLS_TUNE_LASER_STEP,
-                    signal_threshold=config.CLS_TUNE_SIGNAL_THRESHOLD,
-                    iterations=config.CLS_TUNE_MAX_ITER)
+    with timeline.stage("tuning"):
+        tune_parameters(tune_mode=config.CLS_TUNE_MODE,
+                        nr_waveforms=config.CLS_TUNE_NR_OF_WAVEFORMS,
+                        gain_min=config.CLS_TUNE_GAIN_MIN,
+                        gain_max=config.CLS_TUNE_GAIN_MAX,
+                        V_start=config.CLS_TUNE_V_START,
+                        V_step=config.CLS_TUNE_V_STEP,
+                        occ_min=config.CLS_TUNE_OCC_MIN,
+                        occ_max=config.CLS_TUNE_OCC_MAX,
+                        laser_start=config.CLS_TUNE_LASER_START,
+                        laser_step=config.CLS_TUNE_LASER_STEP,
+                        signal_threshold=config.CLS_TUNE_SIGNAL_THRESHOLD,
+                        iterations=config.CLS_TUNE_MAX_ITER)
 
     start_time = time.time()
 
@@ -186,36 +321,32 @@ def charge_linearity_scan(DATA_PATH):
     print(f"saving data in {os.path.join(DATA_PATH, config.CLS_DATAFILE)}")
     Rotation.Instance().go_home()
 
-    with h5py.File(os.path.join(DATA_PATH, config.CLS_DATAFILE), 'w') as h5_connection:
+    waveform_counts = WaveformCountPlanner(default=config.CLS_NR_OF_WAVEFORMS,
+                                           target_signals=config.CLS_TARGET_SIGNALS,
+                                           target_gain_error=config.CLS_TARGET_GAIN_ERROR,
+                                           target_tts_error=config.CLS_TARGET_TTS_ERROR,
+                                           min_waveforms=config.CLS_MIN_NR_OF_WAVEFORMS,
+                                           max_waveforms=config.CLS_MAX_NR_OF_WAVEFORMS,
+                                           periods=None)
+
+    with h5py.File(os.path.join(DATA_PATH, config.CLS_DATAFILE), 'w') as h5_connection, \
+         ScanPipeline(analyse_write_and_count(h5_connection, config.CLS_SIGNAL_THRESHOLD, config.CLS_FILTER_DATASET, waveform_counts)) as pipeline:
 
         # loop through laser tune
         for laser_tune in config.CLS_LASER_TUNE_LIST: 
 
             print(f"\nmeasuring ---- laser tune: {laser_tune}")
+            timeline.next_point(f"laser tune {laser_tune}")
 
-            Laser.Instance().set_tune_value(laser_tune)
-
-            time.sleep(config.CLS_MEASUREMENT_SLEEP)
-            logging.getLogger("OMCU").info(f"measuring dataset of {config.CLS_NR_OF_WAVEFORMS} Waveforms from Picoscope")
-            dataset = Picoscope.Instance().block_measurement(config.CLS_NR_OF_WAVEFORMS)
-
-            if not dataset.calculate_occ(config.CLS_SIGNAL_THRESHOLD):
-                logging.getLogger("OMCU").warning("Measured occupancy of 0. Will NOT store data and continue with next measurement.")
-                print("Measured occupancy of 0. Will NOT store data and continue with next measurement.")
-                continue
+            with timeline.stage("laser tune"):
+                Laser.Instance().set_tune_value(laser_tune)
 
-            dataset.setFilename(config.CLS_DATAFILE)
-            dataset.setFilepath(DATA_PATH)
-            dataset.setHDF5_key(f"laser tune {laser_tune}")
-
-            logging.getLogger("OMCU").info(f"determining dataset metadata")
-            dataset.measure_metadict(signal_threshold=config.CLS_SIGNAL_THRESHOLD)
-            if config.CLS_FILTER_DATASET:
-                logging.getLogger("OMCU").info(f"filtering dataset by threshold of {config.CLS_SIGNAL_THRESHOLD} mV")
-                dataset.filter_by_threshold(signal_threshold=config.CLS_SIGNAL_THRESHOLD)
-
-            logging.getLogger("OMCU").info(f"writing dataset to harddrive")
-            dataset.write_to_file(hdf5_connection=h5_connection)
+            with timeline.stage("sleep"):
+                time.sleep(config.CLS_MEASUREMENT_SLEEP)
+            nr_waveforms = waveform_counts.nr_of_waveforms(laser_tune)
+            logging.getLogger("OMCU").info(f"measuring dataset of {nr_waveforms} Waveforms from Picoscope")
+            measure_point(pipeline, laser_tune, nr_waveforms, config.CLS_SIGNAL_THRESHOLD, config.CLS_DATAFILE, DATA_PATH, f"laser tune {laser_tune}",
+                          nr_signals=waveform_counts.nr_of_signals(laser_tune), max_waveforms=waveform_counts.max_waveforms)
 
     print(f"\nFinished charge linearity scan\nData located at {os.path.join(DATA_PATH, config.CLS_DATAFILE)}")
 
@@ -232,9 +363,11 @@ def charge_linearity_scan(DATA_PATH):
 #------------------------------------------------------------------------------
 
 
+@timed_procedure("dark count scan")
 def dark_count_scan(DATA_PATH):
 
     logging.getLogger("OMCU").info(f"entering DCS measurement")
+    timeline = StageTimeline.Instance()
 
     Laser.Instance().off_pulsed()
     Rotation.Instance().go_home()
@@ -244,30 +377,43 @@ def dark_count_scan(DATA_PATH):
     print(f"\nperforming dark count scan over:\nHV:\t{config.DCS_HV_LIST}\n")
     print(f"saving data in {os.path.join(DATA_PATH, config.DCS_DATAFILE)}")
 
-    with h5py.File(os.path.join(DATA_PATH, config.DCS_DATAFILE), 'w') as h5_connection:
+    def count_and_write(dataset):
+        # runs in the worker of the ScanPipeline, the device metadata is already in the metadict
+        logging.getLogger("OMCU").info(f"determining dark counts")
+        with timeline.stage("metadict"):
+            dataset.measure_metadict(signal_threshold=config.DCS_SIGNAL_THRESHOLD, only_dark_counts=True)
+        logging.getLogger("OMCU").info(f"writing dataset to harddrive")
+        with timeline.stage("HDF5 write"):
+            dataset.write_to_file(hdf5_connection=h5_connection)
+
+    with h5py.File(os.path.join(DATA_PATH, config.DCS_DATAFILE), 'w') as h5_connection, \
+         ScanPipeline(count_and_write) as pipeline:
 
         # loop through HV
         for HV in config.DCS_HV_LIST: 
 
             print(f"\nmeasuring ---- HV: {HV}")
+            timeline.next_point(f"HV {HV}")
 
-            uBase.Instance().SetVoltage(HV)
+            with timeline.stage("HV settling"):
+                uBase.Instance().SetVoltage(HV)
 
             for i in range(config.DCS_NR_OF_ITERATIONS):
 
-                time.sleep(config.DCS_MEASUREMENT_SLEEP)
+                timeline.next_point(f"HV {HV}/iteration {i}")
+                with timeline.stage("sleep"):
+                    time.sleep(config.DCS_MEASUREMENT_SLEEP)
                 logging.getLogger("OMCU").info(f"measuring dataset of {config.DCS_NR_OF_WAVEFORMS} Waveforms with {config.DCS_NR_OF_SAMPLES} samples from Picoscope")
+                snapshot = snapshot_devices_async() # device states are read while the Picoscope captures
                 dataset = Picoscope.Instance().get_datastream(config.DCS_NR_OF_SAMPLES, config.DCS_NR_OF_WAVEFORMS)
 
                 dataset.setFilename(config.DCS_DATAFILE)
                 dataset.setFilepath(DATA_PATH)
                 dataset.setHDF5_key(f"HV {HV}/iteration {i}")
 
-                logging.getLogger("OMCU").info(f"determining dataset metadata")
-                dataset.measure_metadict(signal_threshold=config.DCS_SIGNAL_THRESHOLD)
-
-                logging.getLogger("OMCU").info(f"writing dataset to harddrive")
-                dataset.write_to_file(hdf5_connection=h5_connection)
+                # dark counts and writing happen in the background during the next iteration
+                dataset.measure_metadict(signal_threshold=config.DCS_SIGNAL_THRESHOLD, only_device_metadata=True, snapshot=snapshot)
+                pipeline.submit(dataset)
                 
 
     print(f"\nFinished charge linearity scan\nData located at {os.path.join(DATA_PATH, config.DCS_DATAFILE)}")
@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+import contextlib
+import csv
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import config
+
+# per scan point timing of the stages of the testing procedures (move, HV settling, sleep, capture, ADC conversion,
+# metadict, device metadata, HDF5 write, ...). every finished stage is a row of the timeline csv next to the log file
+# (config.TIMELINE_FILE), a summary of where the run time went is logged after every procedure and written as json
+# (config.TIMELINE_SUMMARY_FILE).
+#
+# capture rows carry the nr of captured samples (size), so the latency models of utils.Planner can be calibrated
+# on the timeline.
+# durations are exclusive: a stage nested in another one (e.g. the captures inside the tuning) is not counted
+# again in the outer stage, so the stages of a thread add up.
+# the procedure and scan point a stage belongs to are kept per thread. the ScanPipeline worker and the snapshot
+# threads take them over from the main thread with current() / attach().
+# as long as the timeline is not started, stage() only runs its block.
+#
+# usage:
+#     StageTimeline.Instance().start(DATA_PATH)
+#
+#     @timed_procedure("photocathode scan")
+#     def photocathode_scan(DATA_PATH):
+#         timeline = StageTimeline.Instance()
+#         for phi, theta in points:
+#             timeline.next_point(f"theta {theta}/phi {phi}")
+#             with timeline.stage("move"):
+#                 Rotation.Instance().set_position(phi, theta)
+
+
+class StageTimeline:
+
+    _instance = None
+
+    @classmethod
+    def Instance(cls):
+        if not cls._instance:
+            cls._instance = StageTimeline()
+        return cls._instance
+
+    def __init__(self):
+
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.lock    = threading.Lock()
+        self.local   = threading.local()
+        self.file    = None
+        self.writer  = None
+        self.summary_path = None
+        self.t0      = None
+        self.started = None
+
+        # procedure -> {"wall time [s]", "points", ("main"|"background", stage) -> [count, total, max]}
+        self.totals  = {}
+
+    @property
+    def enabled(self):
+        return self.writer is not None
+
+    def start(self, path, filename = None, summary_filename = None):
+
+        filename         = filename         if filename         is not None else config.TIMELINE_FILE
+        summary_filename = summary_filename if summary_filename is not None else config.TIMELINE_SUMMARY_FILE
+        if not filename:
+            self.logger.info("no timeline file configured, stages are not timed")
+            return
+
+        self.close()
+        self.t0      = time.monotonic()
+        self.started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.totals  = {}
+        self.summary_path = os.path.join(path, summary_filename) if summary_filename else None
+
+        self.file   = open(os.path.join(path, filename), "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["procedure", "point", "stage", "thread", "start [s]", "duration [s]", "size"])
+        self.file.flush()
+        self.logger.info(f"writing stage timeline to {os.path.join(path, filename)}")
+
+    def finish(self):
+
+        # end of the run: summary of the whole run (procedures, cooldown, ...), then the files are closed
+
+        if not self.enabled: return
+        with self.lock:
+            self.totals.setdefault("", {"wall time [s]": 0, "points": 0})["wall time [s]"] = time.monotonic() - self.t0
+        self.log_summary("")
+        self.write_summary()
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+            self.file   = None
+            self.writer = None
+
+    #---------------------------
+
+    def current(self):
+        # (procedure, point) of the calling thread, to be handed to attach() in another thread
+        return getattr(self.local, "procedure", ""), getattr(self.local, "point", "")
+
+    @contextlib.contextmanager
+    def attach(self, context):
+        previous = self.current()
+        self.local.procedure, self.local.point = context
+        try:
+            yield
+        finally:
+            self.local.procedure, self.local.point = previous
+
+    @contextlib.contextmanager
+    def procedure(self, name):
+
+        # the stages within belong to the procedure. its wall time is the reference of the summary,
+        # in the summary of the whole run the procedure is listed like a stage
+
+        start = time.monotonic()
+        try:
+            with self.attach((name, "")):
+                yield
+        finally:
+            if self.enabled:
+                elapsed = time.monotonic() - start
+                with self.lock:
+                    self.totals.setdefault(name, {"wall time [s]": 0, "points": 0})["wall time [s]"] += elapsed
+                self._record(name, start, elapsed)
+                self.log_summary(name)
+                self.write_summary()
+
+    def next_point(self, key):
+        # the following stages of the thread belong to the scan point key, until the next point or the end of the procedure
+        procedure = self.current()[0]
+        self.local.procedure, self.local.point = procedure, key
+        if self.enabled:
+            with self.lock:
+                self.totals.setdefault(procedure, {"wall time [s]": 0, "points": 0})["points"] += 1
+
+    @contextlib.contextmanager
+    def stage(self, name, size = None):
+
+        # size: amount of data the stage works on (e.g. nr of captured samples), stored in the timeline
+
+        if not self.enabled:
+            yield
+            return
+
+        stack = getattr(self.local, "stack", None)
+        if stack is None: stack = self.local.stack = []
+
+        stack.append(0.)   # time spent in nested stages
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed  = time.monotonic() - start
+            duration = elapsed - stack.pop()
+            if stack: stack[-1] += elapsed
+            self._record(name, start, duration, size)
+
+    def _record(self, name, start, duration, size = None):
+
+        procedure, point = self.current()
+        thread = "main" if threading.current_thread() is threading.main_thread() else "background"
+
+        with self.lock:
+            if self.writer is None: return
+            self.writer.writerow([procedure, point, name, thread, round(start - self.t0, 4), round(duration, 4), "" if size is None else size])
+            self.file.flush()
+
+            totals = self.totals.setdefault(procedure, {"wall time [s]": 0, "points": 0})
+            count, total, longest = totals.get((thread, name), (0, 0., 0.))
+            totals[(thread, name)] = (count + 1, total + duration, max(longest, duration))
+
+    #---------------------------
+
+    def summary(self):
+
+        # per procedure: wall time, nr of points and per thread and stage count, total, mean, max and share of the
+        # wall time. the main thread time not covered by any stage is listed as "other".
+        # stages outside of a procedure (cooldown, laser warm-up, ...) are listed under "run"
+
+        summary = {"start": self.started, "procedures": {}}
+        with self.lock:
+            items = [(procedure, dict(totals)) for procedure, totals in self.totals.items()]
+
+        for procedure, totals in items:
+
+            wall = totals.pop("wall time [s]")
+            entry = {"wall time [s]": round(wall, 3), "points": totals.pop("points"), "main": {}, "background": {}}
+            for (thread, name), (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+                entry[thread][name] = {"count":     count,
+                                       "total [s]": round(total, 3),
+                                       "mean [s]":  round(total / count, 4),
+                                       "max [s]":   round(longest, 4),
+                                       "share [%]": round(100 * total / wall, 1) if wall > 0 else None}
+            if wall > 0:
+                other = wall - sum(total for (thread, _), (_, total, _) in totals.items() if thread == "main")
+                entry["main"]["other"] = {"count": 1, "total [s]": round(other, 3), "mean [s]": round(other, 4),
+                                          "max [s]": round(other, 4), "share [%]": round(100 * other / wall, 1)}
+            summary["procedures"][procedure if procedure else "run"] = entry
+
+        return summary
+
+    def log_summary(self, procedure):
+
+        entry = self.summary()["procedures"].get(procedure if procedure else "run")
+        if not entry: return
+
+        lines = [f"time spent in {procedure if procedure else 'run'}: {round(entry['wall time [s]'] / 60, 1)} minutes" + (f" for {entry['points']} points" if entry["points"] else "")]
+        for thread in ("main", "background"):
+            for name, stage in entry[thread].items():
+                share = f"{stage['share [%]']:5.1f} %" if stage["share [%]"] is not None else "    - "
+                lines.append(f"    {thread:<10} {name:<22} {share}  total {stage['total [s]']:9.1f} s  mean {stage['mean [s]']:8.3f} s  x{stage['count']}")
+        self.logger.info("\n".join(lines))
+        print("\n" + "\n".join(lines))
+
+    def write_summary(self):
+        if not self.summary_path: return
+        with open(self.summary_path, "w") as file:
+            json.dump(self.summary(), file, indent=4)
+
+
+def timed_procedure(name):
+
+    # decorator of the testing procedures: runs the function as procedure name of the StageTimeline
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with StageTimeline.Instance().procedure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
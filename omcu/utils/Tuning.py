@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+
+import json
+import logging
+import os
+
+import config
+import numpy as np
+
+# models for the tuning of the laser (occupancy) and the HV (gain), see utils.util.tune_occ / tune_gain.
+# measurements of earlier runs are kept in config.TUNE_MODEL_FILE (json, in config.OUT_PATH) to seed the models
+
+#-----------------------------------------------------
+
+def _model_file():
+    if not config.TUNE_MODEL_FILE: return None
+    return os.path.join(config.OUT_PATH, config.TUNE_MODEL_FILE)
+
+
+def load_tuning_history(key):
+
+    # returns the stored observations of the given model, [] if there are none
+
+    path = _model_file()
+    if not path or not os.path.exists(path): return []
+    try:
+        with open(path) as file:
+            return json.load(file).get(key, [])
+    except (OSError, ValueError):
+        logging.getLogger("OMCU").warning(f"could not read tuning history from {path}, starting without")
+        return []
+
+
+def save_tuning_history(key, observations):
+
+    path = _model_file()
+    if not path or not os.path.isdir(os.path.dirname(path)): return
+    try:
+        history = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                history = json.load(file)
+        history[key] = observations[-config.TUNE_MODEL_HISTORY:]
+        with open(path, "w") as file:
+            json.dump(history, file, indent=1)
+    except (OSError, ValueError):
+        logging.getLogger("OMCU").warning(f"could not write tuning history to {path}")
+
+#-----------------------------------------------------
+
+class OccupancyModel:
+
+    # occupancy vs laser tune. occupancy is monotonic in the tune, and linear in good approximation
+    # after transforming to the log of the mean nr of photoelectrons: y = log(-log(1 - occ)) (poisson).
+    # the offset changes between PMTs / positions, so earlier runs only provide the slope, the
+    # measurements of the current run are used for secant steps
+
+    history_key = "occupancy"
+
+    def __init__(self, history=None):
+        self.history  = load_tuning_history(self.history_key) if history is None else list(history)
+        self.measured = []    # (tune, occ) of the current run
+
+    @staticmethod
+    def transform(occ):
+        occ = np.clip(occ, 1e-5, 1 - 1e-5)
+        return np.log(-np.log(1 - occ))
+
+    def add(self, tune, occ):
+        self.measured.append((tune, occ))
+        self.history.append((tune, occ))
+        save_tuning_history(self.history_key, self.history)
+
+    def reset(self):
+        # conditions changed (e.g. HV): the measurements of the current run are no longer valid for secant steps,
+        # they remain in the history for the slope
+        self.measured = []
+
+    def slope(self):
+
+        # slope dy/dtune of the earlier runs, None if unknown
+
+        if len(self.history) < 2: return None
+        tunes, occs = np.array(self.history, dtype=float).T
+        if np.ptp(tunes) == 0: return None
+        slope = np.polyfit(tunes, self.transform(occs), 1)[0]
+        return slope if slope else None
+
+    def bracket(self, target):
+
+        # closest pair of measured tunes with occupancy below and above the target, None if not bracketed yet
+
+        below = [tune for tune, occ in self.measured if occ < target]
+        above = [tune for tune, occ in self.measured if occ > target]
+        if not below or not above: return None
+        return min(((b, a) for b in below for a in above), key=lambda pair: abs(pair[0] - pair[1]))
+
+    def predict(self, target):
+
+        # tune for the target occupancy: secant through the two measurements closest to the target,
+        # with a single measurement along the slope of earlier runs. None if no prediction possible
+
+        if not self.measured: return None
+        y_target = self.transform(target)
+        points   = sorted(((abs(self.transform(occ) - y_target), tune, self.transform(occ)) for tune, occ in self.measured))
+
+        distinct = [points[0]] + [point for point in points[1:] if point[1] != points[0][1]]
+        if len(distinct) >= 2:
+            (_, t1, y1), (_, t2, y2) = distinct[:2]
+            if y1 != y2:
+                return t1 + (y_target - y1) * (t2 - t1) / (y2 - y1)
+
+        slope = self.slope()
+        if slope is None: return None
+        _, t1, y1 = points[0]
+        return t1 + (y_target - y1) / slope
+
+    def best(self, target):
+        # measured (tune, occ) closest to the target
+        return min(self.measured, key=lambda point: abs(point[1] - target))
+
+
+def next_laser_tune(model, tune, occ, occ_min, occ_max, step, tune_range=(0, 1000)):
+
+    # next laser tune to measure: model prediction, bisection inside the bracket if the prediction
+    # leaves it, and growing steps in the direction of the old linear search (occ too low: decrease tune)
+    # as long as nothing is known. returns None if the tune can not be improved anymore (bracket of width 1)
+
+    target  = (occ_min + occ_max) / 2
+    bracket = model.bracket(target)
+    guess   = model.predict(target)
+
+    if bracket:
+        low, high = sorted(bracket)
+        if high - low <= 1: return None
+        if guess is None or not low < guess < high:
+            guess = (low + high) / 2
+    elif guess is None:
+        direction = -1 if occ < target else 1
+        guess = tune + direction * step * 2**(len(model.measured) - 1)
+
+    guess = int(round(np.clip(guess, *tune_range)))
+
+    # rounding may hit a measured tune, take the next unmeasured one in the direction of the prediction
+    measured = [t for t, _ in model.measured]
+    if guess in measured:
+        direction = np.sign(guess - tune) or (-1 if occ < target else 1)
+        while guess in measured and tune_range[0] <= guess <= tune_range[1]:
+            guess += int(direction)
+        if bracket and not min(bracket) < guess < max(bracket): return None
+        if not tune_range[0] <= guess <= tune_range[1]: return None
+    return guess
+
+#-----------------------------------------------------
+
+class GainModel:
+
+    # gain vs Dy10 of the PMT: power law gain = a * Dy10^k, i.e. linear in log-log.
+    # with two or more measurements (at different voltages) of the current run, the power law is fitted to them.
+    # with a single one only the amplitude is taken from it and the exponent comes from the warm start
+    # (the PMT's previous frontal HV scan) or config.TUNE_GAIN_EXPONENT
+
+    def __init__(self, warm_start=None):
+
+        # warm_start: hdf5 file of a previous frontal HV scan of this PMT (see load_hv_scan)
+
+        self.measured = []    # (Dy10, gain) of the current run
+        self.prior    = load_hv_scan(warm_start) if warm_start else []
+        if self.prior:
+            logging.getLogger("OMCU").info(f"warm start of gain model with {len(self.prior)} points of {warm_start}")
+
+    def add(self, V, gain):
+        if gain > 0: self.measured.append((V, gain))
+
+    @staticmethod
+    def fit(points):
+        # returns log amplitude and exponent, None if the points do not determine the power law
+        if len(points) < 2: return None
+        V, gain = np.array(points, dtype=float).T
+        if np.ptp(V) == 0: return None
+        k, log_a = np.polyfit(np.log(V), np.log(gain), 1)
+        return (log_a, k) if k > 0 else None
+
+    def exponent(self):
+        for points in (self.measured, self.prior):
+            if len(points) >= 2 and self.fit(points): return self.fit(points)[1]
+        return config.TUNE_GAIN_EXPONENT
+
+    def predict(self, target):
+
+        # Dy10 for the target gain, None if nothing is known
+
+        fitted = self.fit(self.measured) if len(self.measured) >= 2 else None
+        if fitted:
+            log_a, k = fitted
+        elif self.measured:
+            k = self.exponent()
+            V, gain = self.measured[-1]
+            log_a = np.log(gain) - k * np.log(V)
+        elif self.prior and self.fit(self.prior):
+            log_a, k = self.fit(self.prior)
+        else:
+            return None
+        return float(np.exp((np.log(target) - log_a) / k))
+
+    def best(self, target):
+        # measured (Dy10, gain) closest to the target
+        return min(self.measured, key=lambda point: abs(point[1] - target))
+
+
+def load_hv_scan(path):
+
+    # (Dy10, gain) of the measurements of a frontal HV scan file, [] if it can not be read
+
+    from utils.DataHandler import DataHandler
+
+    try:
+        data = DataHandler(filename=os.path.basename(path), filepath=os.path.dirname(path))
+        data.load_metadicts()
+        points = [(float(m.metadict["Dy10 [V]"]), float(m.metadict["gain"])) for m in data.measurements]
+    except Exception:
+        logging.getLogger("OMCU").warning(f"could not load frontal HV scan {path} for the gain model warm start")
+        return []
+    return [(V, gain) for V, gain in points if V > 0 and gain > 0]
+
+
+def next_voltage(model, V, gain_min, gain_max, step, V_max):
+
+    # next Dy10 to measure: power law prediction, rounded to the resolution step (uBase sets integer Dy10)
+    # and limited to config.TUNE_GAIN_MAX_JUMP. returns None if the voltage can not be improved anymore
+
+    target = (gain_min + gain_max) / 2
+    guess  = model.predict(target)
+    if guess is None:
+        # no signal (gain 0) counts as too low
+        guess = V + (step if not model.measured or model.measured[-1][1] < target else -step)
+
+    guess = np.clip(guess, V - config.TUNE_GAIN_MAX_JUMP, V + config.TUNE_GAIN_MAX_JUMP)
+    guess = float(min(round(guess / step) * step, V_max))
+
+    if guess in [V for V, _ in model.measured]: return None
+    return guess
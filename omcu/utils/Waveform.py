@@ -9,15 +9,19 @@ from scipy import constants
 class Waveform:
 
     # class to handle a single Waveform
+    # (also used as a lightweight view onto one row of a utils.WaveformBatch.WaveformBatch)
+    # the trigger trace may be replaced by the already known trigger time
 
-    def __init__(self, time, signal, trigger, signal_threshold = -3.5):
+    def __init__(self, time, signal, trigger = None, signal_threshold = -3.5, trigger_time = None):
         
-        self.time    = np.array(time, dtype=np.float32)
-        self.signal  = np.array(signal, dtype=np.float32)
-        self.trigger = np.array(trigger, dtype=np.float32)
+        self.time    = np.asarray(time, dtype=np.float32)
+        self.signal  = np.asarray(signal, dtype=np.float32)
+        self.trigger = None if trigger is None else np.asarray(trigger, dtype=np.float32)
+        self._trigger_time = trigger_time
 
         assert len(self.time) == len(self.signal)
-        assert len(self.time) == len(self.trigger)
+        assert self.trigger is not None or self._trigger_time is not None
+        if self.trigger is not None: assert len(self.time) == len(self.trigger)
 
         self.trigger_val = 2000
         self.default_trigger_index = 100
@@ -46,8 +50,12 @@ class Waveform:
 
     @property
     def trigger_time(self):
+        if self._trigger_time is not None: return self._trigger_time
         try:
+            # rising edge, linearly interpolated between the two samples around the crossing
             trigger_index = np.flatnonzero((self.trigger[:-1] < self.trigger_val) & (self.trigger[1:] > self.trigger_val))[0]
+            fraction = (self.trigger_val - self.trigger[trigger_index]) / (self.trigger[trigger_index+1] - self.trigger[trigger_index])
+            return self.time[trigger_index] + fraction * (self.time[trigger_index+1] - self.time[trigger_index])
         except:
             trigger_index = self.default_trigger_index
         return self.time[trigger_index]
@@ -91,7 +99,7 @@ class Waveform:
 ###-----------------------------------------------------------------
 
     def __eq__(self, other):
-        return np.array_equal(self.time, other.time) and np.array_equal(self.signal, other.signal) and np.array_equal(self.trigger, other.trigger)
+        return np.array_equal(self.time, other.time) and np.array_equal(self.signal, other.signal) and np.array_equal(self.trigger, other.trigger) and self.trigger_time == other.trigger_time
 
     def __len__(self):
         return len(self.time)
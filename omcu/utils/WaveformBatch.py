@@ -0,0 +1,398 @@
+#!/usr/bin/python3
+
+import numpy as np
+from scipy import constants
+from utils.Waveform import Waveform
+
+# Picoscope channel input ranges in mV, indexed by the range setting of the channel
+channelInputRanges = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000]
+
+
+def adc2mV(adc, range, max_adc):
+    # converts ADC codes to mV in one vectorized pass
+    mV = np.empty(np.shape(adc), dtype=np.float32)
+    np.multiply(adc, np.float32(channelInputRanges[range] / max_adc), out=mV)
+    return mV
+
+
+def mV2adc(mV, range, max_adc):
+    return mV * max_adc / channelInputRanges[range]
+
+
+def trigger_crossing_time(time, trigger, threshold, default_index = 100):
+
+    # time of the first rising edge through threshold of every row of trigger, linearly interpolated
+    # between the two samples around the crossing. works on raw ADC codes as well as on mV.
+    # rows without a crossing get the time of default_index
+
+    trigger  = np.asarray(trigger)
+    crossing = (trigger[:, :-1] < threshold) & (trigger[:, 1:] > threshold)
+    found    = crossing.any(axis=1)
+    index    = np.where(found, np.argmax(crossing, axis=1), default_index)
+
+    lower = np.take_along_axis(trigger, index[:, None], axis=1)[:, 0].astype(np.float32)
+    upper = np.take_along_axis(trigger, np.minimum(index + 1, trigger.shape[1] - 1)[:, None], axis=1)[:, 0].astype(np.float32)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(found, (threshold - lower) / (upper - lower), 0)
+
+    return (time[index] + fraction * (time[1] - time[0])).astype(np.float32)
+
+
+class WaveformBatch:
+
+    # class to handle many Waveforms of equal length at once.
+    # signal and trigger are stored as 2D arrays (n_waveforms x n_samples) that share one time axis,
+    # every Waveform property is available as a vectorized array over all waveforms.
+    # signal and trigger may be handed over as raw int16 ADC codes (with range and max_adc),
+    # they are then converted to mV only when first needed.
+    # instead of the full trigger trace, the per-waveform trigger times may be handed over (see trigger_crossing_time)
+
+    # expected transit time window and pulse half-width in ns (see Waveform.mask).
+    # change with set_window(), which keeps the cached prefix sums
+    expected_tt_max = 220
+    expected_tt_min = 190
+    expected_waveform_length = 20
+
+    # cache entries that depend on the integration window
+    _window_keys = ("window", "mask", "charge", "baseline", "baseline_std")
+
+    # trigger threshold in mV and fallback sample index if the trigger never crosses it
+    trigger_val = 2000
+    default_trigger_index = 100
+
+    def __init__(self, time, signal, trigger = None, signal_threshold = -3.5, signal_range = None, trigger_range = None, max_adc = None, trigger_time = None):
+
+        self.time = np.asarray(time, dtype=np.float32)
+
+        # legacy data carries one (identical) time row per waveform
+        if self.time.ndim == 2: self.time = self.time[0]
+
+        self.signal_range  = signal_range
+        self.trigger_range = trigger_range
+        self.max_adc       = max_adc
+
+        self.signal_adc,  self._signal  = self._split_raw(signal, signal_range)
+        self.trigger_adc, self._trigger = self._split_raw(trigger, trigger_range)
+
+        self._trigger_time = None if trigger_time is None else np.asarray(trigger_time, dtype=np.float32)
+
+        assert len(self.shape) == 2
+        assert self.time.shape == self.shape[1:]
+        if self.has_trigger_trace:
+            assert (self.trigger_adc if self.trigger_adc is not None else self._trigger).shape == self.shape
+        else:
+            assert self._trigger_time is not None, "either the trigger trace or the trigger times need to be handed over"
+            assert self._trigger_time.shape == self.shape[:1]
+
+        self.signal_threshold = signal_threshold
+
+        self._cache = {}
+
+    @classmethod
+    def from_waveforms(cls, waveforms, signal_threshold = -3.5):
+        has_trace = all(wf.trigger is not None for wf in waveforms)
+        return cls(time=waveforms[0].time,
+                   signal=np.stack([wf.signal for wf in waveforms]),
+                   trigger=np.stack([wf.trigger for wf in waveforms]) if has_trace else None,
+                   trigger_time=None if has_trace else [wf.trigger_time for wf in waveforms],
+                   signal_threshold=signal_threshold)
+
+    @classmethod
+    def concatenate(cls, batches):
+
+        # joins batches of the same capture settings (e.g. chunks of a sequential measurement).
+        # raw ADC codes are kept if all batches have them
+
+        batches = list(batches)
+        first   = batches[0]
+        raw     = all(batch.is_raw for batch in batches)
+        trace   = all(batch.has_trigger_trace for batch in batches)
+        return cls(time=first.time,
+                   signal=np.concatenate([batch.signal_adc if raw else batch.signal for batch in batches]),
+                   trigger=np.concatenate([batch.trigger_adc if raw else batch.trigger for batch in batches]) if trace else None,
+                   trigger_time=np.concatenate([batch.trigger_time for batch in batches]),
+                   signal_threshold=first.signal_threshold,
+                   signal_range=first.signal_range,
+                   trigger_range=first.trigger_range,
+                   max_adc=first.max_adc)
+
+    def _split_raw(self, data, range):
+        # integer data are raw ADC codes, everything else is taken as mV
+        if data is None: return None, None
+        data = np.asarray(data)
+        if np.issubdtype(data.dtype, np.integer):
+            assert range is not None and self.max_adc, "raw ADC data need a voltage range and max_adc"
+            return data, None
+        return None, np.asarray(data, dtype=np.float32)
+
+    @property
+    def signal(self):
+        if self._signal is None:
+            self._signal = adc2mV(self.signal_adc, self.signal_range, self.max_adc)
+        return self._signal
+
+    @property
+    def trigger(self):
+        # None if only the trigger times are stored
+        if self._trigger is None and self.trigger_adc is not None:
+            self._trigger = adc2mV(self.trigger_adc, self.trigger_range, self.max_adc)
+        return self._trigger
+
+    def convert(self):
+        # converts the raw ADC codes of signal and (if stored) trigger to mV now instead of when first needed,
+        # e.g. to time the conversion on its own. the ADC codes are kept
+        if self._signal is None:
+            self._signal = adc2mV(self.signal_adc, self.signal_range, self.max_adc)
+        if self._trigger is None and self.trigger_adc is not None:
+            self._trigger = adc2mV(self.trigger_adc, self.trigger_range, self.max_adc)
+        return self
+
+    @property
+    def has_trigger_trace(self):
+        return self.trigger_adc is not None or self._trigger is not None
+
+    @property
+    def is_raw(self):
+        # True if the unmodified ADC codes of signal and (if stored) trigger are available
+        return self.signal_adc is not None and (self.trigger_adc is not None or self._trigger is None)
+
+    @property
+    def shape(self):
+        return (self.signal_adc if self.signal_adc is not None else self._signal).shape
+
+    def _cached(self, key, func):
+        # properties are derived from signal/trigger only, so they are computed once per batch
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    def _at_index(self, index):
+        # picks one sample per waveform from the time axis
+        return self.time[index]
+
+    @staticmethod
+    def _take(array, index):
+        # picks one value per row
+        return np.take_along_axis(array, np.asarray(index)[:, None], axis=1)[:, 0]
+
+    @property
+    def nr_samples(self):
+        return self.shape[1]
+
+    @property
+    def dt(self):
+        # sample interval in ns. the Picoscope timebase is uniform
+        return float(self.time[1] - self.time[0])
+
+    def set_window(self, tt_min=None, tt_max=None, waveform_length=None):
+
+        # changes the integration window. only the window indices and the quantities
+        # derived from them are recomputed, the prefix sums are reused
+
+        if tt_min is not None:          self.expected_tt_min = tt_min
+        if tt_max is not None:          self.expected_tt_max = tt_max
+        if waveform_length is not None: self.expected_waveform_length = waveform_length
+        for key in self._window_keys:
+            self._cache.pop(key, None)
+
+    def _index_after(self, time_value):
+        # first sample index with time > time_value
+        return int(np.floor(np.round((time_value - float(self.time[0])) / self.dt, 6))) + 1
+
+    def _index_before(self, time_value):
+        # first sample index with time >= time_value (exclusive stop of an open interval)
+        return int(np.ceil(np.round((time_value - float(self.time[0])) / self.dt, 6)))
+
+###-----------------------------------------------------------------
+
+    @property
+    def mean(self):
+        return self._cached("mean", lambda: np.mean(self.signal, axis=1, dtype=np.float64))
+
+    @property
+    def min_value(self):
+        # works on the ADC codes if available, so the occupancy does not need a mV conversion
+        if self.signal_adc is not None and self._signal is None:
+            return self._cached("min_value", lambda: adc2mV(np.min(self.signal_adc, axis=1), self.signal_range, self.max_adc))
+        return self._cached("min_value", lambda: np.min(self.signal, axis=1))
+
+    @property
+    def min_index(self):
+        if self.signal_adc is not None and self._signal is None:
+            return self._cached("min_index", lambda: np.argmin(self.signal_adc, axis=1))
+        return self._cached("min_index", lambda: np.argmin(self.signal, axis=1))
+
+    @property
+    def min_time(self):
+        return self._cached("min_time", lambda: self._at_index(self.min_index))
+
+    @property
+    def has_signal(self):
+        if self.signal_threshold: return self.min_value < self.signal_threshold
+        else: return np.ones(len(self), dtype=bool)
+
+    @property
+    def threshold_crossing_time(self):
+        return self._cached("threshold_crossing_time",
+                            lambda: self._at_index(np.argmax(self.signal < self.signal_threshold, axis=1)))
+
+    @property
+    def trigger_time(self):
+
+        # handed over trigger times, or the interpolated rising edge of the trigger trace
+
+        def calc():
+            if self.trigger_adc is not None and self._trigger is None:
+                threshold = self.trigger_val * self.max_adc / channelInputRanges[self.trigger_range]
+                return trigger_crossing_time(self.time, self.trigger_adc, threshold, self.default_trigger_index)
+            return trigger_crossing_time(self.time, self.trigger, self.trigger_val, self.default_trigger_index)
+
+        if self._trigger_time is not None: return self._trigger_time
+        return self._cached("trigger_time", calc)
+
+    @property
+    def transit_time(self):
+        return self.min_time - self.trigger_time
+
+    @property
+    def rise_time(self):
+        return self.min_time - self.threshold_crossing_time
+
+    @property
+    def window(self):
+
+        # start (inclusive) and stop (exclusive) sample index of the pulse window of every waveform.
+        # same selection as Waveform.mask, but computed once per batch from the uniform timebase
+
+        def calc():
+            half_width = np.round(self.expected_waveform_length / self.dt, 6)
+            in_window = (self.min_time > self.trigger_time + self.expected_tt_min) & (self.min_time < self.trigger_time + self.expected_tt_max)
+
+            start = np.where(in_window, self.min_index + int(np.floor(-half_width)) + 1, self._index_after(self.expected_tt_min))
+            stop  = np.where(in_window, self.min_index + int(np.ceil(half_width)),       self._index_before(self.expected_tt_max))
+
+            start = np.clip(start, 0, self.nr_samples)
+            stop  = np.clip(stop, start, self.nr_samples)
+            return start, stop
+
+        return self._cached("window", calc)
+
+    @property
+    def mask(self):
+        def calc():
+            start, stop = self.window
+            samples = np.arange(self.nr_samples)
+            return (samples >= start[:, None]) & (samples < stop[:, None])
+        return self._cached("mask", calc)
+
+    @property
+    def prefix_sum(self):
+
+        # cumulative sum of the signal with a leading zero column: sum(signal[i, a:b]) = P[i, b] - P[i, a]
+
+        def calc():
+            prefix = np.zeros((len(self), self.nr_samples + 1), dtype=np.float64)
+            np.cumsum(self.signal, axis=1, dtype=np.float64, out=prefix[:, 1:])
+            return prefix
+
+        return self._cached("prefix_sum", calc)
+
+    @property
+    def prefix_sum_squared(self):
+        def calc():
+            prefix = np.zeros((len(self), self.nr_samples + 1), dtype=np.float64)
+            np.cumsum(np.square(self.signal, dtype=np.float64), axis=1, out=prefix[:, 1:])
+            return prefix
+        return self._cached("prefix_sum_squared", calc)
+
+    def window_sum(self, prefix=None):
+        # sum of the signal (or of the quantity of the given prefix array) inside the pulse window, O(1) per waveform
+        if prefix is None: prefix = self.prefix_sum
+        start, stop = self.window
+        return self._take(prefix, stop) - self._take(prefix, start)
+
+    @property
+    def baseline(self):
+
+        def calc():
+            start, stop = self.window
+            outside_sum = self.prefix_sum[:, -1] - self.window_sum()
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return outside_sum / (self.nr_samples - (stop - start))
+
+        return self._cached("baseline", calc)
+
+    @property
+    def baseline_std(self):
+
+        def calc():
+            start, stop = self.window
+            outside_sum_squared = self.prefix_sum_squared[:, -1] - self.window_sum(self.prefix_sum_squared)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                variance = outside_sum_squared / (self.nr_samples - (stop - start)) - self.baseline**2
+            return np.sqrt(np.clip(variance, 0, None))
+
+        return self._cached("baseline_std", calc)
+
+    @property
+    def peak_to_valley_ratio(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.abs(self.min_value - self.baseline) / (self.baseline_std / 2)
+
+    @property
+    def charge(self):
+
+        def calc():
+            # trapezoidal integration over the pulse window on the uniform timebase:
+            # dt * (sum of all samples - half of the first and last sample)
+            start, stop = self.window
+            last = self.nr_samples - 1
+            edges = self._take(self.signal, np.minimum(start, last)) + self._take(self.signal, np.clip(stop - 1, 0, last))
+            area = np.where(stop - start >= 2, self.dt * (self.window_sum() - 0.5 * edges), 0) * 1e-12 # mV * ns -> V * s
+            return area/50 # 50 Ohm termination at scope
+
+        return self._cached("charge", calc)
+
+    @property
+    def gain(self):
+        return np.abs(self.charge)/constants.e
+
+###-----------------------------------------------------------------
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+
+        # single index returns a Waveform view, everything else a WaveformBatch (keeping raw ADC codes if available)
+        if isinstance(index, (int, np.integer)):
+            return Waveform(time=self.time,
+                            signal=self.signal[index],
+                            trigger=self.trigger[index] if self.has_trigger_trace else None,
+                            trigger_time=self.trigger_time[index],
+                            signal_threshold=self.signal_threshold)
+
+        signal  = self.signal_adc  if self.signal_adc  is not None else self._signal
+        trigger = self.trigger_adc if self.trigger_adc is not None else self._trigger
+        return WaveformBatch(time=self.time,
+                             signal=signal[index],
+                             trigger=trigger[index] if trigger is not None else None,
+                             trigger_time=self.trigger_time[index],
+                             signal_threshold=self.signal_threshold,
+                             signal_range=self.signal_range,
+                             trigger_range=self.trigger_range,
+                             max_adc=self.max_adc)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+###-----------------------------------------------------------------
+
+    def subtract_baseline(self, value=None):
+
+        if value is None: value = self.baseline[:, None]
+        self.signal -= np.float32(value) if np.isscalar(value) else np.asarray(value, dtype=np.float32)
+        self.signal_adc = None # the mV data do not match the ADC codes anymore
+        self._cache = {}
+        return self.signal
@@ -8,6 +8,8 @@ from devices.Laser import Laser
 from devices.Picoscope import Picoscope
 from devices.Rotation import Rotation
 from devices.uBase import uBase
+from utils.Statistics import GainPrecision, OccupancyDecision
+from utils.Tuning import GainModel, OccupancyModel, next_laser_tune, next_voltage
 
 #-----------------------------------------------------
 
@@ -201,6 +203,15 @@ def measure_gain(threshold_signal=-4, iterations=10000):
 
 #-----------------------------------------------------
 
+def tuning_measurement(waveforms, stop_rules):
+
+    # capture for a tuning step: stops early as soon as the stop rules decide (utils.Statistics),
+    # at most waveforms. full capture if config.TUNE_SEQUENTIAL is off
+
+    if not config.TUNE_SEQUENTIAL:
+        return Picoscope.Instance().block_measurement(waveforms)
+    return Picoscope.Instance().sequential_measurement(stop_rules, max_waveforms=waveforms)
+
 def tune_occ(occ_min, occ_max, laser_tune_start=None, laser_tune_step=1, delay=2, threshold_pico=2000, threshold_signal=-4, waveforms=10000,  iterations=10):
 
     # Rotation stage in home position
@@ -231,6 +242,8 @@ def tune_occ(occ_min, occ_max, laser_tune_start=None, laser_tune_step=1, delay=2
 
     logging.getLogger("OMCU").info(f"tuning occupancy at Dy10={round(uBase.Instance().getDy10())} to value between {occ_min} and {occ_max}")
 
+    # bracket the target occupancy and close in with secant / bisection steps on the occupancy model
+    model = OccupancyModel()
     laser_tune = laser_tune_start
     i = 0
 
@@ -238,23 +251,27 @@ def tune_occ(occ_min, occ_max, laser_tune_start=None, laser_tune_step=1, delay=2
 
         Laser.Instance().set_tune_value(laser_tune)
         time.sleep(delay)
-        dataset = Picoscope.Instance().block_measurement(waveforms)
+        dataset = tuning_measurement(waveforms, [OccupancyDecision(threshold_signal, occ_min, occ_max)])
         occ = dataset.calculate_occ(signal_threshold=threshold_signal)
+        model.add(laser_tune, occ)
+
+        if occ_min <= occ <= occ_max:
+            logging.getLogger("OMCU").info(f"measured occupancy to be {occ}, leaving laser tuning")
+            break
 
         if i > iterations:
             logging.getLogger("OMCU").warning(f"could not tune ocupancy in {iterations} iterations. Leaving with occupancy of {round(occ,2)}")
             break
 
-        if occ < occ_min:
-            laser_tune -= laser_tune_step
-            logging.getLogger("OMCU").info(f"measured occupancy to be {occ}, decreasing tune to {laser_tune}")
-        elif occ > occ_max:
-            laser_tune += laser_tune_step
-            logging.getLogger("OMCU").info(f"measured occupancy to be {occ}, increasing tune to {laser_tune}")
-        else:
-            logging.getLogger("OMCU").info(f"measured occupancy to be {occ}, leaving laser tuning")
+        next_tune = next_laser_tune(model, laser_tune, occ, occ_min, occ_max, laser_tune_step)
+        if next_tune is None:
+            laser_tune, occ = model.best((occ_min + occ_max) / 2)
+            Laser.Instance().set_tune_value(laser_tune)
+            logging.getLogger("OMCU").warning(f"occupancy range can not be reached with the laser tune resolution. Leaving with occupancy of {round(occ,2)} at {laser_tune}")
             break
 
+        logging.getLogger("OMCU").info(f"measured occupancy to be {occ} at {laser_tune}, setting tune to {next_tune}")
+        laser_tune = next_tune
         i+=1
 
     return occ, laser_tune
@@ -289,34 +306,120 @@ def tune_gain(g_min, g_max, V_start=None, V_step=1, delay=2, threshold_signal=-4
 
     logging.getLogger("OMCU").info(f"tuning gain to value between {g_min} and {g_max}")
 
+    # jump to the voltage predicted by the gain-vs-Dy10 power law, refined with every measurement
+    model = GainModel(warm_start=config.TUNE_GAIN_WARM_START)
+    target = (g_min + g_max) / 2
     V = V_start
+    if config.TUNE_GAIN_WARM_START and model.predict(target):
+        V = float(min(round(model.predict(target) / V_step) * V_step, uBase.Instance().vmax))
+        logging.getLogger("OMCU").info(f"starting gain tuning at predicted {V} Volt")
     i = 0
 
     while True:
 
         uBase.Instance().SetVoltage(V)
         time.sleep(delay)
-        dataset = Picoscope.Instance().block_measurement(waveforms)
+        dataset = tuning_measurement(waveforms, [GainPrecision(threshold_signal, g_min, g_max)])
         gain, _ = dataset.calculate_gain(signal_threshold=threshold_signal)
+        model.add(V, gain)
+
+        if g_min <= gain <= g_max:
+            logging.getLogger("OMCU").info(f"measured gain to be {round(gain,2)}, leaving gain tuning")
+            break
 
         if i > iterations:
             logging.getLogger("OMCU").warning(f"could not tune gain in {iterations} iterations. Leaving with gain of {round(gain,2)}")
             break
 
-        if gain < g_min:
-            V += V_step
-            logging.getLogger("OMCU").info(f"measured gain to be {round(gain,2)}, moving HV up to {V} Volt")
-        elif gain > g_max:
-            V -= V_step
-            logging.getLogger("OMCU").info(f"measured gain to be {round(gain,2)}, moving HV down to {V} Volt")
-        else:
-            logging.getLogger("OMCU").info(f"measured gain to be {round(gain,2)}, leaving gain tuning")
+        next_V = next_voltage(model, V, g_min, g_max, V_step, uBase.Instance().vmax)
+        if next_V is None:
+            V, gain = model.best(target)
+            uBase.Instance().SetVoltage(V)
+            logging.getLogger("OMCU").warning(f"gain range can not be reached with the voltage resolution. Leaving with gain of {round(gain,2)} at {V} Volt")
             break
 
+        logging.getLogger("OMCU").info(f"measured gain to be {round(gain,2)} at {V} Volt, moving HV to {next_V} Volt")
+        V = next_V
         i+=1
 
     return gain, V
 
+def tune_jointly(occ_min, occ_max, g_min, g_max, laser_tune_start=None, laser_tune_step=1, V_start=None, V_step=1, delay=2, threshold_signal=-4, waveforms=10000, iterations=10):
+
+    # tunes occupancy and gain together: every capture updates both the occupancy and the gain model
+    # and both the laser tune and the HV are stepped at once. the occupancy depends on the gain (threshold),
+    # so the occupancy measurements of the current run are discarded for secant steps when the HV changes
+
+    Rotation.Instance().go_home()
+    if not max(Rotation.Instance().get_position()) <= 1:
+        logging.getLogger("OMCU").error("Error while tuning. Rotation stage is unable to go to home position")
+        raise RuntimeError
+
+    if not Laser.Instance().get_ld() == 1:
+        try:
+            Laser.Instance().on_pulsed()
+        except:
+            logging.getLogger("OMCU").error("Error while tuning. Laser cannot be turned on")
+            raise RuntimeError
+
+    if not len(uBase.Instance().getUID()):
+        logging.getLogger("OMCU").error("Error while tuning. uBase can not be reached")
+        raise RuntimeError
+
+    assert occ_min <= occ_max and g_min <= g_max
+
+    occ_model  = OccupancyModel()
+    gain_model = GainModel(warm_start=config.TUNE_GAIN_WARM_START)
+
+    laser_tune = laser_tune_start if laser_tune_start else Laser.Instance().get_tune_value()
+    V          = V_start if V_start else uBase.Instance().getDy10()
+    if config.TUNE_GAIN_WARM_START and gain_model.predict((g_min + g_max) / 2):
+        V = float(min(round(gain_model.predict((g_min + g_max) / 2) / V_step) * V_step, uBase.Instance().vmax))
+
+    logging.getLogger("OMCU").info(f"tuning occupancy to value between {occ_min} and {occ_max} and gain to value between {g_min} and {g_max}")
+
+    gain_fixed = False    # gain can not get closer to the range, only the occupancy is tuned further
+    i = 0
+    while True:
+
+        Laser.Instance().set_tune_value(laser_tune)
+        uBase.Instance().SetVoltage(V)
+        time.sleep(delay)
+        dataset = tuning_measurement(waveforms, [OccupancyDecision(threshold_signal, occ_min, occ_max), GainPrecision(threshold_signal, g_min, g_max)])
+        occ     = dataset.calculate_occ(signal_threshold=threshold_signal)
+        gain, _ = dataset.calculate_gain(signal_threshold=threshold_signal)
+        occ_model.add(laser_tune, occ)
+        gain_model.add(V, gain)
+
+        occ_ok  = occ_min <= occ <= occ_max
+        gain_ok = gain_fixed or g_min <= gain <= g_max
+        logging.getLogger("OMCU").info(f"measured occupancy of {occ} at {laser_tune} and gain of {round(gain,2)} at {V} Volt")
+
+        if occ_ok and gain_ok: break
+
+        if i > iterations:
+            logging.getLogger("OMCU").warning(f"could not tune in {iterations} iterations. Leaving with occupancy of {round(occ,2)} and gain of {round(gain,2)}")
+            break
+
+        next_V = V if gain_ok else next_voltage(gain_model, V, g_min, g_max, V_step, uBase.Instance().vmax)
+        if next_V is None:
+            logging.getLogger("OMCU").warning("gain range can not be reached with the voltage resolution, keeping the closest voltage")
+            next_V, _ = gain_model.best((g_min + g_max) / 2)
+            gain_fixed = True
+
+        next_tune = laser_tune if occ_ok else next_laser_tune(occ_model, laser_tune, occ, occ_min, occ_max, laser_tune_step)
+        if next_tune is None:
+            if next_V == V:
+                logging.getLogger("OMCU").warning(f"occupancy range can not be reached with the laser tune resolution. Leaving with occupancy of {round(occ,2)}")
+                break
+            next_tune = laser_tune
+
+        if next_V != V: occ_model.reset()
+        laser_tune, V = next_tune, next_V
+        i+=1
+
+    return occ, laser_tune, gain, V
+
 #------------------------------------
 
 def tune_parameters(tune_mode,
@@ -334,90 +437,70 @@ def tune_parameters(tune_mode,
 
     start_time = time.time()
 
-    if tune_mode == "single" or tune_mode == "only_occ":
-
-        assert occ_min and occ_max and laser_step and signal_threshold and nr_waveforms and iterations
-
-        print(f"\ntuning occupancy between {occ_min} and {occ_max}")
-        occ, laser_tune = tune_occ(occ_min=occ_min,
-                                   occ_max=occ_max,
-                                   laser_tune_start=laser_start,
-                                   laser_tune_step=laser_step,
-                                   threshold_signal=signal_threshold,
-                                   waveforms=nr_waveforms,
-                                   iterations=iterations)
-        print(f"reached occupancy of {occ} at {laser_tune} laser tune value")
-
-    if tune_mode == "single" or tune_mode == "only_gain":
+    # the tuning helpers home the stage every time, keep it powered in between
+    with Rotation.Instance().motion_session():
 
-        assert gain_min and gain_max and V_step and signal_threshold and nr_waveforms and iterations
+        if tune_mode == "single" or tune_mode == "only_occ":
 
-        print(f"\ntuning gain between {gain_min} and {gain_max}")
-        gain, HV = tune_gain(g_min=gain_min,
-                             g_max=gain_max,
-                             V_start=V_start,
-                             V_step=V_step,
-                             threshold_signal=signal_threshold,
-                             waveforms=nr_waveforms,
-                             iterations=iterations)
-        print(f"reached gain {gain} at Voltage of {HV} Volt")
+            assert occ_min and occ_max and laser_step and signal_threshold and nr_waveforms and iterations
 
-    if tune_mode == "iter":
+            print(f"\ntuning occupancy between {occ_min} and {occ_max}")
+            occ, laser_tune = tune_occ(occ_min=occ_min,
+                                       occ_max=occ_max,
+                                       laser_tune_start=laser_start,
+                                       laser_tune_step=laser_step,
+                                       threshold_signal=signal_threshold,
+                                       waveforms=nr_waveforms,
+                                       iterations=iterations)
+            print(f"reached occupancy of {occ} at {laser_tune} laser tune value")
 
-        assert occ_min and occ_max and laser_step and signal_threshold and nr_waveforms and iterations
-        assert gain_min and gain_max and V_step and signal_threshold and nr_waveforms and iterations
-        
-        iters = 0
-
-        print(f"\ntuning occupancy between {occ_min} and {occ_max} and gain between {gain_min} and {gain_max} iteratively")
+        if tune_mode == "single" or tune_mode == "only_gain":
 
-        while True:
+            assert gain_min and gain_max and V_step and signal_threshold and nr_waveforms and iterations
 
-            iters += 1
+            print(f"\ntuning gain between {gain_min} and {gain_max}")
+            gain, HV = tune_gain(g_min=gain_min,
+                                 g_max=gain_max,
+                                 V_start=V_start,
+                                 V_step=V_step,
+                                 threshold_signal=signal_threshold,
+                                 waveforms=nr_waveforms,
+                                 iterations=iterations)
+            print(f"reached gain {gain} at Voltage of {HV} Volt")
 
-            _, laser_val = tune_occ(occ_min=occ_min,
-                                    occ_max=occ_max,
-                                    laser_tune_start=laser_start,
-                                    laser_tune_step=laser_step,
-                                    threshold_signal=signal_threshold,
-                                    waveforms=nr_waveforms)
+        if tune_mode == "iter":
 
-            _, HV_val = tune_gain(g_min=gain_min,
-                                  g_max=gain_max,
-                                  V_start=V_start,
-                                  V_step=V_step,
-                                  threshold_signal=signal_threshold,
-                                  waveforms=nr_waveforms)
-
-            # set current tune vals as new starting positions
-            laser_start = laser_val
-            V_start     = HV_val
+            assert occ_min and occ_max and laser_step and signal_threshold and nr_waveforms and iterations
+            assert gain_min and gain_max and V_step and signal_threshold and nr_waveforms and iterations
+        
+            print(f"\ntuning occupancy between {occ_min} and {occ_max} and gain between {gain_min} and {gain_max} jointly")
+
+            occ, laser_val, gain, HV_val = tune_jointly(occ_min=occ_min,
+                                                        occ_max=occ_max,
+                                                        g_min=gain_min,
+                                                        g_max=gain_max,
+                                                        laser_tune_start=laser_start,
+                                                        laser_tune_step=laser_step,
+                                                        V_start=V_start,
+                                                        V_step=V_step,
+                                                        threshold_signal=signal_threshold,
+                                                        waveforms=nr_waveforms,
+                                                        iterations=iterations)
+            print(f"reached occupancy of {occ} at {laser_val} laser tune value and gain of {round(gain,2)} at {HV_val} V.")
+
+        if tune_mode == "none":
 
-            # measure after tuning to avoid cross-influence
             dataset = Picoscope.Instance().block_measurement(nr_waveforms)
             gain, _ = dataset.calculate_gain(signal_threshold=signal_threshold)
             occ     = dataset.calculate_occ(signal_threshold=signal_threshold)
+            print(f"\nwill not tune gain and occupancy. measured:\nocc:\t{occ}\ngain:\t{round(gain,2)}")
 
-            if occ > occ_min and occ < occ_max and gain > gain_min and gain:
-                print(f"reached occupancy of {occ} at {laser_val} laser tune value and gain of {round(gain,2)} at {HV_val} V.")
-                break
-            if iters >= iterations:
-                print(f"WARNING: could not reach desired tuning values within {iterations} iterations. Aborting tuning!")
-                print(f"reached occupancy of {occ} at {laser_val} laser tune value and gain of {round(gain,2)} at {HV_val} V.")
-
-    if tune_mode == "none":
-
-        dataset = Picoscope.Instance().block_measurement(nr_waveforms)
-        gain, _ = dataset.calculate_gain(signal_threshold=signal_threshold)
-        occ     = dataset.calculate_occ(signal_threshold=signal_threshold)
-        print(f"\nwill not tune gain and occupancy. measured:\nocc:\t{occ}\ngain:\t{round(gain,2)}")
-
-    if tune_mode not in ["none", "iter", "single", "only_gain", "only_occ"]:
+        if tune_mode not in ["none", "iter", "single", "only_gain", "only_occ"]:
 
-        dataset = Picoscope.Instance().block_measurement(nr_waveforms)
-        gain, _ = dataset.calculate_gain(signal_threshold=signal_threshold)
-        occ     = dataset.calculate_occ(signal_threshold=signal_threshold)
-        print(f"WARNING: Can not make sense of tuning mode. Will proceed without tuning. measured:\nocc:\t{occ}\ngain:\t{round(gain,2)}")
+            dataset = Picoscope.Instance().block_measurement(nr_waveforms)
+            gain, _ = dataset.calculate_gain(signal_threshold=signal_threshold)
+            occ     = dataset.calculate_occ(signal_threshold=signal_threshold)
+            print(f"WARNING: Can not make sense of tuning mode. Will proceed without tuning. measured:\nocc:\t{occ}\ngain:\t{round(gain,2)}")
 
     end_time = time.time()
     print(f"Total time for tuning: {round((end_time - start_time) / 60, 0)} minutes")
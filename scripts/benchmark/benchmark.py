@@ -0,0 +1,389 @@
+#!/usr/bin/python3
+
+# benchmarks of the analysis and storage hot paths at the scale of real measurements, on synthetic data
+# of the simulated Picoscope (devices/sim_picoscope.py):
+#   block: 100k x 350 sample block captures (measure_metadict, write_to_file, read_from_file, plots)
+#   dcs:   10000 x 10000 sample dark count captures (get_darkcounts, write_to_file, read_from_file)
+#   pcs:   photocathode scan file of 35 phi x 21 theta = 735 points (load_metadicts, recalculate_metadicts, plots)
+#
+# every case runs in a fresh process, so its peak RSS is not inflated by the other cases. the peak RSS is taken
+# over the timed call (including the data prepared for it, see "rss before").
+# results (wall time, peak RSS, throughput) are written as json, --compare prints the change to an earlier run:
+#
+#   python scripts/benchmark/benchmark.py -o before.json
+#   python scripts/benchmark/benchmark.py -o after.json --compare before.json
+#
+# --scale reduces the nr of waveforms of all workloads (e.g. 0.1 for a quick run), the nr of PCS points stays
+# --check compares the metadicts recalculated from the streamed data (in small chunks) with the ones of the
+# loaded data, within CHECK_TOLERANCE
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+OMCU_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "omcu")
+sys.path.insert(0, OMCU_PATH)
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+
+BLOCK_WAVEFORMS = 100000
+DCS_WAVEFORMS   = 10000
+DCS_SAMPLES     = 10000
+PCS_PHI_LIST    = np.arange(0, 350, 10)
+PCS_THETA_LIST  = np.arange(0, 105, 5)
+THRESHOLD       = -3.5
+SEED            = 1
+
+# tolerance of --check: the histogram fits are identical for any chunking, the baseline (running mean and variance)
+# differs by floating point rounding, which can flip the last digit of the metadict values (rounded to 3 decimals)
+CHECK_TOLERANCE = 1e-3
+CHECK_CHUNK     = 700     # nr of waveforms per chunk of the streamed analysis (the scan file is stored filtered, ~10 % of the waveforms)
+
+##########################################################################################
+
+
+def setup_config():
+    import config
+    config.PICOSCOPE_SIM_REALTIME = False
+    config.PICOSCOPE_SIM_SEED     = SEED
+    config.ANALYSIS_SHOW_PLOTS    = False
+    return config
+
+
+def picoscope():
+    from devices.Picoscope import Picoscope
+    if not Picoscope._instance: Picoscope(backend="simulation")
+    return Picoscope.Instance()
+
+
+def block_capture(nr_waveforms, occupancy=0.1):
+    backend = picoscope().backend
+    backend.occupancy = occupancy
+    dataset = picoscope().block_measurement(nr_waveforms)
+    dataset.setFilename("block.hdf5")
+    dataset.setHDF5_key("block")
+    return dataset
+
+
+def dcs_capture(nr_waveforms, nr_samples):
+    dataset = picoscope().get_datastream(nr_samples, nr_waveforms)
+    dataset.setFilename("data_dark_count.hdf5")
+    dataset.setHDF5_key("dcs")
+    return dataset
+
+
+def snapshot(phi=0, theta=0):
+    # device states of the metadict, as utils.Snapshot would read them
+    return {"time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "theta [°]": theta, "phi [°]": phi, "Dy10 [V]": 87.0,
+            "Powermeter [pW]": 1830.0, "Laser satus": 1, "Laser temp [°C]": 27.5, "Laser tune [%]": 71.0, "Laser pulse freq [Hz]": 10000.0}
+
+
+def prepare(workdir, scale):
+
+    # files read by the benchmarks, written once per run
+
+    import h5py
+    config = setup_config()
+    block_waveforms = int(BLOCK_WAVEFORMS * scale)
+    dcs_waveforms   = int(DCS_WAVEFORMS * scale)
+
+    print(f"preparing block file ({block_waveforms} waveforms)")
+    dataset = block_capture(block_waveforms)
+    dataset.setFilepath(workdir)
+    dataset.measure_metadict(THRESHOLD, snapshot=snapshot())
+    dataset.write_to_file()
+
+    print(f"preparing dark count file ({dcs_waveforms} x {DCS_SAMPLES} samples)")
+    dataset = dcs_capture(dcs_waveforms, DCS_SAMPLES)
+    dataset.setFilepath(workdir)
+    dataset.measure_metadict(THRESHOLD, snapshot=snapshot())
+    dataset.write_to_file()
+    del dataset
+
+    # one capture per theta (occupancy falls with theta), stored filtered for every phi like the photocathode scan
+    print(f"preparing photocathode scan file ({len(PCS_PHI_LIST) * len(PCS_THETA_LIST)} points of {block_waveforms} waveforms)")
+    with h5py.File(os.path.join(workdir, config.PCS_DATAFILE), "w") as h5:
+        for theta in PCS_THETA_LIST:
+            occupancy = 0.1 * max(np.cos(np.radians(theta)), 0)**0.5
+            dataset = block_capture(block_waveforms, occupancy=max(occupancy, 1e-4))
+            dataset.measure_metadict(THRESHOLD, snapshot=snapshot(theta=theta))
+            dataset.filter_by_threshold(THRESHOLD)
+            for phi in PCS_PHI_LIST:
+                dataset.metadict["phi [°]"] = phi
+                dataset.setHDF5_key(f"theta {theta}/phi {phi}")
+                dataset.write_to_file(hdf5_connection=h5)
+
+##########################################################################################
+
+# cases: name -> (setup(workdir, scale) -> state, run(state), nr of items, unit of the items)
+# only run() is timed
+
+
+def _block_setup(workdir, scale):
+    dataset = block_capture(int(BLOCK_WAVEFORMS * scale))
+    dataset.setFilepath(workdir)
+    return dataset
+
+def _block_analysed_setup(workdir, scale):
+    dataset = _block_setup(workdir, scale)
+    dataset.measure_metadict(THRESHOLD, snapshot=snapshot())
+    return dataset
+
+def _block_write(raw_adc):
+    def run(dataset):
+        dataset.setFilename(f"block_write_{os.getpid()}.hdf5")
+        dataset.write_to_file(raw_adc=raw_adc)
+    return run
+
+def _block_read_setup(workdir, scale):
+    from utils.Measurement import Measurement
+    return Measurement(filename="block.hdf5", filepath=workdir, hdf5_key="block")
+
+def _block_plots(dataset):
+    dataset.plot_hist("amplitude")
+    dataset.plot_hist("charge")
+    dataset.plot_transit_times()
+
+def _dcs_setup(workdir, scale):
+    dataset = dcs_capture(int(DCS_WAVEFORMS * scale), DCS_SAMPLES)
+    dataset.setFilepath(workdir)
+    return dataset
+
+def _dcs_analysed_setup(workdir, scale):
+    dataset = _dcs_setup(workdir, scale)
+    dataset.measure_metadict(THRESHOLD, snapshot=snapshot())
+    return dataset
+
+def _dcs_write(dataset):
+    dataset.setFilename(f"dcs_write_{os.getpid()}.hdf5")
+    dataset.write_to_file()
+
+def _dcs_read_setup(workdir, scale):
+    from utils.Measurement import DCS_Measurement
+    return DCS_Measurement(filename="data_dark_count.hdf5", filepath=workdir, hdf5_key="dcs")
+
+def _pcs_setup(workdir, scale):
+    import config
+    from utils.DataHandler import DataHandler
+    return DataHandler(config.PCS_DATAFILE, workdir)
+
+def _pcs_plots_setup(workdir, scale):
+    from utils.DataAnalysis import DataAnalysis
+    return DataAnalysis(workdir)
+
+
+def cases(scale):
+    block = int(BLOCK_WAVEFORMS * scale)
+    dcs   = int(DCS_WAVEFORMS * scale)
+    pcs   = len(PCS_PHI_LIST) * len(PCS_THETA_LIST)
+    return {
+        "block.measure_metadict":       (_block_setup,          lambda d: d.measure_metadict(THRESHOLD, only_waveform_characteristics=True), block, "waveforms"),
+        "block.write_to_file":          (_block_analysed_setup, _block_write(raw_adc=False),                                                block, "waveforms"),
+        "block.write_to_file[raw adc]": (_block_analysed_setup, _block_write(raw_adc=True),                                                 block, "waveforms"),
+        "block.read_from_file":         (_block_read_setup,     lambda d: d.read_from_file(),                                               block, "waveforms"),
+        "block.plots":                  (_block_analysed_setup, _block_plots,                                                               block, "waveforms"),
+        "dcs.get_darkcounts":           (_dcs_setup,            lambda d: d.get_darkcounts(THRESHOLD),                                      dcs,   "waveforms"),
+        "dcs.write_to_file":            (_dcs_analysed_setup,   _dcs_write,                                                                 dcs,   "waveforms"),
+        "dcs.read_from_file":           (_dcs_read_setup,       lambda d: d.read_from_file(),                                               dcs,   "waveforms"),
+        "pcs.load_metadicts":           (_pcs_setup,            lambda d: d.load_metadicts(),                                               pcs,   "points"),
+        "pcs.recalculate_metadicts":    (_pcs_setup,            lambda d: d.recalculate_metadicts(),                                        pcs,   "points"),
+        "pcs.plots":                    (_pcs_plots_setup,      lambda d: d.analyze_PCS(),                                                  pcs,   "points"),
+        }
+
+##########################################################################################
+
+
+def check_consistency(workdir):
+
+    # recalculates the metadicts of the photocathode scan file streamed in chunks of CHECK_CHUNK waveforms and compares
+    # them to the metadicts measured on the loaded data (measure_metadict). returns the nr of values differing by more
+    # than CHECK_TOLERANCE
+
+    config = setup_config()
+    from utils.DataHandler import DataHandler
+    from utils.Statistics import WaveformStatistics
+
+    config.ANALYSIS_CHUNK_SIZE = CHECK_CHUNK
+    streamed = DataHandler(config.PCS_DATAFILE, workdir)
+    streamed.recalculate_metadicts()
+
+    loaded = DataHandler(config.PCS_DATAFILE, workdir)
+    for data in loaded.measurements:
+        # one point after the other, all points do not fit in memory
+        data.read_from_file()
+        data.measure_metadict(data.metadict["sgnl threshold [mV]"], only_waveform_characteristics=True)
+        data.clear()
+
+    keys = WaveformStatistics(THRESHOLD).finalize().keys()
+    failures = 0
+    largest  = 0.
+    for chunked, in_memory in zip(streamed.measurements, loaded.measurements):
+        for key in keys:
+            difference = abs(chunked.metadict[key] - in_memory.metadict[key])
+            largest = max(largest, difference)
+            if difference > CHECK_TOLERANCE:
+                failures += 1
+                print(f"{in_memory.hdf5_key} {key}: streamed {chunked.metadict[key]} loaded {in_memory.metadict[key]}")
+
+    print(f"streamed and loaded metadicts of {len(loaded.measurements)} points: largest difference {largest:.3g}, "
+          f"{failures} values outside of {CHECK_TOLERANCE}")
+    return failures
+
+
+def _status_mb(field):
+    # VmRSS (current) or VmHWM (peak) resident set size of this process
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith(field + ":"): return int(line.split()[1]) / 2**10
+    return None
+
+def _reset_peak_rss():
+    # the peak of the timed section only, not of the setup (linux >= 4.0). ru_maxrss can not be reset
+    try:
+        with open("/proc/self/clear_refs", "w") as file: file.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    return _status_mb("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10   # kB on linux
+
+def _run_case(name, workdir, scale, connection):
+    try:
+        setup_config()
+        setup, run, items, unit = cases(scale)[name]
+        state = setup(workdir, scale)
+        rss_before = _status_mb("VmRSS")
+        _reset_peak_rss()
+        start = time.perf_counter()
+        run(state)
+        wall_time = time.perf_counter() - start
+        connection.send({"wall time [s]": wall_time, "rss before [MB]": rss_before, "peak rss [MB]": _peak_rss_mb()})
+    except Exception as error:
+        connection.send({"error": repr(error)})
+    finally:
+        connection.close()
+
+
+def run_case(name, workdir, scale, repeat):
+
+    # runs the case repeat times, each in a fresh process. reports the fastest run
+
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_case, args=(name, workdir, scale, sender))
+        process.start()
+        sender.close()
+        result = receiver.recv() if receiver.poll(None) else {"error": "no result"}
+        process.join()
+        if "error" in result: return {"name": name, **result}
+        runs.append(result)
+
+    _, _, items, unit = cases(scale)[name]
+    best = min(runs, key=lambda result: result["wall time [s]"])
+    return {"name":              name,
+            "items":             items,
+            "unit":              unit,
+            "wall time [s]":     best["wall time [s]"],
+            "wall times [s]":    [result["wall time [s]"] for result in runs],
+            "peak rss [MB]":     max(result["peak rss [MB]"] for result in runs),
+            "rss before [MB]":   best["rss before [MB]"],
+            "throughput":        items / best["wall time [s]"] if best["wall time [s]"] > 0 else None,
+            "throughput unit":   f"{unit}/s"}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=OMCU_PATH, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, reference_file, scale):
+
+    with open(reference_file) as file:
+        reference = json.load(file)
+
+    print(f"\ncompared to {reference_file} (commit {reference['commit']}):")
+    if reference["scale"] != scale:
+        print(f"WARNING: {reference_file} was run with --scale {reference['scale']}, the workloads differ")
+    reference = {result["name"]: result for result in reference["results"] if "error" not in result}
+    print(f"{'case':32s} {'wall time [s]':>22s} {'peak rss [MB]':>22s}")
+    for result in results:
+        old = reference.get(result["name"])
+        if not old or "error" in result: continue
+        print(f"{result['name']:32s} {old['wall time [s]']:9.3f} -> {result['wall time [s]']:9.3f} "
+              f"{old['peak rss [MB]']:9.0f} -> {result['peak rss [MB]']:9.0f}   (x{old['wall time [s]'] / result['wall time [s]']:.2f} faster)")
+
+
+##########################################################################################
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the OMCU analysis and storage on synthetic data.")
+    parser.add_argument('-o', '--output', help="json file of the results (default: benchmark-<commit>-<date>.json)", action="store")
+    parser.add_argument('--only', nargs="+", help="cases (or prefixes like 'dcs') to run", action="store")
+    parser.add_argument('--scale', type=float, default=1.0, help="factor on the nr of waveforms of all workloads", action="store")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case, the fastest is reported", action="store")
+    parser.add_argument('--workdir', help="directory of the synthetic files (default: temporary). existing files are reused", action="store")
+    parser.add_argument('--compare', help="earlier result file to compare to", action="store")
+    parser.add_argument('--list', help="lists the cases", action="store_true")
+    parser.add_argument('--check', help="only compares the streamed and the in-memory analysis", action="store_true")
+    args = parser.parse_args()
+
+    names = list(cases(args.scale))
+    if args.list:
+        print("\n".join(names))
+        sys.exit(0)
+    if args.only:
+        names = [name for name in names if any(name == only or name.startswith(only + ".") for only in args.only)]
+
+    workdir = args.workdir if args.workdir else tempfile.mkdtemp(prefix="omcu-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        import config
+        if not os.path.exists(os.path.join(workdir, config.PCS_DATAFILE)):
+            prepare(workdir, args.scale)
+
+        if args.check:
+            sys.exit(1 if check_consistency(workdir) else 0)
+
+        results = []
+        for name in names:
+            result = run_case(name, workdir, args.scale, args.repeat)
+            results.append(result)
+            if "error" in result:
+                print(f"{name:32s} FAILED: {result['error']}")
+            else:
+                print(f"{name:32s} {result['wall time [s]']:9.3f} s {result['peak rss [MB]']:8.0f} MB peak "
+                      f"{result['throughput']:12.0f} {result['throughput unit']}")
+    finally:
+        if not args.workdir: shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = git_commit()
+    output = args.output if args.output else f"benchmark-{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as file:
+        json.dump({"commit":   commit,
+                   "date":     datetime.now().isoformat(timespec="seconds"),
+                   "host":     platform.node(),
+                   "python":   platform.python_version(),
+                   "numpy":    np.__version__,
+                   "cpus":     os.cpu_count(),
+                   "scale":    args.scale,
+                   "results":  results}, file, indent=1)
+    print(f"\nresults written to {output}")
+
+    if args.compare: compare(results, args.compare, args.scale)